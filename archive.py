@@ -0,0 +1,210 @@
+import itertools
+import os
+import sys
+from contextlib import contextmanager
+import database
+from database import connection
+
+# Cold storage for old ledger rows. The archive job moves transactions older
+# than ARCHIVE_AFTER_DAYS out of bank.db into one SQLite file per month
+# (archive/transactions_YYYY_MM.db), a bounded batch per transaction.
+# archive_months records which files exist and the id range they hold, and
+# archived_accounts keeps per-account totals plus the last archived balance,
+# so most queries never have to open an archive at all. Readers ATTACH only
+# the months their range needs and UNION ALL them with the hot table.
+# With sharded storage every shard archives its own rows into its own files.
+
+ARCHIVE_DIR = "archive"
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_BATCH_SIZE = 5000
+# SQLite allows 10 attached databases by default; keep one spare.
+MAX_ATTACHED = 9
+COLUMNS = "id, account_number, name, transaction_type, amount, timestamp, balance_after"
+
+_aliases = itertools.count()
+
+# HELPER FUNCTIONS
+
+def month_file(month, shard=0):
+    prefix = f"shard{shard}_" if database.is_sharded() else ""
+    return f"{prefix}transactions_{month.replace('-', '_')}.db"
+
+def _resolve(name):
+    # Archive files live next to the database they were moved out of.
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), ARCHIVE_DIR, name)
+
+@contextmanager
+def attached(conn, files):
+    # Must be entered outside a transaction; aliases are unique so nested
+    # readers on the same pooled connection never collide.
+    schemas = []
+    try:
+        for name in files:
+            schema = f"archive_{next(_aliases)}"
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (_resolve(name),))
+            schemas.append(schema)
+        yield schemas
+    finally:
+        # DETACH is refused inside a transaction; one still open here was
+        # started against the archives and failed part-way.
+        if conn.in_transaction:
+            conn.rollback()
+        for schema in schemas:
+            conn.execute(f"DETACH DATABASE {schema}")
+
+def files_for(cursor, start=None, end=None, after_id=None, account_number=None):
+    # Archive files that can hold rows in [start, end] or after `after_id`,
+    # oldest first. Accounts that were never archived need none.
+    if account_number is not None:
+        cursor.execute("SELECT 1 FROM archived_accounts WHERE account_number = ?", (account_number,))
+        if not cursor.fetchone():
+            return []
+    conditions, params = [], []
+    if start:
+        conditions.append("month >= substr(?, 1, 7)")
+        params.append(start)
+    if end:
+        conditions.append("month <= substr(?, 1, 7)")
+        params.append(end)
+    if after_id is not None:
+        conditions.append("last_id > ?")
+        params.append(after_id)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT path FROM archive_months{where} ORDER BY month", params)
+    return [row[0] for row in cursor.fetchall()]
+
+def iter_rows(conn, columns, where, params, files, order, batch_size, descending=False, hot=True):
+    # Streams matching rows from `files` (at most MAX_ATTACHED per query) and
+    # the hot table. Archives only ever hold rows older than the hot table and
+    # files are month-ordered, so the concatenation keeps `order`, which must
+    # name result columns.
+    groups = [files[i:i + MAX_ATTACHED] for i in range(0, len(files), MAX_ATTACHED)]
+    # A reporting snapshot still holds rows in its hot table that a later
+    # archive run copied into the (live) archive files; read those once.
+    archived = f"({where}) AND id NOT IN (SELECT id FROM main.transactions)" if database.snapshot_directory() else where
+    if hot:
+        groups.append([])
+    if descending:
+        groups.reverse()
+    for group in groups:
+        with attached(conn, group) as schemas:
+            tables = [f"{schema}.transactions" for schema in schemas] or ["main.transactions"]
+            sql = " UNION ALL ".join(f"SELECT {columns} FROM {table} WHERE {archived if schemas else where}" for table in tables)
+            cursor = conn.cursor()
+            try:
+                cursor.execute(f"{sql} ORDER BY {order}", list(params) * len(tables))
+                rows = cursor.fetchmany(batch_size)
+                while rows:
+                    yield from rows
+                    rows = cursor.fetchmany(batch_size)
+            finally:
+                cursor.close()
+
+def balance_before(conn, account_number, bound):
+    # (balance_after, id) of the account's last archived row before `bound`,
+    # for when the hot table has none.
+    cursor = conn.cursor()
+    cursor.execute("SELECT last_balance, last_id, last_timestamp FROM archived_accounts WHERE account_number = ?", (account_number,))
+    row = cursor.fetchone()
+    if not row:
+        return 0.0, 0
+    if row[2] < bound:
+        return row[0], row[1]
+    for name in reversed(files_for(cursor, end=bound)):
+        with attached(conn, [name]) as (schema,):
+            cursor.execute(f"SELECT balance_after, id FROM {schema}.transactions WHERE account_number = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+                           (account_number, bound))
+            found = cursor.fetchone()
+        if found:
+            return found[0], found[1]
+    return 0.0, 0
+
+def _prepare(cursor, schema):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {schema}.transactions (id INTEGER PRIMARY KEY, account_number INTEGER, name TEXT, transaction_type TEXT, amount REAL, timestamp DATETIME, balance_after REAL)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_account_id ON transactions (account_number, id)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_account_timestamp ON transactions (account_number, timestamp)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_transactions_timestamp ON transactions (timestamp)")
+
+# ARCHIVE JOB
+
+def archive_transactions(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE, progress=None):
+    moved, months = 0, set()
+    for shard in range(database.shard_count()):
+        with connection(shard=shard) as conn:
+            cursor = conn.cursor()
+            try:
+                os.makedirs(_resolve(""), exist_ok=True)
+                cursor.execute("SELECT date('now', '+330 minutes', ?)", (f"-{days} days",))
+                cutoff = cursor.fetchone()[0]
+                moved += _archive_shard(conn, shard, cutoff, batch_size, months, moved, progress)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                return False, str(e)
+    if not moved:
+        return True, f"No transactions older than {cutoff} to archive."
+    return True, f"Archived {moved} transactions older than {cutoff} into {len(months)} monthly files."
+
+def _archive_shard(conn, shard, cutoff, batch_size, months, moved_before, progress):
+    cursor = conn.cursor()
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+    moved = 0
+    while True:
+        cursor.execute("SELECT substr(timestamp, 1, 7), date(substr(timestamp, 1, 7) || '-01', '+1 month') FROM transactions WHERE timestamp < ? ORDER BY timestamp LIMIT 1",
+                       (cutoff,))
+        row = cursor.fetchone()
+        if not row:
+            break
+        month, upper = row[0], min(row[1], cutoff)
+        name = month_file(month, shard)
+
+        with attached(conn, [name]) as (schema,):
+            _prepare(cursor, schema)
+            # Copy first and commit the archive, then delete from the hot
+            # table. Attached WAL databases do not commit atomically as a
+            # set, so a crash in between leaves rows in both places, and
+            # the next run re-copies them harmlessly (INSERT OR IGNORE).
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("DELETE FROM temp.archive_batch")
+            cursor.execute("INSERT INTO temp.archive_batch SELECT id FROM main.transactions WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+                           (upper, batch_size))
+            count = cursor.rowcount
+            cursor.execute(f"INSERT OR IGNORE INTO {schema}.transactions ({COLUMNS}) SELECT {COLUMNS} FROM main.transactions WHERE id IN (SELECT id FROM temp.archive_batch)")
+            conn.commit()
+
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute(f"""
+                INSERT INTO archived_accounts (account_number, credits, debits, rows, last_id, last_timestamp, last_balance)
+                SELECT account_number,
+                       SUM(CASE WHEN transaction_type IN {database.DEBIT_TYPES} THEN 0 ELSE amount END),
+                       SUM(CASE WHEN transaction_type IN {database.DEBIT_TYPES} THEN amount ELSE 0 END),
+                       COUNT(*), MAX(id), timestamp, balance_after
+                FROM main.transactions WHERE id IN (SELECT id FROM temp.archive_batch) GROUP BY account_number
+                ON CONFLICT(account_number) DO UPDATE SET credits = credits + excluded.credits, debits = debits + excluded.debits,
+                    rows = rows + excluded.rows, last_id = excluded.last_id, last_timestamp = excluded.last_timestamp, last_balance = excluded.last_balance
+            """)
+            cursor.execute("""
+                INSERT INTO archive_months (month, path, rows, first_id, last_id, archived_at)
+                SELECT ?, ?, COUNT(*), MIN(id), MAX(id), datetime('now', '+330 minutes') FROM temp.archive_batch WHERE true
+                ON CONFLICT(month) DO UPDATE SET rows = rows + excluded.rows, first_id = min(first_id, excluded.first_id),
+                    last_id = max(last_id, excluded.last_id), archived_at = excluded.archived_at
+            """, (month, name))
+            cursor.execute("DELETE FROM main.transactions WHERE id IN (SELECT id FROM temp.archive_batch)")
+            conn.commit()
+
+        moved += count
+        months.add(name)
+        if progress:
+            progress(moved_before + moved)
+    return moved
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Move old transactions into monthly archive databases.")
+    parser.add_argument("--days", type=int, default=ARCHIVE_AFTER_DAYS, help="archive transactions older than this many days")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    database.init_db()
+    success, msg = archive_transactions(args.days, args.batch_size)
+    print(msg)
+    sys.exit(0 if success else 1)
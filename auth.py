@@ -1,31 +1,98 @@
 import sqlite3
-import random
-from database import get_connection
+import database
+from database import connection
+import operations
+
+# Account numbers are the 6-digit range ACCOUNT_MIN .. ACCOUNT_MIN + ACCOUNT_SPACE - 1.
+# Each new account takes the next value of a persisted sequence and maps it
+# through a keyed Feistel permutation, so numbers look random but never
+# repeat and allocation costs the same whether the space is empty or full.
+ACCOUNT_MIN = 100000
+ACCOUNT_SPACE = 900000
+FEISTEL_HALF_BITS = 10
+FEISTEL_ROUNDS = 4
+
+def _feistel(value, key):
+    mask = (1 << FEISTEL_HALF_BITS) - 1
+    left, right = value >> FEISTEL_HALF_BITS, value & mask
+    for i in range(FEISTEL_ROUNDS):
+        f = (right * 0x5BD1E995) ^ ((key >> (8 * i)) & 0xFFFF)
+        left, right = right, left ^ ((f ^ (f >> 13)) & mask)
+    return (left << FEISTEL_HALF_BITS) | right
+
+def account_number_for(index, key):
+    # Cycle-walking keeps the 20-bit permutation inside the account space;
+    # on average it takes fewer than 1.2 rounds of the cipher.
+    value = _feistel(index, key)
+    while value >= ACCOUNT_SPACE:
+        value = _feistel(value, key)
+    return ACCOUNT_MIN + value
+
+def _reserve(cursor, count):
+    cursor.execute("UPDATE account_sequence SET next_value = next_value + ? WHERE id = 1 AND next_value + ? <= ? RETURNING next_value, key", 
+                   (count, count, ACCOUNT_SPACE))
+    row = cursor.fetchone()
+    if not row:
+        raise RuntimeError("Account number space exhausted.")
+    end, key = row
+    return [account_number_for(index, key) for index in range(end - count, end)]
+
+def _by_shard(numbers):
+    groups = {}
+    for number in numbers:
+        groups.setdefault(database.shard_for(number), []).append(number)
+    return groups
+
+def _taken(numbers):
+    # Numbers handed out by the old random allocator may collide once.
+    taken = set()
+    for shard, numbers in _by_shard(numbers).items():
+        with connection(shard=shard) as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(numbers), 500):
+                chunk = numbers[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                cursor.execute(f"SELECT account_number FROM users WHERE account_number IN ({placeholders}) "
+                               f"UNION ALL SELECT account_number FROM deleted_users WHERE account_number IN ({placeholders})", chunk + chunk)
+                taken.update(row[0] for row in cursor.fetchall())
+    return taken
+
+def _allocate(cursor, count):
+    numbers = []
+    while len(numbers) < count:
+        candidates = _reserve(cursor, count - len(numbers))
+        taken = _taken(candidates)
+        numbers.extend(n for n in candidates if n not in taken)
+    return numbers
+
+def create_accounts(customers):
+    # customers: iterable of (name, pin); all accounts commit together.
+    customers = list(customers)
+    if not customers:
+        return []
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        numbers = _allocate(cursor, len(customers))
+        pins = dict(zip(numbers, customers))
+        # Sharded accounts commit in their shards before the sequence does; if
+        # the sequence commit is lost, _taken() skips the numbers next time.
+        for shard, shard_numbers in _by_shard(numbers).items():
+            with connection(shard=shard) as shard_conn:
+                shard_conn.executemany("INSERT INTO users (account_number, name, pin, balance) VALUES (?, ?, ?, 0.0)", 
+                                       [(acc_num, *pins[acc_num]) for acc_num in shard_numbers])
+                if shard_conn is not conn:
+                    shard_conn.commit()
+        conn.commit()
+    return numbers
 
 def create_account(name, pin):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    while True:
-        acc_num = random.randint(100000, 999999)
-        try:
-            cursor.execute("INSERT INTO users (account_number, name, pin, balance) VALUES (?, ?, ?, 0.0)", 
-                           (acc_num, name, pin))
-            conn.commit()
-            conn.close()
-            return acc_num
-        except sqlite3.IntegrityError:
-            continue
+    return create_accounts([(name, pin)])[0]
 
 def login(account_number, pin):
-    conn = get_connection()
-    cursor = conn.cursor()
+    user = operations.get_account(account_number)
     
-    cursor.execute("SELECT * FROM users WHERE account_number = ? AND pin = ?", (account_number, pin))
-    user = cursor.fetchone()
-    conn.close()
-    
-    if user:
+    if user and str(user[2]) == str(pin):
         return {
             "account_number": user[0],
             "name": user[1],
@@ -35,11 +102,10 @@ def login(account_number, pin):
     return None
 
 def admin_login(username, password):
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM admins WHERE username = ? AND password = ?", (username, password))
-    admin = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM admins WHERE username = ? AND password = ?", (username, password))
+        admin = cursor.fetchone()
     
-    return admin is not None
\ No newline at end of file
+    return admin is not None
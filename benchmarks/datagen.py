@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import summaries
+
+# Synthetic bank.db generator. Balances are derived from the generated
+# ledger, so every account reconciles against its transactions.
+
+FIRST_ACCOUNT = 100000
+BATCH_SIZE = 50000
+NAMES = ["Aarav", "Vivaan", "Aditya", "Diya", "Ananya", "Ishaan", "Kavya", "Rohan", "Saanvi", "Arjun",
+         "Meera", "Kabir", "Priya", "Vihaan", "Anika", "Reyansh", "Tara", "Advik", "Nisha", "Dev"]
+SURNAMES = ["Sharma", "Verma", "Gupta", "Iyer", "Nair", "Reddy", "Patel", "Singh", "Das", "Mehta"]
+
+def _open_fast(path):
+    # Durability does not matter while generating, so skip journaling.
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -256000")
+    return conn
+
+def _names(rnd, accounts):
+    return [f"{rnd.choice(NAMES)} {rnd.choice(SURNAMES)}" for _ in range(accounts)]
+
+def _ledger(rnd, accounts, names, balances, transactions, days):
+    start = time.time() - days * 86400
+    step = days * 86400 / max(transactions, 1)
+    random = rnd.random
+    written = 0
+    last_second, when = None, None
+    while written < transactions:
+        second = int(start + step * written)
+        if second != last_second:
+            last_second, when = second, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        acc = int(random() * accounts)
+        amount = float(int(random() * 500) + 1) * 10
+        roll = random()
+        if roll < 0.45 or balances[acc] < amount:
+            balances[acc] += amount
+            yield (FIRST_ACCOUNT + acc, names[acc], "DEPOSIT", amount, when, balances[acc])
+            written += 1
+        elif roll < 0.75 or accounts < 2:
+            balances[acc] -= amount
+            yield (FIRST_ACCOUNT + acc, names[acc], "WITHDRAWAL", amount, when, balances[acc])
+            written += 1
+        else:
+            other = int(random() * (accounts - 1))
+            other += other >= acc
+            balances[acc] -= amount
+            balances[other] += amount
+            yield (FIRST_ACCOUNT + acc, names[acc], "TRANSFER_SENT", amount, when, balances[acc])
+            yield (FIRST_ACCOUNT + other, names[other], "TRANSFER_RECEIVED", amount, when, balances[other])
+            written += 2
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def generate(path, accounts, transactions, seed=42, days=365, complaints=0, progress=None):
+    if os.path.exists(path):
+        raise FileExistsError(f"{path} already exists")
+    rnd = random.Random(seed)
+    conn = _open_fast(path)
+    database.migrate(conn)
+    # Bulk load without secondary indexes and rebuild them afterwards.
+    indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL").fetchall()
+    for name, _ in indexes:
+        conn.execute(f"DROP INDEX {name}")
+    names = _names(rnd, accounts)
+    balances = array("d", bytes(8 * accounts))
+
+    done = 0
+    for batch in _batched(_ledger(rnd, accounts, names, balances, transactions, days), BATCH_SIZE):
+        conn.executemany("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) VALUES (?, ?, ?, ?, ?, ?)", 
+                         batch)
+        done += len(batch)
+        if progress:
+            progress("transactions", done, transactions)
+
+    users = ((FIRST_ACCOUNT + i, names[i], rnd.randint(1000, 9999), balances[i]) for i in range(accounts))
+    done = 0
+    for batch in _batched(users, BATCH_SIZE):
+        conn.executemany("INSERT INTO users (account_number, name, pin, balance) VALUES (?, ?, ?, ?)", batch)
+        done += len(batch)
+        if progress:
+            progress("accounts", done, accounts)
+
+    now = time.strftime("%Y-%m-%d %H:%M:%S")
+    for batch in _batched(((FIRST_ACCOUNT + rnd.randrange(accounts), f"Synthetic complaint {i}", now) for i in range(complaints)), BATCH_SIZE):
+        conn.executemany("INSERT INTO complaints (account_number, name, message, timestamp) SELECT ?, name, ?, ? FROM users WHERE account_number = ?", 
+                         [(acc, msg, ts, acc) for acc, msg, ts in batch])
+    for _, sql in indexes:
+        conn.execute(sql)
+    summaries.rebuild(conn.cursor())
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    # Leave the file in the mode the application opens it in.
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic bank database.")
+    parser.add_argument("path")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--complaints", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365, help="history spread over this many days")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    def report(stage, done, total):
+        print(f"\r  {stage}: {done}/{total}", end="\n" if done >= total else "", flush=True)
+
+    start = time.perf_counter()
+    generate(args.path, args.accounts, args.transactions, args.seed, args.days, args.complaints, progress=report)
+    print(f"Generated {args.path} in {time.perf_counter() - start:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import operations
+import rates
+from benchmarks.run import RESULTS_DIR, git_revision
+from benchmarks import datagen
+
+# The interest and fee cycle (rates.py) with NumPy against the per-row loop,
+# plus the flat apply_interest_to_all() loop it replaces. "compute" times the
+# arithmetic alone on balances already in memory; "dry run" and "apply" time
+# whole cycles against copies of one synthetic database, so every variant
+# starts from the same balances.
+
+def _timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def _in_copy(source, workdir, name, fn):
+    # Runs fn() against a fresh copy of the database in its own directory.
+    path = os.path.join(workdir, name, "bank.db")
+    os.makedirs(os.path.dirname(path))
+    shutil.copy(source, path)
+    database.close_all()
+    database.DB_NAME = path
+    database.init_db()
+    try:
+        return fn()
+    finally:
+        database.close_all()
+
+def run(accounts, days):
+    np = rates._numpy()
+    if np is None:
+        raise SystemExit("NumPy is not installed; pip install numpy to compare against it.")
+
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, "source.db")
+        datagen.generate(source, accounts, accounts * 2)
+
+        balances = np.linspace(-500.0, 250000.0, accounts)
+        as_list = balances.tolist()
+        vector_s, vector = _timed(rates.compute_numpy, np, balances, days, True)
+        loop_s, loop = _timed(rates.compute_python, as_list, days, True)
+        results["compute"] = {"numpy_s": vector_s, "python_s": loop_s, "speedup": loop_s / vector_s,
+                              "max_difference": max(float(np.abs(a - np.array(b)).max()) for a, b in zip(vector, loop))}
+
+        for mode, dry_run in (("dry run", True), ("apply", False)):
+            row = {}
+            for engine, vectorized in (("numpy", True), ("python", False)):
+                elapsed, (success, msg) = _in_copy(source, workdir, f"{mode}_{engine}".replace(" ", "_"),
+                                                   lambda: _timed(rates.run_cycle, days, dry_run=dry_run, vectorized=vectorized))
+                if not success:
+                    raise RuntimeError(msg)
+                row[f"{engine}_s"] = elapsed
+            row["speedup"] = row["python_s"] / row["numpy_s"]
+            results[mode] = row
+
+        elapsed, (success, msg) = _in_copy(source, workdir, "flat", lambda: _timed(operations.apply_interest_to_all))
+        if not success:
+            raise RuntimeError(msg)
+        results["flat 5% loop"] = {"elapsed_s": elapsed}
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized interest and fee cycle.")
+    parser.add_argument("--accounts", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--output", help="also save the results as JSON to this file (or 'auto' for benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = run(args.accounts, args.days)
+    for name, r in results.items():
+        if "speedup" in r:
+            print(f"  {name:<14} numpy {r['numpy_s']:>8.3f} s   per-row {r['python_s']:>8.3f} s   speedup {r['speedup']:>6.1f}x")
+        else:
+            print(f"  {name:<14} {r['elapsed_s']:>8.3f} s")
+
+    if args.output:
+        output = args.output
+        if output == "auto":
+            output = os.path.join(RESULTS_DIR, f"rates_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+                       "python": sys.version.split()[0], "accounts": args.accounts, "days": args.days, "results": results}, f, indent=2)
+        print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import auth
+import operations
+from benchmarks import datagen
+
+# Timed scenarios for every public function in operations.py and auth.py,
+# run against a synthetic database. Results go to benchmarks/results/ as
+# JSON so runs can be compared with --compare.
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def measure(fn, iterations):
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        for i in range(iterations):
+            t0 = time.perf_counter()
+            fn(i)
+            latencies.append(time.perf_counter() - t0)
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "total_s": elapsed,
+        "ops_per_s": iterations / elapsed if elapsed else 0.0,
+        "mean_ms": 1000 * elapsed / iterations,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p99_ms": 1000 * percentile(latencies, 99),
+        "max_ms": 1000 * latencies[-1],
+    }
+
+def build_scenarios(accounts, rnd, workdir, iterations):
+    acc = lambda: datagen.FIRST_ACCOUNT + rnd.randrange(accounts)
+    heavy = max(1, iterations // 100)
+    closable = []
+
+    def close_account(i):
+        operations.close_account(closable[i])
+
+    def prepare_close(n):
+        closable.extend(auth.create_account(f"Closing {i}", 1234) for i in range(n))
+
+    scenarios = [
+        ("auth.create_account", lambda i: auth.create_account(f"Bench {i}", 1234), iterations, None),
+        ("auth.login", lambda i: auth.login(acc(), 1234), iterations, None),
+        ("auth.admin_login", lambda i: auth.admin_login("admin", "admin123"), iterations, None),
+        ("operations.get_ist_time", lambda i: operations.get_ist_time(), iterations, None),
+        ("operations.get_user_name", lambda i: operations.get_user_name(acc()), iterations, None),
+        ("operations.get_balance", lambda i: operations.get_balance(acc()), iterations, None),
+        ("operations.check_loan_eligibility", lambda i: operations.check_loan_eligibility(acc()), iterations, None),
+        ("operations.deposit", lambda i: operations.deposit(acc(), 100.0), iterations, None),
+        ("operations.withdraw", lambda i: operations.withdraw(acc(), 50.0), iterations, None),
+        ("operations.transfer_funds", lambda i: operations.transfer_funds(acc(), acc(), 25.0), iterations, None),
+        ("operations.print_history", lambda i: operations.print_history(acc()), iterations, None),
+        ("operations.update_pin", lambda i: operations.update_pin(acc(), 4321), iterations, None),
+        ("operations.submit_complaint", lambda i: operations.submit_complaint(acc(), "Benchmark feedback"), iterations, None),
+        ("operations.close_account", close_account, heavy, prepare_close),
+        ("operations.add_new_admin", lambda i: operations.add_new_admin(f"bench_admin_{i}", "secret"), heavy, None),
+        ("operations.get_all_users", lambda i: operations.get_all_users(), heavy, None),
+        ("operations.get_deleted_users", lambda i: operations.get_deleted_users(), heavy, None),
+        ("operations.get_all_transactions", lambda i: operations.get_all_transactions(), heavy, None),
+        ("operations.get_all_complaints", lambda i: operations.get_all_complaints(), heavy, None),
+        ("operations.apply_interest_to_all", lambda i: operations.apply_interest_to_all(), 1, None),
+        ("operations.export_transactions_csv",
+         lambda i: operations.export_transactions_csv(os.path.join(workdir, f"export_{i}.csv")), 1, None),
+    ]
+    return scenarios
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR)).stdout.strip() or None
+    except OSError:
+        return None
+
+def run(args):
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        source = args.db or os.path.join(workdir, "source.db")
+        if not os.path.exists(source):
+            print(f"Generating {args.accounts} accounts / {args.transactions} transactions...")
+            datagen.generate(source, args.accounts, args.transactions, args.seed, complaints=args.complaints)
+        with sqlite3.connect(source) as conn:
+            accounts = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+        # Work on a copy so a cached --db stays pristine between runs.
+        database.DB_NAME = os.path.join(workdir, "bench.db")
+        shutil.copyfile(source, database.DB_NAME)
+        database.init_db()
+
+        results = {}
+        for name, fn, iterations, prepare in build_scenarios(accounts, rnd, workdir, args.iterations):
+            if args.only and not any(part in name for part in args.only):
+                continue
+            if prepare:
+                prepare(iterations)
+            results[name] = measure(fn, iterations)
+            r = results[name]
+            print(f"  {name:<40} {r['ops_per_s']:>10.1f} ops/s   p50 {r['p50_ms']:>9.3f} ms   p99 {r['p99_ms']:>9.3f} ms")
+        database.close_all()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {"accounts": accounts, "transactions": args.transactions, "iterations": args.iterations, "seed": args.seed},
+        "results": results,
+    }
+
+def compare(report, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nCompared with {baseline_path} (p50 latency, negative is faster):")
+    for name, r in report["results"].items():
+        if name in baseline and baseline[name]["p50_ms"]:
+            change = 100 * (r["p50_ms"] - baseline[name]["p50_ms"]) / baseline[name]["p50_ms"]
+            print(f"  {name:<40} {baseline[name]['p50_ms']:>9.3f} -> {r['p50_ms']:>9.3f} ms  ({change:+.1f}%)")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the bank operation benchmarks.")
+    parser.add_argument("--accounts", type=int, default=10000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--complaints", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=1000, help="calls per point-operation scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="reuse (or create) this generated database instead of a temporary one")
+    parser.add_argument("--only", nargs="*", help="run only scenarios whose name contains one of these")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/bench_<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import RESULTS_DIR, git_revision, percentile
+
+# Wall-clock cost of launching the CLI: start main.py, show the banner and
+# menu, choose Quit. "cold" runs start without a screen cache and with no
+# database, "warm" runs reuse both, which is what scripted launches see.
+# The bare interpreter start is measured as a floor for comparison.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+def launch(cmd, cwd, env, stdin=""):
+    start = time.perf_counter()
+    subprocess.run(cmd, cwd=cwd, env=env, input=stdin, text=True, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "mean_ms": 1000 * sum(samples) / len(samples),
+        "p50_ms": 1000 * percentile(samples, 50),
+        "p95_ms": 1000 * percentile(samples, 95),
+        "min_ms": 1000 * samples[0],
+    }
+
+def run(runs):
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, BANK_CACHE_DIR=os.path.join(workdir, "cache"))
+        env.pop("BANK_METRICS", None)
+
+        results["interpreter"] = summarize([launch([sys.executable, "-c", "pass"], workdir, env) for _ in range(runs)])
+
+        cold = []
+        for i in range(runs):
+            cwd = os.path.join(workdir, f"cold_{i}")
+            os.makedirs(cwd)
+            cold.append(launch([sys.executable, MAIN], cwd, dict(env, BANK_CACHE_DIR=os.path.join(cwd, "cache")), "4\n"))
+        results["cold"] = summarize(cold)
+
+        launch([sys.executable, MAIN], workdir, env, "4\n")
+        results["warm"] = summarize([launch([sys.executable, MAIN], workdir, env, "4\n") for _ in range(runs)])
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure CLI start-up time.")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--output", help="also save the results as JSON to this file (or 'auto' for benchmarks/results/)")
+    args = parser.parse_args(argv)
+
+    results = run(args.runs)
+    for name, r in results.items():
+        print(f"  {name:<12} mean {r['mean_ms']:>8.1f} ms   p50 {r['p50_ms']:>8.1f} ms   p95 {r['p95_ms']:>8.1f} ms   min {r['min_ms']:>8.1f} ms")
+
+    if args.output:
+        output = args.output
+        if output == "auto":
+            output = os.path.join(RESULTS_DIR, f"startup_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump({"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": git_revision(),
+                       "python": sys.version.split()[0], "runs": args.runs, "results": results}, f, indent=2)
+        print(f"\nResults saved to {output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import operations
+
+# Multi-threaded stress run for the posting path.
+# Phase 1 hammers one account with concurrent withdrawals and checks that
+# exactly balance // amount of them succeed. Phase 2 runs random
+# withdrawals and transfers over many accounts and checks that no balance
+# went negative and that balances still match the ledger. With --shards the
+# accounts are spread over shard files, so most transfers cross shards.
+# With --ledger-engine postings go through the in-memory engine instead.
+
+OPENING_BALANCE = 1000.0
+
+def setup_db(path, accounts, opening_balance, shards=0):
+    database.DB_NAME = path
+    database.SHARD_COUNT = shards
+    database.init_db()
+    for shard in range(database.shard_count()):
+        with database.connection(shard=shard) as conn:
+            conn.executemany("INSERT INTO users (account_number, name, pin, balance) VALUES (?, ?, 1234, ?)", 
+                             [(100000 + i, f"Stress {i}", opening_balance) for i in range(accounts) if database.shard_for(100000 + i) == shard])
+            conn.commit()
+
+def run_threads(threads, worker):
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for t in pool: t.start()
+    for t in pool: t.join()
+    return time.perf_counter() - start
+
+def overdraft_race(threads, attempts, amount=10.0, balance=1000.0):
+    with database.connection(100000) as conn:
+        conn.execute("UPDATE users SET balance = ? WHERE account_number = 100000", (balance,))
+        conn.commit()
+    successes = []
+
+    def worker(_):
+        ok = 0
+        for _ in range(attempts):
+            if operations.withdraw(100000, amount)[0]:
+                ok += 1
+        successes.append(ok)
+
+    elapsed = run_threads(threads, worker)
+    expected = int(balance // amount)
+    final = operations.get_balance(100000)
+    calls = threads * attempts
+    print(f"[overdraft race] {threads} threads x {attempts} withdrawals of {amount:.2f} from {balance:.2f}")
+    print(f"  succeeded: {sum(successes)} (expected {expected}), final balance: {final:.2f}, "
+          f"{calls / elapsed:.0f} calls/s")
+    return sum(successes) == expected and final >= 0
+
+def random_postings(threads, ops, accounts, seed):
+    counts = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+
+    def worker(index):
+        rnd = random.Random(seed + index)
+        ok = failed = 0
+        for _ in range(ops):
+            acc = 100000 + rnd.randrange(accounts)
+            amount = float(rnd.randint(1, 500))
+            if rnd.random() < 0.5:
+                success, _ = operations.withdraw(acc, amount)
+            else:
+                success, _ = operations.transfer_funds(acc, 100000 + rnd.randrange(accounts), amount)
+            if success: ok += 1
+            else: failed += 1
+        with lock:
+            counts["ok"] += ok
+            counts["failed"] += failed
+
+    elapsed = run_threads(threads, worker)
+    # Checkpoint the ledger engine (if running) so the checks see every posting.
+    operations.disable_ledger_engine()
+    negatives = mismatched = 0
+    for shard in range(database.shard_count()):
+        with database.connection(shard=shard) as conn:
+            negatives += conn.execute("SELECT COUNT(*) FROM users WHERE balance < 0").fetchone()[0]
+            mismatched += conn.execute(f"""
+                SELECT COUNT(*) FROM users u LEFT JOIN (
+                    SELECT account_number, SUM(CASE WHEN transaction_type IN {database.DEBIT_TYPES} 
+                                                    THEN -amount ELSE amount END) AS net
+                    FROM transactions GROUP BY account_number
+                ) t ON t.account_number = u.account_number
+                WHERE ABS(u.balance - (:opening + COALESCE(t.net, 0))) > 0.005
+            """, {"opening": OPENING_BALANCE}).fetchone()[0]
+    total = threads * ops
+    print(f"[random postings] {threads} threads x {ops} withdrawals/transfers over {accounts} accounts")
+    print(f"  succeeded: {counts['ok']}, rejected: {counts['failed']}, negative balances: {negatives}, "
+          f"ledger mismatches: {mismatched}")
+    print(f"  throughput: {total / elapsed:.0f} postings/s ({elapsed:.2f}s)")
+    return negatives == 0 and mismatched == 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent posting stress test.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=500, help="postings per thread")
+    parser.add_argument("--accounts", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="database file (default: a temporary file)")
+    parser.add_argument("--group-commit", action="store_true", help="route postings through group commit")
+    parser.add_argument("--shards", type=int, default=0, help="spread the accounts over this many shard files")
+    parser.add_argument("--ledger-engine", action="store_true", help="route postings through the in-memory ledger engine")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        setup_db(args.db or os.path.join(tmp, "stress.db"), args.accounts, OPENING_BALANCE, args.shards)
+        if args.group_commit:
+            committers = operations.enable_group_commit()
+        if args.ledger_engine:
+            operations.enable_ledger_engine()
+        passed = overdraft_race(args.threads, args.ops // 5 or 1)
+        operations.disable_ledger_engine()
+        for shard in range(database.shard_count()):
+            with database.connection(shard=shard) as conn:
+                conn.execute("DELETE FROM transactions")
+                conn.execute("UPDATE users SET balance = ?", (OPENING_BALANCE,))
+                conn.commit()
+        if args.ledger_engine:
+            engine = operations.enable_ledger_engine()
+        passed = random_postings(args.threads, args.ops, args.accounts, args.seed) and passed
+        if args.ledger_engine:
+            print(f"[ledger engine] {engine.stats()}")
+        if args.group_commit:
+            for shard, committer in committers.items():
+                print(f"[group commit] shard {shard}: {committer.stats()}")
+            operations.disable_group_commit()
+        database.close_all()
+
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+# Bounded read-through cache of users rows keyed by account_number.
+# Entries expire after TTL seconds and the least recently used entry is
+# evicted once MAX_SIZE is reached. Every write path invalidates the
+# accounts it touched after its commit.
+
+MAX_SIZE = 10000
+TTL_SECONDS = 10.0
+STRIPES = 64
+
+class AccountCache:
+    def __init__(self, maxsize=MAX_SIZE, ttl=TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Invalidation counters per stripe of accounts. A reader notes the
+        # counter before going to the database and its result is only cached
+        # if no invalidation for that stripe happened in between, so a slow
+        # read can never re-insert a balance that was already superseded.
+        self._versions = [0] * STRIPES
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def version(self, account_number):
+        return self._versions[hash(account_number) % STRIPES]
+
+    def get(self, account_number):
+        with self._lock:
+            entry = self._entries.get(account_number)
+            if entry is None:
+                self.misses += 1
+                return None
+            row, expires = entry
+            if expires < time.monotonic():
+                del self._entries[account_number]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(account_number)
+            self.hits += 1
+            return row
+
+    def put(self, account_number, row, version):
+        with self._lock:
+            if self._versions[hash(account_number) % STRIPES] != version:
+                return
+            self._entries[account_number] = (row, time.monotonic() + self.ttl)
+            self._entries.move_to_end(account_number)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, *account_numbers):
+        with self._lock:
+            for account_number in account_numbers:
+                self._versions[hash(account_number) % STRIPES] += 1
+                if self._entries.pop(account_number, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._versions = [v + 1 for v in self._versions]
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+account_cache = AccountCache()
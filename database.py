@@ -1,25 +1,238 @@
 import sqlite3
 import os
+import threading
+import atexit
+from contextlib import contextmanager
 
 DB_NAME = "bank.db"
 
-def get_connection():
-    return sqlite3.connect(DB_NAME)
+# Connection tuning applied to every pooled connection.
+# WAL lets readers run alongside the single writer, NORMAL sync is durable
+# in WAL mode and avoids an fsync on every commit.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,        # ~64 MB page cache
+    "mmap_size": 268435456,      # 256 MB memory-mapped I/O
+    "busy_timeout": 5000,        # ms to wait on a locked database
+    "temp_store": "MEMORY",
+}
 
-def init_db():
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+POOL_SIZE = 8
+
+# Sharded storage (opt-in). With SHARD_COUNT > 1, accounts, their ledger and
+# closed-account records live in SHARD_COUNT files next to DB_NAME
+# (bank_shard0.db, ...), chosen by account_number % SHARD_COUNT. DB_NAME
+# stays the home database for admins, complaints, the account sequence and
+# the cross-shard transfer log (see shards.py). Every file has the full
+# schema, so single-database code runs unchanged against any of them.
+SHARD_ENV = "BANK_SHARDS"
+SHARD_COUNT = int(os.environ.get(SHARD_ENV) or 0)
+# Transaction ids of shard k start above k * SHARD_ID_SPAN, so ids stay
+# unique across shards and the owning shard of an id is id // SHARD_ID_SPAN.
+SHARD_ID_SPAN = 10 ** 12
+
+# Optional per-statement hook (see metrics.py); applied lazily to pooled
+# connections as they are handed out.
+_trace_callback = None
+
+def set_trace_callback(callback):
+    global _trace_callback
+    _trace_callback = callback
+
+def _open_connection(path):
+    conn = sqlite3.connect(path, timeout=PRAGMAS["busy_timeout"] / 1000, check_same_thread=False)
+    for key, value in PRAGMAS.items():
+        conn.execute(f"PRAGMA {key} = {value}")
+    return conn
+
+class ConnectionPool:
+    def __init__(self, path, size=POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.pid = os.getpid()
+        self._idle = []
+        self._traced = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.retired = False
+
+    def acquire(self):
+        # Re-entrant per thread: nested calls reuse the connection already
+        # held by this thread instead of taking a second one from the pool.
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        if conn is None:
+            conn = _open_connection(self.path)
+        if self._traced.get(conn) is not _trace_callback:
+            conn.set_trace_callback(_trace_callback)
+            self._traced[conn] = _trace_callback
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def release(self, conn):
+        self._local.depth -= 1
+        if self._local.depth > 0:
+            return
+        self._local.conn = None
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self.retired and len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._traced.pop(conn, None)
+        conn.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._traced.clear()
+        for conn in idle:
+            conn.close()
+
+    def retire(self):
+        # Closes the idle connections now and each checked-out one when it
+        # is released, so a pool dropped while in use leaks nothing.
+        with self._lock:
+            self.retired = True
+        self.close_all()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(path=None):
+    path = path or DB_NAME
+    pool = _pools.get(path)
+    # A forked child must never share the parent's sqlite handles.
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None or pool.pid != os.getpid():
+                pool = ConnectionPool(path)
+                _pools[path] = pool
+    return pool
+
+def is_sharded():
+    return SHARD_COUNT > 1
+
+def shard_count():
+    return SHARD_COUNT if is_sharded() else 1
+
+def shard_for(account_number):
+    return int(account_number) % SHARD_COUNT if is_sharded() else 0
+
+def shard_file(home, index):
+    base, ext = os.path.splitext(home)
+    return f"{base}_shard{index}{ext}"
+
+def shard_path(index):
+    return shard_file(DB_NAME, index) if is_sharded() else DB_NAME
+
+def path_for(account_number=None, shard=None):
+    # The home database unless an account or shard is named.
+    if shard is None:
+        if account_number is None:
+            return DB_NAME
+        shard = shard_for(account_number)
+    return shard_path(shard)
+
+# Reporting snapshots (see snapshots.py). Inside reading_snapshot() this
+# thread's connections open the snapshot's copies of the files, read-only,
+# unless a caller asks for the live database.
+_reading = threading.local()
+
+def snapshot_directory():
+    return getattr(_reading, "directory", None)
+
+@contextmanager
+def reading_snapshot(directory):
+    previous = snapshot_directory()
+    _reading.directory = directory
+    try:
+        yield directory
+    finally:
+        _reading.directory = previous
+
+@contextmanager
+def connection(account_number=None, shard=None, live=False):
+    path = path_for(account_number, shard)
+    directory = None if live else snapshot_directory()
+    if directory:
+        path = os.path.join(directory, os.path.basename(path))
+    pool = get_pool(path)
+    conn = pool.acquire()
+    if directory:
+        conn.execute("PRAGMA query_only = ON")
+    try:
+        yield conn
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    finally:
+        pool.release(conn)
+
+def close_all(directory=None):
+    # Retires every pool, or only those for files in `directory`; threads
+    # still holding one of their connections finish with it first.
+    with _pools_lock:
+        paths = [path for path in _pools if directory is None or os.path.dirname(path) == directory]
+        pools = [_pools.pop(path) for path in paths]
+    for pool in pools:
+        if pool.pid == os.getpid():
+            pool.retire()
+
+atexit.register(close_all)
+
+def get_connection(account_number=None, shard=None):
+    return _open_connection(path_for(account_number, shard))
+
+# Ledger types that take money out of an account; every other type adds to it.
+DEBIT_TYPES = ('WITHDRAWAL', 'TRANSFER_SENT', 'MONTHLY_FEE', 'MIN_BALANCE_PENALTY')
+
+# Recomputes daily_totals from the ledger (see summaries.py).
+DAILY_TOTALS_BACKFILL = """
+INSERT INTO daily_totals (day, transaction_type, total, count)
+SELECT substr(timestamp, 1, 10), transaction_type, SUM(amount), COUNT(*) FROM transactions GROUP BY 1, 2
+"""
+
+def full_text_index(table, key, column, **options):
+    # An external-content FTS5 index <table>_fts over `column`, keyed by the
+    # table's integer primary key and kept in step by triggers. Updates only
+    # touch the index when `column` itself changes.
+    fts = f"{table}_fts"
+    settings = "".join(f", {name}='{value}'" for name, value in options.items())
+    delete = f"INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.{key}, old.{column});"
+    insert = f"INSERT INTO {fts} (rowid, {column}) VALUES (new.{key}, new.{column});"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}', content_rowid='{key}'{settings})",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {key}, {column} ON {table} BEGIN {delete} {insert} END",
+        f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')",
+    ]
+
+# Schema migrations, applied in order. The list position + 1 is the schema
+# version recorded in PRAGMA user_version once that migration has run.
+# Each step is either an SQL statement or a callable taking a cursor.
+MIGRATIONS = [
+    # 1: base tables
+    [
+        '''
         CREATE TABLE IF NOT EXISTS users (
             account_number INTEGER PRIMARY KEY,
             name TEXT NOT NULL,
             pin INTEGER NOT NULL,
             balance REAL DEFAULT 0.0
         )
-    ''')
-    
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS deleted_users (
             account_number INTEGER PRIMARY KEY,
             name TEXT,
@@ -27,9 +240,8 @@ def init_db():
             balance REAL,
             closed_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-    
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS transactions (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             account_number INTEGER,
@@ -38,9 +250,8 @@ def init_db():
             amount REAL,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS complaints (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             account_number INTEGER,
@@ -48,23 +259,260 @@ def init_db():
             message TEXT NOT NULL,
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
-    ''')
-
-    cursor.execute('''
+        ''',
+        '''
         CREATE TABLE IF NOT EXISTS admins (
             username TEXT PRIMARY KEY,
             password TEXT NOT NULL
         )
-    ''')
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS interest_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            rate REAL NOT NULL,
+            status TEXT NOT NULL DEFAULT 'RUNNING',
+            last_account INTEGER NOT NULL DEFAULT 0,
+            accounts_credited INTEGER NOT NULL DEFAULT 0,
+            started_at DATETIME,
+            finished_at DATETIME
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            updated_at DATETIME
+        )
+        ''',
+        "INSERT OR IGNORE INTO admins (username, password) VALUES ('admin', 'admin123')",
+    ],
+    # 2: indexes for history, date-range and per-type queries
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_account_id ON transactions (account_number, id)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_timestamp ON transactions (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type_timestamp ON transactions (transaction_type, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_complaints_account_id ON complaints (account_number, id)",
+        "ANALYZE",
+    ],
+    # 3: keyset pages of one transaction type
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_type_id ON transactions (transaction_type, id)",
+    ],
+    # 4: account number sequence with a per-database permutation key
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS account_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_value INTEGER NOT NULL,
+            key INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO account_sequence (id, next_value, key) VALUES (1, 0, abs(random()) % 4294967296)",
+    ],
+    # 5: running balance on every ledger row, backfilled backwards from the
+    # current (or archived) balance, and the index statements seek on
+    [
+        "ALTER TABLE transactions ADD COLUMN balance_after REAL",
+        '''
+        UPDATE transactions SET balance_after = running.balance_after
+        FROM (
+            SELECT t.id, COALESCE(u.balance, d.balance, 0) - COALESCE(SUM(
+                CASE WHEN t.transaction_type IN ('WITHDRAWAL', 'TRANSFER_SENT') THEN -t.amount ELSE t.amount END
+            ) OVER (PARTITION BY t.account_number ORDER BY t.id DESC ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING), 0) AS balance_after
+            FROM transactions t
+            LEFT JOIN users u ON u.account_number = t.account_number
+            LEFT JOIN deleted_users d ON d.account_number = t.account_number
+        ) AS running
+        WHERE transactions.id = running.id
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_transactions_account_timestamp ON transactions (account_number, timestamp)",
+    ],
+    # 6: incrementally maintained daily totals and the per-day report over them
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            day TEXT NOT NULL,
+            transaction_type TEXT NOT NULL,
+            total REAL NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (day, transaction_type)
+        ) WITHOUT ROWID
+        ''',
+        '''
+        CREATE VIEW IF NOT EXISTS daily_summary AS
+        SELECT day,
+               SUM(CASE WHEN transaction_type = 'DEPOSIT' THEN total ELSE 0 END) AS deposits,
+               SUM(CASE WHEN transaction_type = 'WITHDRAWAL' THEN total ELSE 0 END) AS withdrawals,
+               SUM(CASE WHEN transaction_type = 'TRANSFER_SENT' THEN total ELSE 0 END) AS transfers,
+               SUM(CASE WHEN transaction_type = 'INTEREST_CREDIT' THEN total ELSE 0 END) AS interest,
+               SUM(CASE WHEN transaction_type IN ('DEPOSIT', 'INTEREST_CREDIT') THEN total
+                        WHEN transaction_type = 'WITHDRAWAL' THEN -total ELSE 0 END) AS net_flow,
+               SUM(count) AS transactions
+        FROM daily_totals GROUP BY day
+        ''',
+        DAILY_TOTALS_BACKFILL,
+    ],
+    # 7: bookkeeping for monthly archive files (see archive.py)
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS archive_months (
+            month TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            first_id INTEGER,
+            last_id INTEGER,
+            archived_at TEXT
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS archived_accounts (
+            account_number INTEGER PRIMARY KEY,
+            credits REAL NOT NULL,
+            debits REAL NOT NULL,
+            rows INTEGER NOT NULL,
+            last_id INTEGER,
+            last_timestamp TEXT,
+            last_balance REAL
+        )
+        ''',
+    ],
+    # 8: storage layout and the two-phase log for cross-shard transfers
+    [
+        "CREATE TABLE IF NOT EXISTS storage_layout (id INTEGER PRIMARY KEY CHECK (id = 1), shards INTEGER NOT NULL)",
+        "INSERT OR IGNORE INTO storage_layout (id, shards) VALUES (1, 1)",
+        '''
+        CREATE TABLE IF NOT EXISTS transfer_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            sender INTEGER NOT NULL,
+            receiver INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            state TEXT NOT NULL,
+            completed INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT NOT NULL,
+            updated_at TEXT
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_transfer_log_pending ON transfer_log (id) WHERE completed = 0",
+        '''
+        CREATE TABLE IF NOT EXISTS transfer_branches (
+            transfer_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            account_number INTEGER NOT NULL,
+            amount REAL NOT NULL,
+            state TEXT NOT NULL,
+            ledger_id INTEGER,
+            PRIMARY KEY (transfer_id, role)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_transfer_branches_pending ON transfer_branches (account_number) WHERE state = 'PREPARED'",
+    ],
+    # 9: last ledger-engine log record applied to this database (see ledger.py)
+    [
+        "CREATE TABLE IF NOT EXISTS ledger_checkpoint (id INTEGER PRIMARY KEY CHECK (id = 1), lsn INTEGER NOT NULL, checkpointed_at TEXT)",
+        "INSERT OR IGNORE INTO ledger_checkpoint (id, lsn) VALUES (1, 0)",
+    ],
+    # 10: interest and fee cycles (see rates.py); fees in the daily summary
+    [
+        '''
+        CREATE TABLE IF NOT EXISTS rate_cycles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cycle TEXT NOT NULL,
+            days INTEGER NOT NULL,
+            charge_fees INTEGER NOT NULL,
+            last_account INTEGER NOT NULL DEFAULT 0,
+            accounts INTEGER NOT NULL DEFAULT 0,
+            interest REAL NOT NULL DEFAULT 0,
+            fees REAL NOT NULL DEFAULT 0,
+            penalties REAL NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'RUNNING',
+            started_at TEXT NOT NULL,
+            finished_at TEXT
+        )
+        ''',
+        "DROP VIEW IF EXISTS daily_summary",
+        '''
+        CREATE VIEW daily_summary AS
+        SELECT day,
+               SUM(CASE WHEN transaction_type = 'DEPOSIT' THEN total ELSE 0 END) AS deposits,
+               SUM(CASE WHEN transaction_type = 'WITHDRAWAL' THEN total ELSE 0 END) AS withdrawals,
+               SUM(CASE WHEN transaction_type = 'TRANSFER_SENT' THEN total ELSE 0 END) AS transfers,
+               SUM(CASE WHEN transaction_type = 'INTEREST_CREDIT' THEN total ELSE 0 END) AS interest,
+               SUM(CASE WHEN transaction_type IN ('MONTHLY_FEE', 'MIN_BALANCE_PENALTY') THEN total ELSE 0 END) AS fees,
+               SUM(CASE WHEN transaction_type IN ('DEPOSIT', 'INTEREST_CREDIT') THEN total
+                        WHEN transaction_type IN ('WITHDRAWAL', 'MONTHLY_FEE', 'MIN_BALANCE_PENALTY') THEN -total ELSE 0 END) AS net_flow,
+               SUM(count) AS transactions
+        FROM daily_totals GROUP BY day
+        ''',
+    ],
+    # 11: full-text search over complaints and customer names (see operations.search_*)
+    full_text_index("complaints", "id", "message", tokenize="porter unicode61") +
+    full_text_index("users", "account_number", "name", tokenize="unicode61 remove_diacritics 2", prefix="2 3") +
+    full_text_index("deleted_users", "account_number", "name", tokenize="unicode61 remove_diacritics 2", prefix="2 3"),
+    # 12: cross-shard transfers posted by the ledger engine, keyed by log record (see ledger.py)
+    [
+        "ALTER TABLE transfer_log ADD COLUMN ledger_lsn INTEGER",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transfer_log_ledger_lsn ON transfer_log (ledger_lsn) WHERE ledger_lsn IS NOT NULL",
+    ],
+]
 
-    cursor.execute("INSERT OR IGNORE INTO admins (username, password) VALUES (?, ?)", ('admin', 'admin123'))
-    
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    if get_schema_version(conn) >= SCHEMA_VERSION:
+        return False
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        # Re-read under the write lock in case another process migrated first.
+        version = get_schema_version(conn)
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            for step in MIGRATIONS[number - 1]:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            cursor.execute(f"PRAGMA user_version = {number}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return True
+
+def _check_layout(conn):
+    # Refuse to start with a shard count the data was not laid out for;
+    # an unsharded database is converted with `python shards.py split`.
+    stored = conn.execute("SELECT shards FROM storage_layout WHERE id = 1").fetchone()[0]
+    if stored == shard_count():
+        return
+    if stored == 1 and not conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+        conn.execute("UPDATE storage_layout SET shards = ? WHERE id = 1", (shard_count(),))
+        conn.commit()
+        return
+    raise RuntimeError(f"{DB_NAME} is laid out for {stored} shard(s) but {SHARD_ENV} asks for {shard_count()}.")
+
+def init_shard(conn, index):
+    # Start this shard's transaction ids in its own range.
+    conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'transactions', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'transactions')", 
+                 (index * SHARD_ID_SPAN,))
     conn.commit()
-    conn.close()
+
+def init_db():
+    created = not os.path.exists(DB_NAME)
+    with connection() as conn:
+        migrate(conn)
+        _check_layout(conn)
+    if is_sharded():
+        for index in range(SHARD_COUNT):
+            with connection(shard=index) as conn:
+                migrate(conn)
+                init_shard(conn, index)
     
-    if not os.path.exists(DB_NAME):
+    if created:
         print(f"[System] Database {DB_NAME} created.")
 
 if __name__ == "__main__":
     init_db()
-    print("Database initialized successfully.")
\ No newline at end of file
+    print("Database initialized successfully.")
@@ -0,0 +1,48 @@
+import os
+import zlib
+
+# Terminal rendering helpers for a fast start. tabulate and pyfiglet are only
+# imported the first time something has to be rendered, and static screens
+# (the banner and the menus) are rendered once and replayed from a small
+# cache file afterwards, so a typical launch imports neither.
+
+CACHE_ENV = "BANK_CACHE_DIR"
+CACHE_DIR = os.environ.get(CACHE_ENV) or os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+def tabulate(*args, **kwargs):
+    from tabulate import tabulate as render
+    return render(*args, **kwargs)
+
+def cached(key, render):
+    # The key covers everything that affects the output, so editing a menu
+    # simply renders (and caches) a new screen. It is stored on the first
+    # line of the file, which also guards against checksum collisions.
+    key = key.replace("\n", " ")
+    path = os.path.join(CACHE_DIR, f"screen-{zlib.crc32(key.encode()):08x}.txt")
+    try:
+        with open(path, encoding="utf-8") as f:
+            stored, _, text = f.read().partition("\n")
+        if stored == key:
+            return text
+    except OSError:
+        pass
+    text = render()
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        temp = f"{path}.{os.getpid()}"
+        with open(temp, "w", encoding="utf-8") as f:
+            f.write(f"{key}\n{text}")
+        os.replace(temp, path)
+    except OSError:
+        pass
+    return text
+
+def table(rows, **kwargs):
+    # For static tables only; dynamic data goes through tabulate() directly.
+    return cached(f"table:{rows!r}:{sorted(kwargs.items())!r}", lambda: tabulate(rows, **kwargs))
+
+def figlet(text, font):
+    def render():
+        import pyfiglet
+        return pyfiglet.figlet_format(text, font=font)
+    return cached(f"figlet:{font}:{text}", render)
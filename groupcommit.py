@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+import database
+from cache import account_cache
+
+# Group commit for postings. Callers queue a post_* function from
+# operations.py and block; a single committer thread applies everything
+# that arrives within MAX_DELAY seconds (or MAX_BATCH postings) in one
+# SQLite transaction, each posting under its own savepoint so a rejected
+# posting only rolls back itself. Callers are released only after the
+# shared commit has been synced to disk. Postings receive the batch's
+# timestamp from `clock`, read under the write lock like a direct posting.
+# With sharded storage there is one committer per shard.
+
+MAX_BATCH = 256
+MAX_DELAY = 0.002
+
+class _Request:
+    __slots__ = ("post", "accounts", "args", "outcome", "done")
+
+    def __init__(self, post, accounts, args):
+        self.post = post
+        self.accounts = accounts
+        self.args = args
+        self.outcome = None
+        self.done = threading.Event()
+
+class GroupCommitter:
+    def __init__(self, clock, max_batch=MAX_BATCH, max_delay=MAX_DELAY, shard=None):
+        self.clock = clock
+        self.shard = shard
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = self.postings = 0
+        self._queue = queue.Queue()
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name=f"bank-group-commit-{shard or 0}", daemon=True)
+        self._thread.start()
+
+    def submit(self, post, accounts, *args):
+        request = _Request(post, accounts, args)
+        with self._lock:
+            if self._stopping:
+                return False, "Group commit is shutting down."
+            self._queue.put(request)
+        request.done.wait()
+        return request.outcome
+
+    def stop(self):
+        with self._lock:
+            if self._stopping:
+                return
+            self._stopping = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        # A dedicated connection with synchronous=FULL: one fsync per group
+        # is the whole point, and it makes every released result durable.
+        conn = database.get_connection(shard=self.shard)
+        conn.execute("PRAGMA synchronous = FULL")
+        try:
+            while True:
+                first = self._queue.get()
+                if first is None:
+                    break
+                batch = [first]
+                deadline = time.monotonic() + self.max_delay
+                stop = False
+                while len(batch) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stop = True
+                        break
+                    batch.append(item)
+                self._apply(conn, batch)
+                if stop:
+                    break
+        finally:
+            conn.close()
+            # Anything still queued after shutdown is refused, not dropped.
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item.outcome = (False, "Group commit is shutting down.")
+                    item.done.set()
+
+    def _apply(self, conn, batch):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            current_time = self.clock()
+            for request in batch:
+                cursor.execute("SAVEPOINT posting")
+                try:
+                    request.outcome = request.post(cursor, *request.args, current_time)
+                except Exception as e:
+                    request.outcome = (False, str(e))
+                if not request.outcome[0]:
+                    cursor.execute("ROLLBACK TO posting")
+                cursor.execute("RELEASE posting")
+            conn.commit()
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            for request in batch:
+                request.outcome = (False, str(e))
+        else:
+            self.batches += 1
+            self.postings += len(batch)
+            account_cache.invalidate(*[acc for request in batch if request.outcome[0] for acc in request.accounts])
+        for request in batch:
+            request.done.set()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "postings": self.postings,
+            "avg_batch": self.postings / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
@@ -0,0 +1,184 @@
+import csv
+import json
+import math
+import database
+from database import connection
+import operations
+from cache import account_cache
+import summaries
+import shards
+
+INGEST_BATCH_SIZE = 10000
+POSTING_TYPES = ("DEPOSIT", "WITHDRAWAL", "TRANSFER")
+
+# HELPER FUNCTIONS
+
+def read_rows(path):
+    # Yields (line_no, record) pairs without loading the whole file.
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                if line.strip():
+                    try:
+                        yield line_no, json.loads(line)
+                    except ValueError:
+                        yield line_no, None
+    else:
+        with open(path, newline='') as f:
+            for line_no, record in enumerate(csv.DictReader(f), start=2):
+                yield line_no, record
+
+def parse_posting(record):
+    if not isinstance(record, dict):
+        raise ValueError("Malformed row.")
+    posting_type = str(record.get("type") or "").strip().upper()
+    if posting_type not in POSTING_TYPES:
+        raise ValueError(f"Unknown type '{posting_type}'.")
+    try:
+        account = int(record.get("account_number"))
+        amount = float(record.get("amount"))
+        receiver = int(record.get("receiver_account")) if posting_type == "TRANSFER" else None
+    except (TypeError, ValueError):
+        raise ValueError("Invalid or missing field.")
+    if not math.isfinite(amount):
+        raise ValueError("Amount must be a finite number.")
+    if amount <= 0:
+        raise ValueError("Amount must be positive.")
+    if receiver == account:
+        raise ValueError("Cannot transfer to self.")
+    return posting_type, account, amount, receiver
+
+def _load_accounts(cursor, account_numbers):
+    accounts = {}
+    account_numbers = list(account_numbers)
+    for i in range(0, len(account_numbers), 500):
+        chunk = account_numbers[i:i + 500]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT account_number, name, balance FROM users WHERE account_number IN ({placeholders})", chunk)
+        for acc_num, name, balance in cursor.fetchall():
+            accounts[acc_num] = [name, balance]
+    return accounts
+
+def _apply_batch(conn, batch):
+    # batch: list of (line_no, posting), where a posting that failed to parse
+    # is its error message. Rows are validated against balances held in
+    # memory under the write lock, then written with executemany.
+    results = []
+    cursor = conn.cursor()
+
+    wanted = set()
+    for _, posting in batch:
+        if isinstance(posting, tuple):
+            wanted.add(posting[1])
+            if posting[3] is not None:
+                wanted.add(posting[3])
+
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        current_time = operations.get_ist_time()
+        accounts = _load_accounts(cursor, wanted)
+        touched = set()
+        entries = []
+        for line_no, posting in batch:
+            if isinstance(posting, str):
+                results.append((line_no, "FAILED", posting))
+                continue
+            posting_type, account, amount, receiver = posting
+            sender = accounts.get(account)
+            if sender is None:
+                results.append((line_no, "FAILED", "Account not found."))
+                continue
+            if posting_type == "DEPOSIT":
+                sender[1] += amount
+                entries.append((account, sender[0], "DEPOSIT", amount, current_time, sender[1]))
+            elif posting_type == "WITHDRAWAL":
+                if sender[1] < amount:
+                    results.append((line_no, "FAILED", "Insufficient funds."))
+                    continue
+                sender[1] -= amount
+                entries.append((account, sender[0], "WITHDRAWAL", amount, current_time, sender[1]))
+            else:
+                target = accounts.get(receiver)
+                if target is None:
+                    results.append((line_no, "FAILED", "Receiver account not found."))
+                    continue
+                if sender[1] < amount:
+                    results.append((line_no, "FAILED", "Insufficient funds."))
+                    continue
+                sender[1] -= amount
+                target[1] += amount
+                entries.append((account, sender[0], "TRANSFER_SENT", amount, current_time, sender[1]))
+                entries.append((receiver, target[0], "TRANSFER_RECEIVED", amount, current_time, target[1]))
+                touched.add(receiver)
+            touched.add(account)
+            results.append((line_no, "APPLIED", f"{posting_type} of ₹ {amount:.2f}"))
+
+        cursor.executemany("UPDATE users SET balance = ? WHERE account_number = ?",
+                           [(accounts[acc][1], acc) for acc in touched])
+        cursor.executemany("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) VALUES (?, ?, ?, ?, ?, ?)",
+                           entries)
+        summaries.record(cursor, entries)
+        conn.commit()
+        account_cache.invalidate(*touched)
+    except Exception as e:
+        conn.rollback()
+        results = [(line_no, "FAILED", f"Batch rolled back: {e}") for line_no, _ in batch]
+    return results
+
+def _apply_sharded(batch):
+    # Postings within one shard are applied as a batch on that shard;
+    # cross-shard transfers go through the two-phase protocol one by one,
+    # after the single-shard postings. The report keeps file order.
+    groups, cross = {}, []
+    for line_no, posting in batch:
+        if isinstance(posting, tuple) and posting[3] is not None and database.shard_for(posting[1]) != database.shard_for(posting[3]):
+            cross.append((line_no, posting))
+        else:
+            shard = database.shard_for(posting[1]) if isinstance(posting, tuple) else 0
+            groups.setdefault(shard, []).append((line_no, posting))
+    results = []
+    for shard, rows in groups.items():
+        with connection(shard=shard) as conn:
+            results += _apply_batch(conn, rows)
+    for line_no, (posting_type, account, amount, receiver) in cross:
+        success, msg = shards.transfer(account, receiver, amount)
+        results.append((line_no, "APPLIED", f"{posting_type} of ₹ {amount:.2f}") if success else (line_no, "FAILED", msg))
+    results.sort()
+    return results
+
+# BULK INGESTION
+
+def ingest_file(path, report_path=None, batch_size=INGEST_BATCH_SIZE, progress=None):
+    if operations._ledger_engine is not None:
+        return False, "Bulk import cannot run while the ledger engine owns the balances."
+    report_path = report_path or f"{path}.report.csv"
+    applied = failed = 0
+    try:
+        with connection() as conn, open(report_path, 'w', newline='') as report:
+            writer = csv.writer(report)
+            writer.writerow(["Line", "Status", "Message"])
+            batch = []
+
+            def flush():
+                nonlocal applied, failed
+                results = _apply_sharded(batch) if database.is_sharded() else _apply_batch(conn, batch)
+                writer.writerows(results)
+                for _, status, _ in results:
+                    if status == "APPLIED": applied += 1
+                    else: failed += 1
+                batch.clear()
+                if progress:
+                    progress(applied, failed)
+
+            for line_no, record in read_rows(path):
+                try:
+                    batch.append((line_no, parse_posting(record)))
+                except ValueError as e:
+                    batch.append((line_no, str(e)))
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+    except Exception as e:
+        return False, str(e)
+    return True, f"Applied {applied} rows, {failed} failed. Report saved as '{report_path}'"
@@ -0,0 +1,484 @@
+import array
+import math
+import os
+import struct
+import threading
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+import database
+from database import connection
+from cache import account_cache
+import auth
+import operations
+import shards
+import summaries
+
+# In-memory ledger engine for peak hours (operations.enable_ledger_engine()).
+# Balances live in an array of doubles indexed by account number, and every
+# accepted posting is appended to a write-ahead log before its caller is
+# answered. A background thread checkpoints the postings into the
+# transactions table and the touched balances into users, then drops the log
+# segments they came from. On start the engine loads the checkpointed
+# balances and replays whatever the log holds beyond each database's
+# ledger_checkpoint.lsn, so a crash loses nothing that was acknowledged.
+# A transfer between shards is checkpointed the way shards.transfer() leaves
+# one: a completed transfer_log entry in the home database, keyed by its log
+# record, and a committed branch beside each leg, so reconciliation pairs
+# its legs.
+#
+# While the engine runs it owns every balance: jobs that write balances
+# directly (interest, bulk import) refuse to run, and history and statements
+# trail the engine by at most one checkpoint interval. A checkpoint that
+# fails is retried by the next one; after CHECKPOINT_FAILURE_LIMIT failures
+# in a row the engine refuses postings (with the error) rather than keep
+# acknowledging ones that cannot reach the database. It also owns the log
+# directory, through an exclusive lock on LOCK_FILE held for its lifetime:
+# a second engine, or recover_log() in another process, refuses to touch
+# segments it does not own.
+
+LEDGER_DIR = "ledger_wal"
+LOCK_FILE = "engine.lock"
+CHECKPOINT_INTERVAL = 1.0     # seconds between checkpoints
+CHECKPOINT_ROWS = 50000       # or sooner, once this many postings are pending
+SYNC_INTERVAL = 0.002         # log fsync period when no caller is waiting (sync=False)
+CHECKPOINT_FAILURE_LIMIT = 5  # failed checkpoints in a row before postings are refused
+
+DEPOSIT, WITHDRAWAL, TRANSFER = 1, 2, 3
+
+# Log record: crc32 of the rest, then lsn, kind, account, receiver, amount, timestamp.
+CRC = struct.Struct("<I")
+RECORD = struct.Struct("<QBIId19s")
+RECORD_SIZE = CRC.size + RECORD.size
+
+# HELPER FUNCTIONS
+
+def _log_dir():
+    # The log lives next to the database it checkpoints into.
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), LEDGER_DIR)
+
+def _lock_log():
+    # The open lock file, now held exclusively, or None if another engine
+    # holds it. Closing the descriptor releases the lock.
+    os.makedirs(_log_dir(), exist_ok=True)
+    fd = os.open(os.path.join(_log_dir(), LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError:
+        os.close(fd)
+        return None
+    return fd
+
+def log_in_use():
+    # True while an engine, in this process or another, holds the log: it
+    # owns every balance then, and nothing else may write them.
+    if not os.path.isdir(_log_dir()):
+        return False
+    fd = _lock_log()
+    if fd is None:
+        return True
+    os.close(fd)
+    return False
+
+def _segments():
+    directory = _log_dir()
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".wal")]
+
+def _read_segment(path):
+    # Yields records up to the first torn or corrupt one, and cuts the file
+    # there so new records are never appended after garbage.
+    with open(path, "r+b") as f:
+        data = f.read()
+        offset = 0
+        while offset + RECORD_SIZE <= len(data):
+            payload = data[offset + CRC.size:offset + RECORD_SIZE]
+            if CRC.unpack_from(data, offset)[0] != zlib.crc32(payload):
+                break
+            lsn, kind, account, receiver, amount, timestamp = RECORD.unpack(payload)
+            yield lsn, kind, account, receiver, amount, timestamp.decode()
+            offset += RECORD_SIZE
+        if offset < len(data):
+            f.truncate(offset)
+
+# LEDGER ENGINE
+
+class LedgerEngine:
+    def __init__(self, sync=True, checkpoint_interval=CHECKPOINT_INTERVAL, checkpoint_rows=CHECKPOINT_ROWS, lock_fd=None):
+        # sync=False answers callers once the record is written to the OS;
+        # it is still fsynced within SYNC_INTERVAL, but a power cut may lose it.
+        # lock_fd is a log lock the caller already holds (see recover_log()).
+        self._lock_fd = lock_fd if lock_fd is not None else _lock_log()
+        if self._lock_fd is None:
+            raise RuntimeError("The ledger engine is already running in another process.")
+        self.sync = sync
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_rows = checkpoint_rows
+        self.postings = self.checkpoints = 0
+        self.checkpoint_failures = 0     # in a row; reset by the next good checkpoint
+        self.checkpoint_error = None
+        self._balances = array.array('d', [math.nan]) * auth.ACCOUNT_SPACE
+        self._pending = []       # (account, type, amount, timestamp, balance_after, lsn, other account)
+        self._dirty = set()
+        self._lock = threading.Lock()           # postings, the log write order
+        self._file_lock = threading.Lock()      # the current segment's descriptor
+        self._checkpoint_lock = threading.Lock()
+        self._synced = threading.Condition()
+        self._wake = threading.Event()
+        self._stopping = False
+        self.lsn = self.synced_lsn = 0
+        self._fd = None
+
+        try:
+            self._checkpointed = self._load()
+            self.lsn = self.synced_lsn = max(self._checkpointed.values())
+            replayed = self._replay()
+            self._open_segment()
+            self.checkpoint()
+        except Exception:
+            os.close(self._lock_fd)
+            raise
+        self.replayed = replayed
+        self._threads = [threading.Thread(target=self._sync_loop, name="bank-ledger-sync", daemon=True),
+                         threading.Thread(target=self._checkpoint_loop, name="bank-ledger-checkpoint", daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    # STATE
+
+    def _load(self):
+        checkpointed = {}
+        for shard in range(database.shard_count()):
+            with connection(shard=shard) as conn:
+                for account_number, balance in conn.execute("SELECT account_number, balance FROM users"):
+                    index = account_number - auth.ACCOUNT_MIN
+                    if 0 <= index < auth.ACCOUNT_SPACE:
+                        self._balances[index] = balance
+                checkpointed[shard] = conn.execute("SELECT lsn FROM ledger_checkpoint WHERE id = 1").fetchone()[0]
+        return checkpointed
+
+    def _replay(self):
+        # A transfer between shards is replayed side by side: each side only
+        # if its database has not checkpointed that record yet.
+        replayed = 0
+        for path in _segments():
+            for lsn, kind, account, receiver, amount, timestamp in _read_segment(path):
+                if not math.isfinite(amount):
+                    # Written by an engine that did not check amounts; never applied.
+                    self.lsn = max(self.lsn, lsn)
+                    continue
+                sides = [(account, -amount if kind != DEPOSIT else amount, ('DEPOSIT', 'WITHDRAWAL', 'TRANSFER_SENT')[kind - 1], receiver)]
+                if kind == TRANSFER:
+                    sides.append((receiver, amount, 'TRANSFER_RECEIVED', account))
+                for acc, delta, kind_name, other in sides:
+                    if lsn > self._checkpointed[database.shard_for(acc)] and self._index(acc) is not None:
+                        self._apply(acc, delta, kind_name, abs(delta), timestamp, lsn, other)
+                self.lsn = max(self.lsn, lsn)
+                replayed += 1
+        return replayed
+
+    def _index(self, account_number):
+        # Accounts opened after the engine started are picked up on first use.
+        index = int(account_number) - auth.ACCOUNT_MIN
+        if not 0 <= index < auth.ACCOUNT_SPACE:
+            return None
+        if math.isnan(self._balances[index]):
+            with connection(account_number) as conn:
+                row = conn.execute("SELECT balance FROM users WHERE account_number = ?", (account_number,)).fetchone()
+            if not row:
+                return None
+            self._balances[index] = row[0]
+        return index
+
+    def _apply(self, account_number, delta, kind, amount, timestamp, lsn, other=0):
+        index = int(account_number) - auth.ACCOUNT_MIN
+        balance = self._balances[index] + delta
+        self._balances[index] = balance
+        self._pending.append((int(account_number), kind, amount, timestamp, balance, lsn, int(other)))
+        self._dirty.add(int(account_number))
+        return balance
+
+    # WRITE-AHEAD LOG
+
+    def _open_segment(self):
+        path = os.path.join(_log_dir(), f"{self.lsn + 1:020d}.wal")
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _rotate(self):
+        # Called under self._lock: later records go to a fresh segment, so the
+        # closed ones can be deleted once checkpointed.
+        with self._file_lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            self._open_segment()
+        with self._synced:
+            self.synced_lsn = self.lsn
+            self._synced.notify_all()
+
+    def _append(self, kind, account, receiver, amount, timestamp):
+        payload = RECORD.pack(self.lsn + 1, kind, int(account), int(receiver), amount, timestamp.encode())
+        os.write(self._fd, CRC.pack(zlib.crc32(payload)) + payload)
+        self.lsn += 1
+        self.postings += 1
+        return self.lsn
+
+    def _wait(self, lsn):
+        if len(self._pending) >= self.checkpoint_rows:
+            self._wake.set()
+        if not self.sync:
+            return
+        with self._synced:
+            self._synced.notify_all()
+            self._synced.wait_for(lambda: self.synced_lsn >= lsn or self._stopping)
+
+    def _sync_loop(self):
+        # One fsync covers every record written since the previous one.
+        while not self._stopping:
+            with self._synced:
+                self._synced.wait_for(lambda: self.lsn > self.synced_lsn or self._stopping, timeout=SYNC_INTERVAL)
+            with self._file_lock:
+                target = self.lsn
+                if target > self.synced_lsn:
+                    os.fsync(self._fd)
+            with self._synced:
+                self.synced_lsn = max(self.synced_lsn, target)
+                self._synced.notify_all()
+
+    # POSTINGS (same results as the operations.* functions)
+
+    def _refusal(self, amount):
+        # Why a posting of amount cannot be taken, or None.
+        if not math.isfinite(amount): return "Amount must be a finite number."
+        if amount <= 0: return "Amount must be positive."
+        if self.checkpoint_failures >= CHECKPOINT_FAILURE_LIMIT:
+            return f"The ledger engine cannot checkpoint its postings: {self.checkpoint_error}"
+        return None
+
+    def deposit(self, account_number, amount):
+        refusal = self._refusal(amount)
+        if refusal: return False, refusal
+        with self._lock:
+            if self._index(account_number) is None: return False, "Account not found."
+            timestamp = operations.get_ist_time()
+            lsn = self._append(DEPOSIT, account_number, 0, amount, timestamp)
+            balance = self._apply(account_number, amount, 'DEPOSIT', amount, timestamp, lsn)
+        self._wait(lsn)
+        return True, f"Deposit successful. New Balance: ₹ {balance:.2f}"
+
+    def withdraw(self, account_number, amount):
+        refusal = self._refusal(amount)
+        if refusal: return False, refusal
+        with self._lock:
+            index = self._index(account_number)
+            if index is None or self._balances[index] < amount: return False, "Insufficient funds."
+            timestamp = operations.get_ist_time()
+            lsn = self._append(WITHDRAWAL, account_number, 0, amount, timestamp)
+            balance = self._apply(account_number, -amount, 'WITHDRAWAL', amount, timestamp, lsn)
+        self._wait(lsn)
+        return True, f"Withdrawal successful. Remaining Balance: ₹ {balance:.2f}"
+
+    def transfer_funds(self, sender_acc, receiver_acc, amount):
+        refusal = self._refusal(amount)
+        if refusal: return False, refusal
+        if str(sender_acc) == str(receiver_acc): return False, "Cannot transfer to self."
+        with self._lock:
+            index = self._index(sender_acc)
+            if index is None or self._balances[index] < amount: return False, "Insufficient funds."
+            if self._index(receiver_acc) is None: return False, "Receiver account not found."
+            timestamp = operations.get_ist_time()
+            lsn = self._append(TRANSFER, sender_acc, receiver_acc, amount, timestamp)
+            self._apply(sender_acc, -amount, 'TRANSFER_SENT', amount, timestamp, lsn, receiver_acc)
+            self._apply(receiver_acc, amount, 'TRANSFER_RECEIVED', amount, timestamp, lsn, sender_acc)
+        self._wait(lsn)
+        return True, "Transfer successful."
+
+    def get_balance(self, account_number):
+        with self._lock:
+            index = self._index(account_number)
+            return self._balances[index] if index is not None else 0.0
+
+    def release_account(self, account_number, close):
+        # Closes an account the engine holds no money for: close() does the
+        # database side and returns (success, message). Postings wait on the
+        # lock meanwhile, and the account is forgotten only once close()
+        # succeeded, so none can reach an account on its way out.
+        with self._lock:
+            index = self._index(account_number)
+            if index is not None and self._balances[index] > 0:
+                return False, "Cannot close account with remaining balance. Please withdraw funds first."
+            success, msg = close()
+            if success and index is not None:
+                self._balances[index] = math.nan
+            return success, msg
+
+    # CHECKPOINTS
+
+    def checkpoint(self):
+        with self._checkpoint_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                balances = {acc: self._balances[acc - auth.ACCOUNT_MIN] for acc in self._dirty}
+                self._dirty = set()
+                lsn = self.lsn
+                if entries:
+                    self._rotate()
+            if not entries:
+                self._drop_segments()
+                return 0
+
+            error = None
+            try:
+                transfers = self._log_transfers(entries)
+            except Exception as e:
+                error, failed = e, entries
+            else:
+                failed = []
+                for shard in range(database.shard_count()):
+                    shard_entries = [entry for entry in entries if database.shard_for(entry[0]) == shard]
+                    try:
+                        self._write(shard, shard_entries, balances, lsn, transfers)
+                    except Exception as e:
+                        error = e
+                        failed += shard_entries
+            account_cache.invalidate(*balances)
+            if failed:
+                # Retried by the next checkpoint; the log keeps them meanwhile.
+                with self._lock:
+                    self._pending[:0] = failed
+                    self._dirty.update(entry[0] for entry in failed)
+                self.checkpoint_failures += 1
+                self.checkpoint_error = str(error)
+                return 0
+            self.checkpoint_failures, self.checkpoint_error = 0, None
+            self._drop_segments()
+            self.checkpoints += 1
+            return len(entries)
+
+    def _drop_segments(self):
+        # Only with nothing pending: every closed segment is in the database.
+        for path in _segments()[:-1]:
+            os.remove(path)
+
+    def _log_transfers(self, entries):
+        # Logs the cross-shard transfers among entries as completed in the
+        # home database before either leg is written; returns {lsn: transfer
+        # id}. A retried checkpoint or a replay finds the entry already there.
+        legs = {}
+        for acc, kind, amount, timestamp, _, lsn, other in entries:
+            if kind in ('TRANSFER_SENT', 'TRANSFER_RECEIVED') and database.shard_for(acc) != database.shard_for(other):
+                sender, receiver = (acc, other) if kind == 'TRANSFER_SENT' else (other, acc)
+                legs[lsn] = (sender, receiver, amount, timestamp, timestamp, lsn)
+        if not legs:
+            return {}
+        transfers = {}
+        with connection() as conn, shards._durable(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.executemany("INSERT OR IGNORE INTO transfer_log (sender, receiver, amount, state, completed, created_at, updated_at, ledger_lsn) "
+                                   "VALUES (?, ?, ?, 'COMMITTED', 1, ?, ?, ?)", list(legs.values()))
+                lsns = list(legs)
+                for i in range(0, len(lsns), 500):
+                    chunk = lsns[i:i + 500]
+                    cursor.execute(f"SELECT ledger_lsn, id FROM transfer_log WHERE ledger_lsn IN ({','.join('?' * len(chunk))})", chunk)
+                    transfers.update(cursor.fetchall())
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        return transfers
+
+    def _write(self, shard, entries, balances, lsn, transfers):
+        insert = ("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) "
+                  "VALUES (?, COALESCE((SELECT name FROM users WHERE account_number = ?), (SELECT name FROM deleted_users WHERE account_number = ?)), ?, ?, ?, ?)")
+        with connection(shard=shard) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                # The name of an account closed since its posting comes from
+                # deleted_users. Rows go in log order; a cross-shard leg goes
+                # in on its own so its branch can point at the row.
+                rows, branches = [], []
+                for acc, kind, amount, timestamp, balance, entry_lsn, _ in entries:
+                    row = (acc, acc, acc, kind, amount, timestamp, balance)
+                    transfer_id = transfers.get(entry_lsn)
+                    if transfer_id is None:
+                        rows.append(row)
+                        continue
+                    cursor.executemany(insert, rows)
+                    rows = []
+                    cursor.execute(insert, row)
+                    branches.append((transfer_id, 'DEBIT' if kind == 'TRANSFER_SENT' else 'CREDIT', acc, amount, cursor.lastrowid))
+                cursor.executemany(insert, rows)
+                cursor.executemany("INSERT INTO transfer_branches (transfer_id, role, account_number, amount, state, ledger_id) VALUES (?, ?, ?, ?, 'COMMITTED', ?)",
+                                   branches)
+                summaries.record(cursor, [(acc, None, kind, amount, timestamp) for acc, kind, amount, timestamp, _, _, _ in entries])
+                cursor.executemany("UPDATE users SET balance = ? WHERE account_number = ?",
+                                   [(balance, acc) for acc, balance in balances.items() if database.shard_for(acc) == shard])
+                cursor.execute("UPDATE ledger_checkpoint SET lsn = ?, checkpointed_at = ? WHERE id = 1", (lsn, operations.get_ist_time()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def _checkpoint_loop(self):
+        while not self._stopping:
+            self._wake.wait(self.checkpoint_interval)
+            self._wake.clear()
+            if not self._stopping:
+                self.checkpoint()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        with self._synced:
+            self._synced.notify_all()
+        for thread in self._threads:
+            thread.join()
+        try:
+            self.checkpoint()
+            with self._file_lock:
+                os.fsync(self._fd)
+                os.close(self._fd)
+            # Everything is in the database now; leave an empty log behind.
+            if not self._pending:
+                for path in _segments():
+                    os.remove(path)
+        finally:
+            os.close(self._lock_fd)
+
+    def stats(self):
+        return {"postings": self.postings, "checkpoints": self.checkpoints, "lsn": self.lsn,
+                "synced_lsn": self.synced_lsn, "pending": len(self._pending),
+                "checkpoint_failures": self.checkpoint_failures, "checkpoint_error": self.checkpoint_error}
+
+def recover_log():
+    # Applies a log left behind by an engine that did not stop cleanly, so
+    # normal postings never run on top of missing ones. Fails, touching
+    # nothing, while an engine in another process owns the log: postings
+    # made around it would not see its balances.
+    if not os.path.isdir(_log_dir()):
+        return True, "No ledger log to recover."
+    fd = _lock_log()
+    if fd is None:
+        return False, "The ledger engine is running in another process. Stop it before starting another."
+    if not any(os.path.getsize(path) for path in _segments()):
+        os.close(fd)
+        return True, "No ledger log to recover."
+    try:
+        engine = LedgerEngine(lock_fd=fd)
+        replayed = engine.replayed
+        engine.stop()
+        if engine.checkpoint_error:
+            # The log is kept, so the next start tries again.
+            return False, f"Replayed {replayed} logged postings but could not checkpoint them: {engine.checkpoint_error}"
+        return True, f"Replayed {replayed} logged postings into {database.DB_NAME}."
+    except Exception as e:
+        return False, str(e)
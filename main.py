@@ -1,10 +1,12 @@
 import sys
 import time
-import pyfiglet
-from tabulate import tabulate
 import database
 import auth
 import operations
+import session
+from cache import account_cache
+from display import tabulate
+import display
 
 Menu = [
     [1, 'User Login'],
@@ -13,13 +15,32 @@ Menu = [
     [4, 'Exit']
 ]
 
+# Admin listings, exports and reconciliation read from the latest reporting
+# snapshot while this is on (see snapshots.py).
+report_from_snapshot = False
+
+# Modules behind single menu entries are imported where they are used, so
+# a launch only pays for what it runs.
+
 def main():
+    import ledger
+    import metrics
     database.init_db()
+    if database.is_sharded():
+        import shards
+        shards.recover_transfers()
+    success, msg = ledger.recover_log()
+    if not success:
+        print(f"[ERROR] {msg}")
+        sys.exit(1)
+    # A CLI session usually serves one account: load only the accounts it touches.
+    operations.enable_velocity_limits(seed=False)
+    metrics.enable_from_env()
     show_banner()
     
     while True:
         try:
-            print(tabulate(Menu, headers=['OPTION', 'FUNCTION'], tablefmt="fancy_grid", stralign="center", numalign="center"))
+            print(display.table(Menu, headers=['OPTION', 'FUNCTION'], tablefmt="fancy_grid", stralign="center", numalign="center"))
             ch = input("\nChoose Option Number From Menu: ").strip()
             
             if ch == '1':
@@ -41,8 +62,8 @@ def show_banner():
     print()
     print("============================================================")
     try:
-        print(pyfiglet.figlet_format("Bank Management", font="doom"))
-        print(pyfiglet.figlet_format("System", font="doom"))
+        print(display.figlet("Bank Management", font="doom"))
+        print(display.figlet("System", font="doom"))
     except Exception:
         print("       BANK MANAGEMENT SYSTEM       ")
     print("============================================================")
@@ -64,7 +85,8 @@ def user_login_flow():
         
         user = auth.login(acc, pin)
         if user:
-            user_dashboard(user)
+            with session.Session(user) as s:
+                user_dashboard(s)
         else:
             print("\n[ERROR] Invalid Credentials. Access Denied.\n")
     except ValueError:
@@ -86,7 +108,11 @@ def create_account_flow():
                 
             pin = int(pin_input)
             if len(pin_input) == 4:
-                acc = auth.create_account(name, pin)
+                try:
+                    acc = auth.create_account(name, pin)
+                except RuntimeError as e:
+                    print(f"\n[ERROR] {e}\n")
+                    return
                 print(f"\n[SUCCESS] Account Created!")
                 print(f"IMPORTANT: Your Account Number is {acc}")
                 print("Please write this down to login.\n")
@@ -109,9 +135,9 @@ def admin_login_flow():
     else: 
         print("\n[ERROR] Invalid Admin Credentials.\n")
 
-def user_dashboard(user):
+def user_dashboard(s):
     while True:
-        print(f"\n--- DASHBOARD: {user['name']} ---")
+        print(f"\n--- DASHBOARD: {s.name} ---")
         user_menu = [
             ["1", "Check Balance"], 
             ["2", "Deposit"], 
@@ -122,15 +148,16 @@ def user_dashboard(user):
             ["7", "Change PIN"],
             ["8", "Close Account"],
             ["9", "Feedback"], 
-            ["10", "Logout"]
+            ["10", "Account Statement"],
+            ["11", "Logout"]
         ]
-        print(tabulate(user_menu, tablefmt="fancy_grid", stralign="left"))
+        print(display.table(user_menu, tablefmt="fancy_grid", stralign="left"))
         
         try:
             choice = input("\nSelect Action: ").strip()
             
             if choice == '1':
-                print(f"\nBalance: ₹ {operations.get_balance(user['account_number']):.2f}")
+                print(f"\nBalance: ₹ {s.balance:.2f}")
                 input("\nPress Enter to return to Dashboard...")
 
             elif choice == '2':
@@ -138,7 +165,7 @@ def user_dashboard(user):
                     amt_str = input("Enter amount to Deposit: ")
                     if amt_str:
                         amt = float(amt_str)
-                        success, msg = operations.deposit(user['account_number'], amt)
+                        success, msg = s.deposit(amt)
                         print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                 except ValueError: print("Invalid input.")
                 input("\nPress Enter to return to Dashboard...")
@@ -148,7 +175,7 @@ def user_dashboard(user):
                     amt_str = input("Enter amount to Withdraw: ")
                     if amt_str:
                         amt = float(amt_str)
-                        success, msg = operations.withdraw(user['account_number'], amt)
+                        success, msg = s.withdraw(amt)
                         print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                 except ValueError: print("Invalid input.")
                 input("\nPress Enter to return to Dashboard...")
@@ -163,7 +190,7 @@ def user_dashboard(user):
                             print(f"\n[VERIFY] Transferring to: {receiver_name}")
                             if input("Confirm? (y/n): ").lower() in ['y', 'yes']:
                                 amt = float(input("Amount: "))
-                                success, msg = operations.transfer_funds(user['account_number'], target_acc, amt)
+                                success, msg = s.transfer(target_acc, amt)
                                 print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                             else: print("Cancelled.")
                         else: print("\n[ERROR] Account Not Found.")
@@ -171,11 +198,11 @@ def user_dashboard(user):
                 input("\nPress Enter to return to Dashboard...")
 
             elif choice == '5':
-                operations.print_history(user['account_number'])
+                s.print_history()
                 input("\nPress Enter to return to Dashboard...")
 
             elif choice == '6':
-                eligible, amount = operations.check_loan_eligibility(user['account_number'])
+                eligible, amount = s.check_loan_eligibility()
                 if eligible:
                     print(f"\n[CONGRATS] Eligible for loan up to ₹ {amount:.2f}")
                 else:
@@ -186,7 +213,7 @@ def user_dashboard(user):
                 try:
                     new_pin = int(input("Enter New 4-digit PIN: "))
                     if len(str(new_pin)) == 4:
-                        success, msg = operations.update_pin(user['account_number'], new_pin)
+                        success, msg = s.update_pin(new_pin)
                         print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                     else: print("PIN must be 4 digits.")
                 except ValueError: print("Invalid input.")
@@ -195,7 +222,7 @@ def user_dashboard(user):
             elif choice == '8':
                 confirm = input("Close Account permanently? (yes/no): ").lower()
                 if confirm in ['y', 'yes']:
-                    success, msg = operations.close_account(user['account_number'])
+                    success, msg = s.close_account()
                     print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                     if success: return
                 input("\nPress Enter to return to Dashboard...")
@@ -203,11 +230,24 @@ def user_dashboard(user):
             elif choice == '9':
                 msg = input("Message: ")
                 if msg:
-                    success, resp = operations.submit_complaint(user['account_number'], msg)
+                    success, resp = s.submit_complaint(msg)
                     print(f"\n[{'SUCCESS' if success else 'ERROR'}] {resp}")
                 input("\nPress Enter to return to Dashboard...")
 
             elif choice == '10':
+                try:
+                    start_date = input("From Date (YYYY-MM-DD): ").strip()
+                    end_date = input("To Date (YYYY-MM-DD): ").strip()
+                    time.strptime(start_date, "%Y-%m-%d")
+                    time.strptime(end_date, "%Y-%m-%d")
+                    s.print_statement(start_date, end_date)
+                    if input("\nSave as CSV? (y/n): ").lower() in ['y', 'yes']:
+                        success, msg = s.export_statement_csv(start_date, end_date)
+                        print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                except ValueError: print("Invalid date.")
+                input("\nPress Enter to return to Dashboard...")
+
+            elif choice == '11':
                 break
             
             else:
@@ -228,43 +268,73 @@ def admin_dashboard():
             ["5", "View Complaints"],
             ["6", "View Deleted Users"], 
             ["7", "Add New Admin"],
-            ["8", "Logout"]
+            ["8", "Bulk Import"],
+            ["9", "System Metrics"],
+            ["10", "Daily Report"],
+            ["11", "Archive Old Transactions"],
+            ["12", "Reconcile Ledger"],
+            ["13", "Interest & Fee Cycle"],
+            ["14", "Reporting Snapshot"],
+            ["15", "Search Customers"],
+            ["16", "Search Complaints"],
+            ["17", "Velocity Limits"],
+            ["18", "Logout"]
         ]
-        print(tabulate(admin_menu, tablefmt="fancy_grid", stralign="left"))
+        print(display.table(admin_menu, tablefmt="fancy_grid", stralign="left"))
         
         try:
             choice = input("\nSelect Action: ").strip()
             
             if choice == '1':
-                operations.get_all_users()
-                input("\nPress Enter to return to Admin Menu...")
+                browse_report(operations.get_all_users)
 
             elif choice == '2':
-                operations.get_all_transactions()
-                input("\nPress Enter to return to Admin Menu...")
+                print("\n--- FILTER TRANSACTIONS (press Enter to skip a filter) ---")
+                try:
+                    filters = prompt_filters(include_type=True)
+                    browse_report(operations.get_all_transactions, **filters)
+                except ValueError:
+                    print("Invalid input.")
+                    input("\nPress Enter to return to Admin Menu...")
 
             elif choice == '3':
                 confirm = input("Apply 5% interest to ALL users? (yes/no): ").lower()
                 if confirm in ['y', 'yes']:
-                    success, msg = operations.apply_interest_to_all()
+                    success, msg = operations.apply_interest_to_all(progress=show_interest_progress)
+                    print()
                     print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
                 else:
                     print("\nOperation Cancelled.")
                 input("\nPress Enter to return to Admin Menu...")
 
             elif choice == '4':
-                success, msg = operations.export_transactions_csv()
-                print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                print("\n--- EXPORT TRANSACTIONS (press Enter to skip a filter) ---")
+                try:
+                    filters = prompt_filters()
+                    incremental = input("Only rows added since the last export? (y/n): ").lower() in ['y', 'yes']
+                    compress = input("Compress with gzip? (y/n): ").lower() in ['y', 'yes']
+                    filename = "bank_transactions_report.csv"
+                    if incremental:
+                        filename = f"bank_transactions_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+                    import snapshots
+                    with snapshots.reporting(report_from_snapshot):
+                        success, msg = operations.export_transactions_csv(filename, compress=compress, incremental=incremental, **filters)
+                    print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                except ValueError: print("Invalid input.")
                 input("\nPress Enter to return to Admin Menu...")
 
             elif choice == '5':
-                operations.get_all_complaints()
-                input("\nPress Enter to return to Admin Menu...")
+                print("\n--- FILTER COMPLAINTS (press Enter to skip a filter) ---")
+                try:
+                    filters = prompt_filters()
+                    browse_report(operations.get_all_complaints, **filters)
+                except ValueError:
+                    print("Invalid input.")
+                    input("\nPress Enter to return to Admin Menu...")
 
             elif choice == '6':
                 print("\n--- DELETED / PAST USERS RECORDS ---")
-                operations.get_deleted_users()
-                input("\nPress Enter to return to Admin Menu...")
+                browse_report(operations.get_deleted_users)
 
             elif choice == '7':
                 print("\n--- ADD NEW ADMIN ---")
@@ -281,6 +351,74 @@ def admin_dashboard():
                 input("\nPress Enter to return to Admin Menu...")
 
             elif choice == '8':
+                print("\n--- BULK IMPORT (CSV or JSONL) ---")
+                print("Columns: type (DEPOSIT/WITHDRAWAL/TRANSFER), account_number, amount, receiver_account")
+                path = input("File path (Enter to cancel): ").strip()
+                if path:
+                    import ingest
+                    success, msg = ingest.ingest_file(path, progress=show_ingest_progress)
+                    print()
+                    print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                input("\nPress Enter to return to Admin Menu...")
+
+            elif choice == '9':
+                metrics_screen()
+
+            elif choice == '10':
+                print("\n--- DAILY REPORT (press Enter to skip a filter) ---")
+                if input("Rebuild summaries from the ledger first? (y/n): ").lower() in ['y', 'yes']:
+                    success, msg = operations.rebuild_daily_summaries()
+                    print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                try:
+                    filters = prompt_filters(include_account=False)
+                    browse_report(operations.get_daily_summary, **filters)
+                except ValueError:
+                    print("Invalid input.")
+                    input("\nPress Enter to return to Admin Menu...")
+
+            elif choice == '11':
+                import archive
+                print("\n--- ARCHIVE OLD TRANSACTIONS ---")
+                try:
+                    days_input = input(f"Archive transactions older than how many days? [{archive.ARCHIVE_AFTER_DAYS}]: ").strip()
+                    days = int(days_input) if days_input else archive.ARCHIVE_AFTER_DAYS
+                    if input(f"Move transactions older than {days} days to monthly archive files? (y/n): ").lower() in ['y', 'yes']:
+                        success, msg = archive.archive_transactions(days, progress=show_archive_progress)
+                        print()
+                        print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                    else:
+                        print("\nOperation Cancelled.")
+                except ValueError: print("Invalid input.")
+                input("\nPress Enter to return to Admin Menu...")
+
+            elif choice == '12':
+                import reconcile
+                print("\n--- LEDGER RECONCILIATION ---")
+                success, msg = reconcile.reconcile_ledger(progress=show_reconcile_progress, snapshot=report_from_snapshot)
+                print()
+                print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+                input("\nPress Enter to return to Admin Menu...")
+
+            elif choice == '13':
+                rate_cycle_screen()
+
+            elif choice == '14':
+                snapshot_screen()
+
+            elif choice in ('15', '16'):
+                search = operations.search_customers if choice == '15' else operations.search_complaints
+                text = input("Search for (words or word prefixes, Enter to cancel): ").strip()
+                if text:
+                    try:
+                        browse_pages(search, text=text)
+                    except ValueError as e:
+                        print(f"\n[ERROR] {e}")
+                        input("\nPress Enter to return to Admin Menu...")
+
+            elif choice == '17':
+                velocity_screen()
+
+            elif choice == '18':
                 break
             
             else:
@@ -290,5 +428,156 @@ def admin_dashboard():
             print("\nLogging out...")
             break
 
+def snapshot_screen():
+    global report_from_snapshot
+    import snapshots
+    while True:
+        current = snapshots.latest()
+        source = "latest snapshot" if report_from_snapshot else "live database"
+        print("\n--- REPORTING SNAPSHOT ---")
+        print(f"Latest snapshot: {current[0] if current else 'none'} | admin reports read from the {source}")
+        action = input("\n[T]ake a snapshot now, [U]se snapshot for reports on/off, Enter to return: ").strip().lower()
+        if action == 't':
+            success, msg = snapshots.take_snapshot(progress=show_snapshot_progress)
+            print()
+            print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+        elif action == 'u':
+            report_from_snapshot = not report_from_snapshot
+        elif action == '':
+            break
+
+def velocity_screen():
+    tracker = operations.enable_velocity_limits()
+    while True:
+        print("\n--- VELOCITY LIMITS ---")
+        rules = [[name, ", ".join(kinds), f"{window / 3600:g} h", max_count if max_count is not None else "-",
+                  f"₹ {max_amount:.2f}" if max_amount is not None else "-"] for name, kinds, window, max_count, max_amount in tracker.rules]
+        print(tabulate(rules, headers=["Rule", "Types", "Window", "Max Postings", "Max Amount"], tablefmt="fancy_grid"))
+        throttled = tracker.throttled()
+        if throttled:
+            print(tabulate(throttled, headers=["Account", "Last Rule Hit", "Rejections", "Last Rejected"], tablefmt="fancy_grid"))
+        else:
+            print("No accounts throttled in the last window.")
+        s = tracker.stats()
+        print(f"\nTracking {s['accounts']}/{s['max_accounts']} accounts in {s['buckets']} buckets per window | evictions {s['evictions']}")
+        action = input("\n[A]ccount usage, [R]eload from the ledger, Enter to return: ").strip().lower()
+        if action == 'a':
+            try:
+                acc = int(input("Account Num: ").strip())
+                usage = [[name, count, f"₹ {amount:.2f}"] for name, count, amount in tracker.usage(acc)]
+                print(tabulate(usage, headers=["Rule", "Postings", "Amount"], tablefmt="fancy_grid"))
+            except ValueError:
+                print("Invalid input.")
+        elif action == 'r':
+            print(f"\n[SUCCESS] {tracker.seed()} accounts loaded from the recent ledger.")
+        elif action == '':
+            break
+
+def metrics_screen():
+    import metrics
+    while True:
+        state = "ON" if metrics.is_enabled() else "OFF"
+        print(f"\n--- SYSTEM METRICS (collection {state}) ---")
+        rows = [[name, s['calls'], s['errors'], s['failures'], f"{s['avg_ms']:.3f}", f"{s['p50_ms']:g}", f"{s['p99_ms']:g}", 
+                 f"{s['max_ms']:.3f}", f"{s['statements'] / s['calls']:.1f}"] for name, s in metrics.snapshot().items()]
+        if rows:
+            print(tabulate(rows, headers=["Operation", "Calls", "Errors", "Failed", "Avg ms", "p50 ms", "p99 ms", "Max ms", "SQL/call"], 
+                           tablefmt="fancy_grid"))
+        else:
+            print("No operations recorded yet.")
+        c = account_cache.stats()
+        print(f"\nAccount cache: {c['size']}/{c['max_size']} entries, TTL {c['ttl_s']:g}s | hits {c['hits']}, misses {c['misses']} "
+              f"({c['hit_ratio']:.1%} hit ratio) | evictions {c['evictions']}, expirations {c['expirations']}, invalidations {c['invalidations']}")
+        action = input("\n[T]oggle collection, [R]eset, [D]ump to file, Enter to return: ").strip().lower()
+        if action == 't':
+            metrics.disable() if metrics.is_enabled() else metrics.enable()
+        elif action == 'r':
+            metrics.reset()
+            account_cache.reset_stats()
+        elif action == 'd':
+            path = input("File name (.json, or .prom for Prometheus text) [bank_metrics.json]: ").strip() or "bank_metrics.json"
+            try:
+                print(f"\n[SUCCESS] Metrics written to '{metrics.dump(path)}'")
+            except OSError as e:
+                print(f"\n[ERROR] {e}")
+        elif action == '':
+            break
+
+def browse_report(view, **filters):
+    import snapshots
+    with snapshots.reporting(report_from_snapshot) as name:
+        if name:
+            print(f"(reading reporting snapshot {name})")
+        browse_pages(view, **filters)
+
+def browse_pages(view, **filters):
+    # Stack of page cursors; the first page starts from the newest/lowest key.
+    cursors = [None]
+    while True:
+        next_cursor = view(cursors[-1], **filters)
+        options = []
+        if next_cursor is not None: options.append("[N]ext")
+        if len(cursors) > 1: options.append("[P]revious")
+        options.append("Enter to return")
+        nav = input(f"\nPage {len(cursors)} | {', '.join(options)}: ").strip().lower()
+        if nav == 'n' and next_cursor is not None:
+            cursors.append(next_cursor)
+        elif nav == 'p' and len(cursors) > 1:
+            cursors.pop()
+        elif nav == '':
+            break
+
+def prompt_filters(include_type=False, include_account=True):
+    filters = {}
+    acc_input = input("Account Num: ").strip() if include_account else ""
+    if acc_input:
+        filters['account_number'] = int(acc_input)
+    if include_type:
+        type_input = input("Type (DEPOSIT/WITHDRAWAL/TRANSFER_SENT/TRANSFER_RECEIVED/INTEREST_CREDIT/MONTHLY_FEE/MIN_BALANCE_PENALTY): ").strip().upper()
+        if type_input:
+            filters['transaction_type'] = type_input
+    for key, label in [('start_date', "From Date (YYYY-MM-DD): "), ('end_date', "To Date (YYYY-MM-DD): ")]:
+        date_input = input(label).strip()
+        if date_input:
+            time.strptime(date_input, "%Y-%m-%d")
+            filters[key] = date_input
+    return filters
+
+def rate_cycle_screen():
+    import rates
+    print("\n--- INTEREST & FEE CYCLE ---")
+    tiers = ", ".join(f"{rate:.2%} from ₹ {low:g}" for low, rate in rates.INTEREST_TIERS)
+    print(f"Tiers: {tiers} | fee ₹ {rates.MONTHLY_FEE:g} below ₹ {rates.FEE_WAIVER_BALANCE:g} | "
+          f"penalty ₹ {rates.MIN_BALANCE_PENALTY:g} below ₹ {rates.MIN_BALANCE:g}")
+    try:
+        cycle = input(f"Cycle [{rates.default_cycle()}]: ").strip() or None
+        days_input = input(f"Days of interest [{rates.CYCLE_DAYS}]: ").strip()
+        days = int(days_input) if days_input else rates.CYCLE_DAYS
+        charge_fees = input("Charge fees and penalties? (y/n): ").lower() in ['y', 'yes']
+        success, msg = rates.run_cycle(days, charge_fees, dry_run=True, cycle=cycle, progress=show_interest_progress)
+        print()
+        print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+        if success and input("Apply this cycle to ALL users? (yes/no): ").lower() in ['y', 'yes']:
+            success, msg = rates.run_cycle(days, charge_fees, cycle=cycle, progress=show_interest_progress)
+            print()
+            print(f"\n[{'SUCCESS' if success else 'ERROR'}] {msg}")
+    except ValueError: print("Invalid input.")
+    input("\nPress Enter to return to Admin Menu...")
+
+def show_interest_progress(done, total):
+    print(f"\r  Credited {done}/{total} accounts...", end="", flush=True)
+
+def show_ingest_progress(applied, failed):
+    print(f"\r  Applied {applied} rows, {failed} failed...", end="", flush=True)
+
+def show_archive_progress(moved):
+    print(f"\r  Archived {moved} transactions...", end="", flush=True)
+
+def show_snapshot_progress(pages):
+    print(f"\r  Copied {pages} pages...", end="", flush=True)
+
+def show_reconcile_progress(done, total):
+    print(f"\r  Checked {done}/{total} ranges...", end="", flush=True)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,182 @@
+import functools
+import json
+import os
+import threading
+import time
+import database
+
+# Per-operation call counts, latency histograms, SQL statement counts and
+# error counts for the public functions of operations.py and auth.py.
+# Instrumentation is installed by wrapping the module functions in enable()
+# and removed again in disable(), so a disabled build runs the original
+# functions with no wrapper at all. Callers therefore look the functions up
+# on the module (operations.deposit(...)): a name bound by
+# "from operations import ..." keeps the unwrapped function.
+
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+METRICS_ENV = "BANK_METRICS"
+
+class OperationStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.failures = 0
+        self.statements = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def percentile(self, pct):
+        # Upper bound of the bucket holding the requested rank.
+        if not self.calls:
+            return 0.0
+        rank = pct / 100 * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if seen >= rank:
+                return float(LATENCY_BUCKETS_MS[i])
+        return self.max_ms
+
+_stats = {}
+_lock = threading.Lock()
+_local = threading.local()
+_originals = {}
+
+def _stats_for(name):
+    stats = _stats.get(name)
+    if stats is None:
+        with _lock:
+            stats = _stats.setdefault(name, OperationStats())
+    return stats
+
+def _on_statement(_sql):
+    # Statements count towards every instrumented call active on this thread.
+    for stats in getattr(_local, "stack", ()):
+        stats.statements += 1
+
+def _wrap(name, fn):
+    stats = _stats_for(name)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(stats)
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with _lock:
+                stats.errors += 1
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            stack.pop()
+            with _lock:
+                stats.observe(elapsed_ms)
+        if isinstance(result, tuple) and result and result[0] is False:
+            with _lock:
+                stats.failures += 1
+        return result
+    return wrapper
+
+def _instrumented_modules():
+    import auth
+    import operations
+    return [operations, auth]
+
+def is_enabled():
+    return bool(_originals)
+
+def enable():
+    if _originals:
+        return
+    for module in _instrumented_modules():
+        prefix = module.__name__
+        for attr, value in list(vars(module).items()):
+            if attr.startswith("_") or not callable(value) or getattr(value, "__module__", None) != prefix:
+                continue
+            _originals[(module, attr)] = value
+            setattr(module, attr, _wrap(f"{prefix}.{attr}", value))
+    database.set_trace_callback(_on_statement)
+
+def disable():
+    database.set_trace_callback(None)
+    for (module, attr), fn in _originals.items():
+        setattr(module, attr, fn)
+    _originals.clear()
+
+def enable_from_env():
+    if os.environ.get(METRICS_ENV, "").lower() in ("1", "true", "yes", "on"):
+        enable()
+
+def reset():
+    # Installed wrappers hold on to their stats objects, so clear in place.
+    with _lock:
+        for stats in _stats.values():
+            stats.__init__()
+
+def snapshot():
+    with _lock:
+        return {
+            name: {
+                "calls": s.calls,
+                "errors": s.errors,
+                "failures": s.failures,
+                "statements": s.statements,
+                "total_ms": s.total_ms,
+                "avg_ms": s.total_ms / s.calls if s.calls else 0.0,
+                "p50_ms": s.percentile(50),
+                "p99_ms": s.percentile(99),
+                "max_ms": s.max_ms,
+                "buckets": dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ["+Inf"], s.buckets)),
+            }
+            for name, s in sorted(_stats.items()) if s.calls
+        }
+
+def to_prometheus(data=None):
+    data = snapshot() if data is None else data
+    lines = [
+        "# HELP bank_operation_latency_ms Operation latency in milliseconds.",
+        "# TYPE bank_operation_latency_ms histogram",
+    ]
+    for name, s in data.items():
+        cumulative = 0
+        for bound, count in s["buckets"].items():
+            cumulative += count
+            lines.append(f'bank_operation_latency_ms_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'bank_operation_latency_ms_sum{{operation="{name}"}} {s["total_ms"]:.6f}')
+        lines.append(f'bank_operation_latency_ms_count{{operation="{name}"}} {s["calls"]}')
+    for metric, key, help_text in [
+        ("bank_operation_errors_total", "errors", "Calls that raised an exception."),
+        ("bank_operation_failures_total", "failures", "Calls that returned a failure result."),
+        ("bank_operation_sql_statements_total", "statements", "SQL statements executed by the operation."),
+    ]:
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, s in data.items():
+            lines.append(f'{metric}{{operation="{name}"}} {s[key]}')
+    return "\n".join(lines) + "\n"
+
+def dump(path):
+    # .prom / .txt files get Prometheus text format, anything else JSON.
+    data = snapshot()
+    with open(path, "w") as f:
+        if path.endswith((".prom", ".txt")):
+            f.write(to_prometheus(data))
+        else:
+            json.dump(data, f, indent=2)
+    return path
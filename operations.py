@@ -1,291 +1,743 @@
 import csv
+import math
+import re
 import sqlite3
+import contextlib
+import heapq
+from itertools import chain, islice
+from operator import itemgetter
 from datetime import datetime, timedelta, timezone
-from database import get_connection
-from tabulate import tabulate
+import database
+from database import connection
+from cache import account_cache
+import groupcommit
+import shards
+import summaries
+import archive
+from display import tabulate
+
+INTEREST_RATE = 0.05
+INTEREST_CHUNK_SIZE = 10000
+EXPORT_BATCH_SIZE = 5000
+PAGE_SIZE = 20
+
+# Opt-in shared-commit mode for postings, see enable_group_commit().
+# One committer per shard (just one without sharding).
+_group_committers = {}
+# Opt-in in-memory ledger engine, see enable_ledger_engine().
+_ledger_engine = None
+# Opt-in per-account velocity limits, see enable_velocity_limits().
+_velocity = None
 
 # HELPER FUNCTIONS
 
+def get_account(account_number):
+    # Read-through lookup of (account_number, name, pin, balance).
+    row = account_cache.get(account_number)
+    if row is None:
+        version = account_cache.version(account_number)
+        with connection(account_number) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT account_number, name, pin, balance FROM users WHERE account_number = ?", (account_number,))
+            row = cursor.fetchone()
+        if row:
+            account_cache.put(account_number, row, version)
+    return live_account(row)
+
+def live_account(row):
+    # While the ledger engine runs, its balance is the current one.
+    if row is not None and _ledger_engine is not None:
+        row = (*row[:3], _ledger_engine.get_balance(row[0]))
+    return row
+
 def get_user_name(account_number):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT name FROM users WHERE account_number = ?", (account_number,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
+    result = get_account(account_number)
+    return result[1] if result else None
 
 def get_ist_time():
     now_utc = datetime.now(timezone.utc)
     now_ist = now_utc + timedelta(hours=5, minutes=30)
     return now_ist.strftime("%Y-%m-%d %H:%M:%S")
 
+# POSTING CORE
+# Each post_* function runs inside the caller's write transaction and never
+# commits. Balance checks are folded into guarded UPDATE ... RETURNING
+# statements, so there is no read-then-write window between callers. When a
+# post_* function returns False the caller must roll back its transaction.
+# Every ledger row carries the balance it left behind (balance_after), and
+# timestamps are taken under the write lock so they never run backwards
+# against ids; statements and point-in-time balances rely on both.
+
+def _record(cursor, entries):
+    cursor.executemany("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) VALUES (?, ?, ?, ?, ?, ?)", 
+                       entries)
+    summaries.record(cursor, entries)
+
+def post_deposit(cursor, account_number, amount, current_time):
+    cursor.execute("UPDATE users SET balance = balance + ? WHERE account_number = ? RETURNING name, balance", 
+                   (amount, account_number))
+    row = cursor.fetchone()
+    if not row: return False, "Account not found."
+    name, new_balance = row
+    _record(cursor, [(account_number, name, 'DEPOSIT', amount, current_time, new_balance)])
+    return True, f"Deposit successful. New Balance: ₹ {new_balance:.2f}"
+
+def post_withdrawal(cursor, account_number, amount, current_time):
+    cursor.execute("UPDATE users SET balance = balance - ? WHERE account_number = ? AND balance >= ? RETURNING name, balance", 
+                   (amount, account_number, amount))
+    row = cursor.fetchone()
+    if not row: return False, "Insufficient funds."
+    name, new_balance = row
+    _record(cursor, [(account_number, name, 'WITHDRAWAL', amount, current_time, new_balance)])
+    return True, f"Withdrawal successful. Remaining Balance: ₹ {new_balance:.2f}"
+
+def post_transfer(cursor, sender_acc, receiver_acc, amount, current_time):
+    cursor.execute("UPDATE users SET balance = balance - ? WHERE account_number = ? AND balance >= ? RETURNING name, balance", 
+                   (amount, sender_acc, amount))
+    sender = cursor.fetchone()
+    if not sender: return False, "Insufficient funds."
+    cursor.execute("UPDATE users SET balance = balance + ? WHERE account_number = ? RETURNING name, balance", 
+                   (amount, receiver_acc))
+    receiver = cursor.fetchone()
+    if not receiver: return False, "Receiver account not found."
+    _record(cursor, [(sender_acc, sender[0], 'TRANSFER_SENT', amount, current_time, sender[1]), 
+                     (receiver_acc, receiver[0], 'TRANSFER_RECEIVED', amount, current_time, receiver[1])])
+    return True, "Transfer successful."
+
+def enable_group_commit(max_batch=groupcommit.MAX_BATCH, max_delay=groupcommit.MAX_DELAY):
+    if not _group_committers:
+        for shard in range(database.shard_count()):
+            _group_committers[shard] = groupcommit.GroupCommitter(get_ist_time, max_batch, max_delay, shard)
+    return _group_committers
+
+def disable_group_commit():
+    committers = list(_group_committers.values())
+    _group_committers.clear()
+    for committer in committers:
+        committer.stop()
+
+def enable_ledger_engine(**options):
+    global _ledger_engine
+    if _ledger_engine is None:
+        import ledger  # imported on demand: it loads every balance into memory
+        _ledger_engine = ledger.LedgerEngine(**options)
+    return _ledger_engine
+
+def disable_ledger_engine():
+    global _ledger_engine
+    engine, _ledger_engine = _ledger_engine, None
+    if engine:
+        engine.stop()
+
+def enable_velocity_limits(rules=None, seed=True, **options):
+    # seed=False skips loading the whole recent ledger up front; each
+    # account's recent rows are then read on its first posting instead.
+    global _velocity
+    if _velocity is None:
+        import velocity
+        tracker = velocity.VelocityTracker(rules or velocity.load_rules(), **options)
+        if seed:
+            tracker.seed()
+        _velocity = tracker
+    return _velocity
+
+def disable_velocity_limits():
+    global _velocity
+    _velocity = None
+
+def _limited(kind, post, account_number, *args):
+    # Reserves the amount (the last argument) against the account's velocity
+    # limits before posting, and gives it back if the posting fails.
+    tracker, amount = _velocity, args[-1]
+    if tracker is None:
+        return post(account_number, *args)
+    allowed, msg, token = tracker.reserve(account_number, kind, amount)
+    if not allowed:
+        return False, msg
+    success, msg = post(account_number, *args)
+    if not success:
+        tracker.release(account_number, kind, amount, token)
+    return success, msg
+
+def _run_posting(post, accounts, *args):
+    # Every account in `accounts` lives in the shard of the first one.
+    committer = _group_committers.get(database.shard_for(accounts[0]))
+    if committer is not None:
+        return committer.submit(post, accounts, *args)
+    with connection(accounts[0]) as conn:
+        cursor = conn.cursor()
+        try:
+            # Take the write lock up front so the guarded update and the ledger
+            # rows land in one serialized transaction.
+            cursor.execute("BEGIN IMMEDIATE")
+            success, msg = post(cursor, *args, get_ist_time())
+            if success:
+                conn.commit()
+                account_cache.invalidate(*accounts)
+            else:
+                conn.rollback()
+            return success, msg
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+
+def _amount_error(amount):
+    # The check every posting entry point shares with bulk import
+    # (ingest.parse_posting): NaN and infinity both pass a plain "<= 0".
+    if not math.isfinite(amount): return "Amount must be a finite number."
+    if amount <= 0: return "Amount must be positive."
+    return None
+
 # USER OPERATIONS
 
 def get_balance(account_number):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT balance FROM users WHERE account_number = ?", (account_number,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 0.0
+    if _ledger_engine is not None:
+        return _ledger_engine.get_balance(account_number)
+    result = get_account(account_number)
+    return result[3] if result else 0.0
 
 def deposit(account_number, amount):
-    if amount <= 0: return False, "Amount must be positive."
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        current_time = get_ist_time()
-        
-        cursor.execute("SELECT name FROM users WHERE account_number = ?", (account_number,))
-        name = cursor.fetchone()[0]
-
-        cursor.execute("UPDATE users SET balance = balance + ? WHERE account_number = ?", (amount, account_number))
-        cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp) VALUES (?, ?, 'DEPOSIT', ?, ?)", 
-                       (account_number, name, amount, current_time))
-        
-        cursor.execute("SELECT balance FROM users WHERE account_number = ?", (account_number,))
-        new_balance = cursor.fetchone()[0]
-        
-        conn.commit()
-        return True, f"Deposit successful. New Balance: ₹ {new_balance:.2f}"
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+    error = _amount_error(amount)
+    if error: return False, error
+    if _ledger_engine is not None:
+        return _ledger_engine.deposit(account_number, amount)
+    return _run_posting(post_deposit, (account_number,), account_number, amount)
 
 def withdraw(account_number, amount):
-    balance = get_balance(account_number)
-    if amount <= 0: return False, "Amount must be positive."
-    if balance < amount: return False, "Insufficient funds."
-    
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        current_time = get_ist_time()
-        
-        cursor.execute("SELECT name FROM users WHERE account_number = ?", (account_number,))
-        name = cursor.fetchone()[0]
+    error = _amount_error(amount)
+    if error: return False, error
+    return _limited('WITHDRAWAL', _withdraw, account_number, amount)
 
-        cursor.execute("UPDATE users SET balance = balance - ? WHERE account_number = ?", (amount, account_number))
-        cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp) VALUES (?, ?, 'WITHDRAWAL', ?, ?)", 
-                       (account_number, name, amount, current_time))
-        
-        cursor.execute("SELECT balance FROM users WHERE account_number = ?", (account_number,))
-        new_balance = cursor.fetchone()[0]
-        
-        conn.commit()
-        return True, f"Withdrawal successful. Remaining Balance: ₹ {new_balance:.2f}"
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+def _withdraw(account_number, amount):
+    if _ledger_engine is not None:
+        return _ledger_engine.withdraw(account_number, amount)
+    return _run_posting(post_withdrawal, (account_number,), account_number, amount)
 
 def transfer_funds(sender_acc, receiver_acc, amount):
-    sender_bal = get_balance(sender_acc)
-    if amount <= 0: return False, "Amount must be positive."
-    if sender_bal < amount: return False, "Insufficient funds."
-    if str(sender_acc) == str(receiver_acc): return False, "Cannot transfer to self."
-    
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        current_time = get_ist_time()
-        
-        cursor.execute("SELECT account_number, name FROM users WHERE account_number = ?", (receiver_acc,))
-        receiver_data = cursor.fetchone()
-        if not receiver_data: return False, "Receiver account not found."
-        receiver_name = receiver_data[1]
+    error = _amount_error(amount)
+    if error: return False, error
+    return _limited('TRANSFER_SENT', _transfer_funds, sender_acc, receiver_acc, amount)
 
-        cursor.execute("SELECT name FROM users WHERE account_number = ?", (sender_acc,))
-        sender_name = cursor.fetchone()[0]
+def _transfer_funds(sender_acc, receiver_acc, amount):
+    if _ledger_engine is not None:
+        return _ledger_engine.transfer_funds(sender_acc, receiver_acc, amount)
+    if str(sender_acc) == str(receiver_acc): return False, "Cannot transfer to self."
+    if database.shard_for(sender_acc) != database.shard_for(receiver_acc):
+        return shards.transfer(sender_acc, receiver_acc, amount)
+    return _run_posting(post_transfer, (sender_acc, receiver_acc), sender_acc, receiver_acc, amount)
 
-        cursor.execute("UPDATE users SET balance = balance - ? WHERE account_number = ?", (amount, sender_acc))
-        cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp) VALUES (?, ?, 'TRANSFER_SENT', ?, ?)", 
-                       (sender_acc, sender_name, amount, current_time))
-        
-        cursor.execute("UPDATE users SET balance = balance + ? WHERE account_number = ?", (amount, receiver_acc))
-        cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp) VALUES (?, ?, 'TRANSFER_RECEIVED', ?, ?)", 
-                       (receiver_acc, receiver_name, amount, current_time))
-        
-        conn.commit()
-        return True, "Transfer successful."
-    except Exception as e:
-        conn.rollback()
-        return False, str(e)
-    finally:
-        conn.close()
+def fetch_history(account_number, limit=10):
+    with connection(account_number) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT transaction_type, amount, timestamp FROM transactions WHERE account_number = ? ORDER BY id DESC LIMIT ?", (account_number, limit))
+        rows = cursor.fetchall()
+        if len(rows) < limit:
+            files = archive.files_for(cursor, account_number=account_number)
+            if files:
+                older = archive.iter_rows(conn, "transaction_type, amount, timestamp, id", "account_number = ?", [account_number], 
+                                          files, "id DESC", limit, descending=True, hot=False)
+                with contextlib.closing(older):
+                    rows += [row[:3] for row in islice(older, limit - len(rows))]
+        return rows
 
 def print_history(account_number):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT transaction_type, amount, timestamp FROM transactions WHERE account_number = ? ORDER BY id DESC LIMIT 10", (account_number,))
-    rows = cursor.fetchall()
-    conn.close()
+    rows = fetch_history(account_number)
     if rows:
         print(tabulate(rows, headers=["Type", "Amount", "Time (IST)"], tablefmt="fancy_grid"))
     else:
         print("No transactions found.")
 
-def check_loan_eligibility(account_number):
-    balance = get_balance(account_number)
+def _balance_before(conn, account_number, bound):
+    # One seek on idx_transactions_account_timestamp: the last row before
+    # `bound` already carries the balance, nothing is replayed.
+    cursor = conn.cursor()
+    cursor.execute("SELECT balance_after, id FROM transactions WHERE account_number = ? AND timestamp < ? ORDER BY timestamp DESC, id DESC LIMIT 1",
+                   (account_number, bound))
+    row = cursor.fetchone()
+    return (row[0], row[1]) if row else archive.balance_before(conn, account_number, bound)
+
+def get_balance_at(account_number, when):
+    # `when` is a timestamp, or a plain date meaning the end of that day.
+    if len(when) == 10:
+        when += " 23:59:59"
+    with connection(account_number) as conn:
+        # "~" sorts after every timestamp character, so this includes `when`.
+        return _balance_before(conn, account_number, when + "~")[0]
+
+def generate_statement(account_number, start_date, end_date, batch_size=EXPORT_BATCH_SIZE):
+    # Returns (opening, closing, rows). Rows are streamed lazily in batches and
+    # stop at the row the closing balance came from, so a posting that lands
+    # while the statement is being read cannot make the two disagree.
+    with connection(account_number) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT date(?), date(?, '+1 day')", (start_date, end_date))
+        start, end = cursor.fetchone()
+        if start is None or end is None:
+            raise ValueError("Dates must be in YYYY-MM-DD format.")
+        opening, _ = _balance_before(conn, account_number, start)
+        closing, last_id = _balance_before(conn, account_number, end)
+        files = archive.files_for(cursor, start, end, account_number=account_number)
+
+    def rows():
+        with connection(account_number) as conn:
+            for row in archive.iter_rows(conn, "timestamp, transaction_type, amount, balance_after, id", 
+                                         "account_number = ? AND timestamp >= ? AND timestamp < ? AND id <= ?", 
+                                         [account_number, start, end, last_id], files, "timestamp, id", batch_size):
+                yield row[:4]
+
+    return opening, closing, rows()
+
+def print_statement(account_number, start_date, end_date):
+    try:
+        opening, closing, rows = generate_statement(account_number, start_date, end_date)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print(f"Statement for {account_number}: {start_date} to {end_date}")
+    print(f"Opening Balance: ₹ {opening:.2f}")
+    rows = list(rows)
+    if rows:
+        print(tabulate(rows, headers=["Time (IST)", "Type", "Amount", "Balance"], tablefmt="fancy_grid", floatfmt=".2f"))
+    else:
+        print("No transactions in this period.")
+    print(f"Closing Balance: ₹ {closing:.2f}")
+
+def export_statement_csv(account_number, start_date, end_date, filename=None):
+    filename = filename or f"statement_{account_number}_{start_date}_{end_date}.csv"
+    try:
+        opening, closing, rows = generate_statement(account_number, start_date, end_date)
+        count = 0
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Time (IST)", "Type", "Amount", "Balance"])
+            writer.writerow([start_date, "OPENING_BALANCE", "", f"{opening:.2f}"])
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+            writer.writerow([end_date, "CLOSING_BALANCE", "", f"{closing:.2f}"])
+        return True, f"Statement with {count} transactions saved as '{filename}'"
+    except Exception as e:
+        return False, str(e)
+
+def check_loan_eligibility(account_number, balance=None):
+    if balance is None:
+        balance = get_balance(account_number)
     if balance >= 5000:
         return True, balance * 5
     return False, 0.0
 
 def update_pin(account_number, new_pin):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("UPDATE users SET pin = ? WHERE account_number = ?", (new_pin, account_number))
-        conn.commit()
-        return True, "PIN updated successfully."
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+    with connection(account_number) as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("UPDATE users SET pin = ? WHERE account_number = ?", (new_pin, account_number))
+            conn.commit()
+            account_cache.invalidate(account_number)
+            return True, "PIN updated successfully."
+        except Exception as e:
+            return False, str(e)
 
 def close_account(account_number):
-    balance = get_balance(account_number)
-    if balance > 0:
-        return False, "Cannot close account with remaining balance. Please withdraw funds first."
-    
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        current_time = get_ist_time()
-        
+    if _ledger_engine is not None:
+        return _ledger_engine.release_account(account_number, lambda: _close_account(account_number))
+    return _close_account(account_number)
+
+def _close_account(account_number):
+    with connection(account_number) as conn:
+        cursor = conn.cursor()
+        # The checks and the delete share one write transaction, so no
+        # transfer branch can be prepared on the account in between.
+        cursor.execute("BEGIN IMMEDIATE")
         cursor.execute("SELECT * FROM users WHERE account_number = ?", (account_number,))
         user_data = cursor.fetchone()
+        balance = user_data[3] if user_data else 0.0
+        if balance > 0:
+            return False, "Cannot close account with remaining balance. Please withdraw funds first."
+        # A cross-shard transfer still being settled may move money in or back.
+        cursor.execute("SELECT 1 FROM transfer_branches WHERE account_number = ? AND state = 'PREPARED' LIMIT 1", (account_number,))
+        if cursor.fetchone():
+            return False, "A transfer on this account is still being settled. Please try again shortly."
         
-        if user_data:
-            cursor.execute("INSERT INTO deleted_users (account_number, name, pin, balance, closed_at) VALUES (?, ?, ?, ?, ?)", 
-                           (user_data[0], user_data[1], user_data[2], user_data[3], current_time))
+        try:
+            current_time = get_ist_time()
+            
+            if user_data:
+                cursor.execute("INSERT INTO deleted_users (account_number, name, pin, balance, closed_at) VALUES (?, ?, ?, ?, ?)", 
+                               (user_data[0], user_data[1], user_data[2], user_data[3], current_time))
 
-        cursor.execute("DELETE FROM users WHERE account_number = ?", (account_number,))
-        conn.commit()
-        return True, "Account closed successfully. Records archived."
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+            cursor.execute("DELETE FROM users WHERE account_number = ?", (account_number,))
+            conn.commit()
+            account_cache.invalidate(account_number)
+            return True, "Account closed successfully. Records archived."
+        except Exception as e:
+            return False, str(e)
 
-def submit_complaint(account_number, message):
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        current_time = get_ist_time()
-        
-        cursor.execute("SELECT name FROM users WHERE account_number = ?", (account_number,))
-        name = cursor.fetchone()[0]
+def submit_complaint(account_number, message, name=None):
+    if name is None:
+        user_data = get_account(account_number)
+        if not user_data: return False, "Account not found."
+        name = user_data[1]
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            current_time = get_ist_time()
 
-        cursor.execute("INSERT INTO complaints (account_number, name, message, timestamp) VALUES (?, ?, ?, ?)", 
-                       (account_number, name, message, current_time))
-        conn.commit()
-        return True, "Feedback submitted successfully."
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+            cursor.execute("INSERT INTO complaints (account_number, name, message, timestamp) VALUES (?, ?, ?, ?)", 
+                           (account_number, name, message, current_time))
+            conn.commit()
+            return True, "Feedback submitted successfully."
+        except Exception as e:
+            return False, str(e)
 
 # ADMIN OPERATIONS
 
-def get_all_users():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT account_number, name, balance FROM users")
-    rows = cursor.fetchall()
-    conn.close()
+def _build_filters(account_number=None, transaction_type=None, start_date=None, end_date=None, date_column="timestamp"):
+    conditions, params = [], []
+    if account_number is not None:
+        conditions.append("account_number = ?")
+        params.append(account_number)
+    if transaction_type:
+        conditions.append("transaction_type = ?")
+        params.append(transaction_type)
+    if start_date:
+        conditions.append(f"{date_column} >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append(f"{date_column} < date(?, '+1 day')")
+        params.append(end_date)
+    return conditions, params
+
+def _all_shards():
+    return range(database.shard_count())
+
+def _fetch_page(select, key, conditions, params, after, page_size, descending, shards=(None,), sort_key=itemgetter(0)):
+    # Keyset pagination: each page continues from the last key seen, so the
+    # cost of a page never depends on how deep into the table it is.
+    # Reading several shards, each returns its own next page and the pages
+    # are merged; that is exact because all of them continue from the same
+    # cursor in the same order. A tuple key is compared as a row value and
+    # `sort_key` extracts it from a result row.
+    conditions, params = list(conditions), list(params)
+    columns = key if isinstance(key, tuple) else (key,)
+    if after is not None:
+        if isinstance(key, tuple):
+            conditions.append(f"({', '.join(key)}) {'<' if descending else '>'} ({', '.join('?' * len(key))})")
+            params.extend(after)
+        else:
+            conditions.append(f"{key} {'<' if descending else '>'} ?")
+            params.append(after)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = ", ".join(f"{column} {'DESC' if descending else 'ASC'}" for column in columns)
+    pages = []
+    for shard in shards:
+        with connection(shard=shard) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"{select}{where} ORDER BY {order} LIMIT ?", params + [page_size + 1])
+            pages.append(cursor.fetchall())
+    rows = pages[0] if len(pages) == 1 else list(islice(heapq.merge(*pages, key=sort_key, reverse=descending), page_size + 1))
+    next_cursor = sort_key(rows[page_size - 1]) if len(rows) > page_size else None
+    return rows[:page_size], next_cursor
+
+def fetch_users_page(after=None, page_size=PAGE_SIZE, account_number=None):
+    conditions, params = _build_filters(account_number)
+    return _fetch_page("SELECT account_number, name, balance FROM users", "account_number", 
+                       conditions, params, after, page_size, descending=False, shards=_all_shards())
+
+def fetch_deleted_users_page(after=None, page_size=PAGE_SIZE, account_number=None, start_date=None, end_date=None):
+    conditions, params = _build_filters(account_number, start_date=start_date, end_date=end_date, date_column="closed_at")
+    return _fetch_page("SELECT account_number, name, closed_at FROM deleted_users", "account_number", 
+                       conditions, params, after, page_size, descending=False, shards=_all_shards())
+
+def fetch_transactions_page(after=None, page_size=PAGE_SIZE, account_number=None, transaction_type=None, start_date=None, end_date=None):
+    conditions, params = _build_filters(account_number, transaction_type, start_date, end_date)
+    select = "SELECT id, account_number, name, transaction_type, amount, timestamp FROM transactions"
+    if not database.is_sharded():
+        return _fetch_page(select, "id", conditions, params, after, page_size, descending=True)
+    # Ids only order rows within a shard, so across shards pages follow
+    # (timestamp, id). The cursor stays a plain id, looked up in its shard.
+    if after is not None:
+        with connection(shard=int(after) // database.SHARD_ID_SPAN) as conn:
+            after = conn.execute("SELECT timestamp, id FROM transactions WHERE id = ?", (after,)).fetchone()
+        if after is None:
+            return [], None
+    rows, next_cursor = _fetch_page(select, ("timestamp", "id"), conditions, params, after, page_size, descending=True, 
+                                    shards=_all_shards(), sort_key=itemgetter(5, 0))
+    return rows, next_cursor and next_cursor[1]
+
+def fetch_complaints_page(after=None, page_size=PAGE_SIZE, account_number=None, start_date=None, end_date=None):
+    conditions, params = _build_filters(account_number, start_date=start_date, end_date=end_date)
+    return _fetch_page("SELECT id, account_number, name, message, timestamp FROM complaints", "id", 
+                       conditions, params, after, page_size, descending=True)
+
+def get_all_users(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = fetch_users_page(after, page_size, **filters)
     if rows:
         print(tabulate(rows, headers=["Acc Num", "Name", "Balance"], tablefmt="fancy_grid"))
     else:
         print("No active users.")
+    return next_cursor
 
-def get_deleted_users():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT account_number, name, closed_at FROM deleted_users")
-    rows = cursor.fetchall()
-    conn.close()
+def get_deleted_users(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = fetch_deleted_users_page(after, page_size, **filters)
     if rows:
         print(tabulate(rows, headers=["Acc Num", "Name", "Closed At (IST)"], tablefmt="fancy_grid"))
     else:
         print("No deleted user records found.")
+    return next_cursor
 
-def get_all_transactions():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, account_number, name, transaction_type, amount, timestamp FROM transactions ORDER BY id DESC")
-    rows = cursor.fetchall()
-    conn.close()
+def get_all_transactions(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = fetch_transactions_page(after, page_size, **filters)
     if rows:
         print(tabulate(rows, headers=["ID", "Acc Num", "Name", "Type", "Amount", "Time (IST)"], tablefmt="fancy_grid"))
     else:
         print("No transactions recorded yet.")
+    return next_cursor
 
-def get_all_complaints():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, account_number, name, message, timestamp FROM complaints ORDER BY id DESC")
-    rows = cursor.fetchall()
-    conn.close()
+def fetch_daily_summary_page(after=None, page_size=PAGE_SIZE, start_date=None, end_date=None):
+    conditions, params = _build_filters(start_date=start_date, end_date=end_date, date_column="day")
+    select = "SELECT day, deposits, withdrawals, transfers, interest, fees, net_flow, transactions FROM daily_summary"
+    if not database.is_sharded():
+        return _fetch_page(select, "day", conditions, params, after, page_size, descending=True)
+    # Every shard totals its own accounts; a day is the sum over shards. The
+    # latest page_size days overall are among each shard's latest page_size.
+    totals, more = {}, False
+    for shard in _all_shards():
+        rows, next_cursor = _fetch_page(select, "day", conditions, params, after, page_size, descending=True, shards=(shard,))
+        for row in rows:
+            totals[row[0]] = [a + b for a, b in zip(totals.get(row[0], [0] * (len(row) - 1)), row[1:])]
+        more = more or next_cursor is not None
+    days = sorted(totals, reverse=True)
+    rows = [(day, *totals[day]) for day in days[:page_size]]
+    return rows, rows[-1][0] if more or len(days) > page_size else None
+
+def get_daily_summary(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = fetch_daily_summary_page(after, page_size, **filters)
+    if rows:
+        print(tabulate(rows, headers=["Day", "Deposits", "Withdrawals", "Transfers", "Interest", "Fees", "Net Flow", "Count"], 
+                       tablefmt="fancy_grid", floatfmt=".2f"))
+    else:
+        print("No activity recorded yet.")
+    return next_cursor
+
+def rebuild_daily_summaries():
+    days = set()
+    for shard in _all_shards():
+        with connection(shard=shard) as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                summaries.rebuild(cursor)
+                cursor.execute("SELECT DISTINCT day FROM daily_totals")
+                days.update(row[0] for row in cursor.fetchall())
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+    return True, f"Daily summaries rebuilt for {len(days)} days."
+
+def get_all_complaints(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = fetch_complaints_page(after, page_size, **filters)
     if rows:
         print(tabulate(rows, headers=["ID", "Acc Num", "Name", "Message", "Time (IST)"], tablefmt="fancy_grid"))
     else:
         print("No complaints found.")
+    return next_cursor
+
+# SEARCH
+
+def _match(text):
+    # Every word of the input as a prefix term, all of them required.
+    words = re.findall(r"\w+", text or "")
+    if not words:
+        raise ValueError("Enter at least one word to search for.")
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_complaints_page(after=None, page_size=PAGE_SIZE, text=""):
+    # Best matches first (bm25 rank); pages continue from the last (rank, id).
+    select = ("SELECT c.id, c.account_number, c.name, snippet(complaints_fts, 0, '[', ']', '...', 12), c.timestamp, complaints_fts.rank "
+              "FROM complaints_fts JOIN complaints c ON c.id = complaints_fts.rowid")
+    return _fetch_page(select, ("complaints_fts.rank", "c.id"), ["complaints_fts MATCH ?"], [_match(text)], after, page_size, 
+                       descending=False, sort_key=itemgetter(5, 0))
+
+def search_customers_page(after=None, page_size=PAGE_SIZE, text="", include_closed=True):
+    # Active and closed accounts by name, best matches first; pages continue
+    # from the last (rank, account_number).
+    match = _match(text)
+    parts = ["SELECT u.account_number, u.name, 'ACTIVE' AS status, users_fts.rank AS rank "
+             "FROM users_fts JOIN users u ON u.account_number = users_fts.rowid WHERE users_fts MATCH ?"]
+    if include_closed:
+        parts.append("SELECT d.account_number, d.name, 'CLOSED', deleted_users_fts.rank "
+                     "FROM deleted_users_fts JOIN deleted_users d ON d.account_number = deleted_users_fts.rowid WHERE deleted_users_fts MATCH ?")
+    select = f"SELECT account_number, name, status, rank FROM ({' UNION ALL '.join(parts)})"
+    return _fetch_page(select, ("rank", "account_number"), [], [match] * len(parts), after, page_size, 
+                       descending=False, shards=_all_shards(), sort_key=itemgetter(3, 0))
+
+def search_complaints(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = search_complaints_page(after, page_size, **filters)
+    if rows:
+        print(tabulate([row[:5] for row in rows], headers=["ID", "Acc Num", "Name", "Match", "Time (IST)"], tablefmt="fancy_grid"))
+    else:
+        print("No matching complaints.")
+    return next_cursor
+
+def search_customers(after=None, page_size=PAGE_SIZE, **filters):
+    rows, next_cursor = search_customers_page(after, page_size, **filters)
+    if rows:
+        print(tabulate([row[:3] for row in rows], headers=["Acc Num", "Name", "Status"], tablefmt="fancy_grid"))
+    else:
+        print("No matching customers.")
+    return next_cursor
 
 def add_new_admin(username, password):
-    conn = get_connection()
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO admins (username, password) VALUES (?, ?)", (username, password))
+            conn.commit()
+            return True, f"New Admin '{username}' added."
+        except sqlite3.IntegrityError:
+            return False, "Username already exists."
+        except Exception as e:
+            return False, str(e)
+
+def apply_interest_to_all(rate=INTEREST_RATE, chunk_size=INTEREST_CHUNK_SIZE, progress=None):
+    if _ledger_engine is not None:
+        return False, "Interest cannot be applied while the ledger engine owns the balances."
+    # Shards keep their own interest_runs, so each one resumes on its own.
+    count, resumed = 0, False
+    for shard in _all_shards():
+        def shard_progress(done, total, before=count):
+            if progress:
+                progress(before + done, before + total)
+        with connection(shard=shard) as conn:
+            try:
+                credited, was_resumed = _apply_interest(conn, rate, chunk_size, shard_progress)
+            except Exception as e:
+                conn.rollback()
+                return False, str(e)
+        count += credited
+        resumed = resumed or was_resumed
+    resumed = " (resumed interrupted run)" if resumed else ""
+    return True, f"Interest applied to {count} accounts{resumed}."
+
+def _apply_interest(conn, rate, chunk_size, progress):
     cursor = conn.cursor()
-    try:
-        cursor.execute("INSERT INTO admins (username, password) VALUES (?, ?)", (username, password))
+    # An interrupted run is picked up where its last committed chunk ended.
+    cursor.execute("SELECT id, rate, last_account, accounts_credited, started_at FROM interest_runs WHERE status = 'RUNNING' ORDER BY id DESC LIMIT 1")
+    run = cursor.fetchone()
+    if run:
+        run_id, rate, last_account, count, _ = run
+    else:
+        cursor.execute("INSERT INTO interest_runs (rate, started_at) VALUES (?, ?)", (rate, get_ist_time()))
+        run_id, last_account, count = cursor.lastrowid, 0, 0
         conn.commit()
-        return True, f"New Admin '{username}' added."
-    except sqlite3.IntegrityError:
-        return False, "Username already exists."
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
 
-def apply_interest_to_all():
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
+    cursor.execute("SELECT COUNT(*) FROM users WHERE account_number > ? AND balance > 0", (last_account,))
+    total = count + cursor.fetchone()[0]
+
+    while True:
+        cursor.execute("SELECT MAX(account_number) FROM (SELECT account_number FROM users WHERE account_number > ? ORDER BY account_number LIMIT ?)", 
+                       (last_account, chunk_size))
+        upper = cursor.fetchone()[0]
+        if upper is None:
+            break
+
+        # Each chunk is its own short write transaction so tellers are
+        # only ever blocked for one chunk, and the run position commits
+        # together with the balances it covers.
+        cursor.execute("BEGIN IMMEDIATE")
         current_time = get_ist_time()
-        
-        cursor.execute("SELECT account_number, name, balance FROM users")
-        users = cursor.fetchall()
-        
-        count = 0
-        for acc_num, name, balance in users:
-            if balance > 0:
-                interest = balance * 0.05
-                new_balance = balance + interest
-                cursor.execute("UPDATE users SET balance = ? WHERE account_number = ?", (new_balance, acc_num))
-                cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp) VALUES (?, ?, 'INTEREST_CREDIT', ?, ?)", 
-                               (acc_num, name, interest, current_time))
-                count += 1
+        cursor.execute("INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) SELECT account_number, name, 'INTEREST_CREDIT', balance * ?, ?, balance + balance * ? FROM users WHERE account_number > ? AND account_number <= ? AND balance > 0", 
+                       (rate, current_time, rate, last_account, upper))
+        credited = cursor.rowcount
+        summaries.record_select(cursor, "SELECT substr(?, 1, 10), 'INTEREST_CREDIT', SUM(balance * ?), COUNT(*) FROM users WHERE account_number > ? AND account_number <= ? AND balance > 0 GROUP BY 1", 
+                                (current_time, rate, last_account, upper))
+        cursor.execute("UPDATE users SET balance = balance + balance * ? WHERE account_number > ? AND account_number <= ? AND balance > 0", 
+                       (rate, last_account, upper))
+        cursor.execute("UPDATE interest_runs SET last_account = ?, accounts_credited = accounts_credited + ? WHERE id = ?", 
+                       (upper, credited, run_id))
         conn.commit()
-        return True, f"Interest applied to {count} accounts."
-    except Exception as e:
-        conn.rollback()
-        return False, str(e)
-    finally:
-        conn.close()
+        account_cache.clear()
 
-def export_transactions_csv():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM transactions")
-    rows = cursor.fetchall()
-    conn.close()
-    
-    filename = "bank_transactions_report.csv"
-    try:
-        with open(filename, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "Account Number", "Name", "Type", "Amount", "Timestamp (IST)"])
-            writer.writerows(rows)
-        return True, f"Report saved as '{filename}'"
-    except Exception as e:
-        return False, str(e)
\ No newline at end of file
+        last_account = upper
+        count += credited
+        progress(count, total)
+
+    cursor.execute("UPDATE interest_runs SET status = 'COMPLETED', finished_at = ? WHERE id = ?", (get_ist_time(), run_id))
+    conn.commit()
+    return count, run is not None
+
+def save_export_watermarks(marks):
+    # marks: [(watermark name, last exported id)]
+    with connection(live=True) as conn:
+        conn.executemany("INSERT INTO export_watermarks (name, last_id, updated_at) VALUES (?, ?, ?) ON CONFLICT(name) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at", 
+                         [(name, last_id, get_ist_time()) for name, last_id in marks])
+        conn.commit()
+
+def export_transactions_csv(filename="bank_transactions_report.csv", compress=False, start_date=None, end_date=None, 
+                            account_number=None, incremental=False, watermark="transactions_csv", batch_size=EXPORT_BATCH_SIZE,
+                            save_watermarks=save_export_watermarks):
+    # save_watermarks lets a caller run the closing watermark write elsewhere
+    # (the service hands it to its writer thread).
+    if compress and not filename.endswith(".gz"):
+        filename += ".gz"
+
+    conditions, params = _build_filters(account_number, start_date=start_date, end_date=end_date)
+    # Watermarks live in the live home database, also when the rows come
+    # from a reporting snapshot; sharded exports keep one per shard, as ids
+    # only order rows within a shard. A filtered export has its own, so it
+    # never moves the unfiltered (or a differently filtered) one past rows
+    # it did not export.
+    scope = ",".join(f"{key}={value}" for key, value in (("account_number", account_number), ("start_date", start_date),
+                                                          ("end_date", end_date)) if value is not None)
+    if scope:
+        watermark = f"{watermark}[{scope}]"
+    sources = [database.shard_for(account_number)] if account_number is not None else list(_all_shards())
+    names = {shard: f"{watermark}:{shard}" if database.is_sharded() else watermark for shard in sources}
+
+    with connection(live=True) as conn, contextlib.ExitStack() as stack:
+        cursor = conn.cursor()
+        try:
+            streams, last_ids = [], {}
+            for shard in sources:
+                shard_conditions, shard_params, after_id = list(conditions), list(params), None
+                if incremental:
+                    cursor.execute("SELECT last_id FROM export_watermarks WHERE name = ?", (names[shard],))
+                    result = cursor.fetchone()
+                    after_id = result[0] if result else 0
+                    shard_conditions.append("id > ?")
+                    shard_params.append(after_id)
+
+                shard_conn = stack.enter_context(connection(shard=shard))
+                # Archived months are only attached when the filters reach them.
+                files = archive.files_for(shard_conn.cursor(), start_date, end_date, after_id, account_number)
+                rows = archive.iter_rows(shard_conn, "id, account_number, name, transaction_type, amount, timestamp", 
+                                         " AND ".join(shard_conditions) or "1", shard_params, files, "id", batch_size)
+                streams.append(stack.enter_context(contextlib.closing(rows)))
+            # Within a shard id order is time order; across shards merge by time.
+            rows = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=itemgetter(5, 0))
+
+            first = next(rows, None)
+            if incremental and first is None:
+                return True, "No new transactions since the last export."
+
+            count = 0
+            opener = open
+            if compress:
+                import gzip  # imported on demand to keep startup lean
+                opener = gzip.open
+            with opener(filename, 'wt', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["ID", "Account Number", "Name", "Type", "Amount", "Timestamp (IST)"])
+                if first is not None:
+                    for row in chain((first,), rows):
+                        writer.writerow(row)
+                        count += 1
+                        last_ids[row[0] // database.SHARD_ID_SPAN] = row[0]
+
+            # The watermarks only move once the file is completely written.
+            if incremental and last_ids:
+                save_watermarks([(names[shard], last_id) for shard, last_id in last_ids.items()])
+            return True, f"{count} transactions saved as '{filename}'"
+        except Exception as e:
+            return False, str(e)
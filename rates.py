@@ -0,0 +1,242 @@
+import sys
+import time
+import database
+from database import connection
+from cache import account_cache
+import operations
+import summaries
+
+# Monthly interest and fee cycle. Interest is tiered by balance band (each
+# band's annual rate applies to the part of the balance inside it) and
+# accrues daily over the cycle; accounts below FEE_WAIVER_BALANCE pay the
+# monthly fee and accounts below MIN_BALANCE the minimum-balance penalty,
+# both judged on the balance before interest and never taking an account
+# below zero.
+#
+# A chunk of accounts is loaded into NumPy arrays, every credit and debit is
+# computed in a few vectorized passes, and the results go back with bulk
+# executemany calls inside one short write transaction per chunk. NumPy is
+# optional: without it the same cycle runs through the per-row loop, which
+# is also what benchmarks/rates.py compares against. Like interest_runs,
+# rate_cycles records each shard's position so an interrupted cycle resumes
+# where its last committed chunk ended, and a cycle is applied only once.
+
+INTEREST_TIERS = [(0.0, 0.02), (10000.0, 0.035), (100000.0, 0.05)]
+DAYS_IN_YEAR = 365
+CYCLE_DAYS = 30
+MONTHLY_FEE = 10.0
+FEE_WAIVER_BALANCE = 5000.0
+MIN_BALANCE = 1000.0
+MIN_BALANCE_PENALTY = 25.0
+CYCLE_CHUNK_SIZE = 100000
+
+INSERT = "INSERT INTO transactions (account_number, name, transaction_type, amount, timestamp, balance_after) VALUES (?, ?, ?, ?, ?, ?)"
+KINDS = ('INTEREST_CREDIT', 'MONTHLY_FEE', 'MIN_BALANCE_PENALTY')
+
+# HELPER FUNCTIONS
+
+def _numpy():
+    # Imported on first use so the CLI does not pay for it at start-up.
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+def _bands():
+    uppers = [low for low, _ in INTEREST_TIERS[1:]] + [float("inf")]
+    return [(low, high, rate) for (low, rate), high in zip(INTEREST_TIERS, uppers)]
+
+def compute_numpy(np, balances, days, charge_fees):
+    # Returns (interest, fee, penalty) arrays for an array of balances.
+    interest = np.zeros_like(balances)
+    for low, high, rate in _bands():
+        interest += np.clip(balances - low, 0.0, high - low) * rate
+    interest = np.round(interest * days / DAYS_IN_YEAR, 2)
+    if not charge_fees:
+        zeros = np.zeros_like(balances)
+        return interest, zeros, zeros
+    funded = np.maximum(balances + interest, 0.0)
+    fee = np.minimum(np.where(balances < FEE_WAIVER_BALANCE, MONTHLY_FEE, 0.0), funded)
+    penalty = np.minimum(np.where(balances < MIN_BALANCE, MIN_BALANCE_PENALTY, 0.0), funded - fee)
+    return interest, fee, penalty
+
+def compute_python(balances, days, charge_fees):
+    # The per-row equivalent of compute_numpy(), returning lists.
+    bands = _bands()
+    interest, fees, penalties = [], [], []
+    for balance in balances:
+        accrued = 0.0
+        for low, high, rate in bands:
+            accrued += min(max(balance - low, 0.0), high - low) * rate
+        accrued = round(accrued * days / DAYS_IN_YEAR, 2)
+        fee = penalty = 0.0
+        if charge_fees:
+            funded = max(balance + accrued, 0.0)
+            fee = min(MONTHLY_FEE if balance < FEE_WAIVER_BALANCE else 0.0, funded)
+            penalty = min(MIN_BALANCE_PENALTY if balance < MIN_BALANCE else 0.0, funded - fee)
+        interest.append(accrued)
+        fees.append(fee)
+        penalties.append(penalty)
+    return interest, fees, penalties
+
+def _postings(np, rows, days, charge_fees, current_time):
+    # Ledger rows per kind (interest first, so each account's balance_after
+    # runs in id order), the new balances, and the (total, count) per kind.
+    # A debit capped at the whole balance leaves exactly zero, not the
+    # rounding residue of the subtraction.
+    accounts = [row[0] for row in rows]
+    if np is not None:
+        balances = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+        amounts = compute_numpy(np, balances, days, charge_fees)
+        afters, balance = [], balances
+        balance = balance + amounts[0]
+        afters.append(balance)
+        for amount in amounts[1:]:
+            balance = np.where(amount > 0, np.maximum(balance - amount, 0.0), balance)
+            afters.append(balance)
+        totals = [(float(amount.sum()), int(np.count_nonzero(amount))) for amount in amounts]
+        picks = [np.flatnonzero(amount).tolist() for amount in amounts]
+        amounts = [amount.tolist() for amount in amounts]
+        afters = [after.tolist() for after in afters]
+    else:
+        amounts = compute_python([row[2] for row in rows], days, charge_fees)
+        afters, balance = [], [row[2] for row in rows]
+        balance = [b + a for b, a in zip(balance, amounts[0])]
+        afters.append(balance)
+        for amount in amounts[1:]:
+            balance = [max(b - a, 0.0) if a > 0 else b for b, a in zip(balance, amount)]
+            afters.append(balance)
+        totals = [(sum(amount), sum(1 for a in amount if a)) for amount in amounts]
+        picks = [[i for i, a in enumerate(amount) if a] for amount in amounts]
+
+    entries = [[(accounts[i], rows[i][1], kind, amount[i], current_time, after[i]) for i in pick]
+               for kind, amount, after, pick in zip(KINDS, amounts, afters, picks)]
+    changed = sorted(set().union(*picks))
+    updates = [(afters[-1][i], accounts[i]) for i in changed]
+    return entries, updates, totals
+
+def default_cycle():
+    return operations.get_ist_time()[:7]
+
+# RATE CYCLE
+
+def run_cycle(days=CYCLE_DAYS, charge_fees=True, dry_run=False, cycle=None, chunk_size=CYCLE_CHUNK_SIZE,
+              vectorized=True, progress=None):
+    if operations._ledger_engine is not None:
+        return False, "Rate cycles cannot run while the ledger engine owns the balances."
+    cycle = cycle or default_cycle()
+    np = _numpy() if vectorized else None
+    report = {"accounts": 0, "totals": [(0.0, 0)] * len(KINDS), "resumed": False, "applied": 0}
+    for shard in range(database.shard_count()):
+        def shard_progress(done, total, before=report["accounts"]):
+            if progress:
+                progress(before + done, before + total)
+        with connection(shard=shard) as conn:
+            try:
+                if dry_run:
+                    _preview(conn, np, days, charge_fees, chunk_size, report, shard_progress)
+                else:
+                    _apply(conn, np, cycle, days, charge_fees, chunk_size, report, shard_progress)
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                return False, str(e)
+
+    (interest, credited), (fees, charged), (penalties, penalised) = report["totals"]
+    summary = (f"{report['accounts']} accounts: ₹ {interest:.2f} interest to {credited}, ₹ {fees:.2f} in fees from {charged}, "
+               f"₹ {penalties:.2f} in minimum-balance penalties from {penalised}")
+    if not (dry_run or report["applied"]):
+        return False, f"Cycle {cycle} has already been applied."
+    if dry_run:
+        return True, f"Dry run for cycle {cycle} ({days} days), nothing written. {summary}."
+    resumed = " (resumed interrupted cycle)" if report["resumed"] else ""
+    return True, f"Cycle {cycle} applied to {summary}{resumed}."
+
+def _add(report, count, totals):
+    report["accounts"] += count
+    report["totals"] = [(total + t, n + c) for (total, n), (t, c) in zip(report["totals"], totals)]
+
+def _preview(conn, np, days, charge_fees, chunk_size, report, progress):
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM users")
+    total, last_account, done = cursor.fetchone()[0], 0, 0
+    while True:
+        cursor.execute("SELECT account_number, name, balance FROM users WHERE account_number > ? ORDER BY account_number LIMIT ?",
+                       (last_account, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        _, _, totals = _postings(np, rows, days, charge_fees, "")
+        _add(report, len(rows), totals)
+        last_account, done = rows[-1][0], done + len(rows)
+        progress(done, total)
+
+def _apply(conn, np, cycle, days, charge_fees, chunk_size, report, progress):
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, days, charge_fees, last_account, accounts, status FROM rate_cycles WHERE cycle = ? ORDER BY id DESC LIMIT 1",
+                   (cycle,))
+    run = cursor.fetchone()
+    if run and run[5] == 'COMPLETED':
+        # Shards finish on their own; a rerun only completes the others.
+        return
+    report["applied"] += 1
+    if run:
+        # An interrupted cycle keeps the terms it started with.
+        run_id, days, charge_fees, last_account, done, _ = run
+        report["resumed"] = True
+    else:
+        cursor.execute("INSERT INTO rate_cycles (cycle, days, charge_fees, started_at) VALUES (?, ?, ?, ?)",
+                       (cycle, days, int(charge_fees), operations.get_ist_time()))
+        run_id, last_account, done = cursor.lastrowid, 0, 0
+        conn.commit()
+
+    cursor.execute("SELECT COUNT(*) FROM users WHERE account_number > ?", (last_account,))
+    total = done + cursor.fetchone()[0]
+
+    while True:
+        # The chunk is read inside its own write transaction, so the
+        # balances written back are exactly the ones the amounts came from.
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT account_number, name, balance FROM users WHERE account_number > ? ORDER BY account_number LIMIT ?",
+                       (last_account, chunk_size))
+        rows = cursor.fetchall()
+        if not rows:
+            conn.rollback()
+            break
+        current_time = operations.get_ist_time()
+        entries, updates, totals = _postings(np, rows, days, charge_fees, current_time)
+        for kind_entries in entries:
+            cursor.executemany(INSERT, kind_entries)
+        cursor.executemany("UPDATE users SET balance = ? WHERE account_number = ?", updates)
+        cursor.executemany(summaries.UPSERT, [(current_time[:10], kind, total, count)
+                                              for kind, (total, count) in zip(KINDS, totals) if count])
+        (interest, _), (fees, _), (penalties, _) = totals
+        last_account = rows[-1][0]
+        cursor.execute("UPDATE rate_cycles SET last_account = ?, accounts = accounts + ?, interest = interest + ?, fees = fees + ?, penalties = penalties + ? WHERE id = ?",
+                       (last_account, len(rows), interest, fees, penalties, run_id))
+        conn.commit()
+        account_cache.clear()
+
+        _add(report, len(rows), totals)
+        done += len(rows)
+        progress(done, total)
+
+    cursor.execute("UPDATE rate_cycles SET status = 'COMPLETED', finished_at = ? WHERE id = ?", (operations.get_ist_time(), run_id))
+    conn.commit()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Apply the monthly interest and fee cycle.")
+    parser.add_argument("--days", type=int, default=CYCLE_DAYS, help="days of interest to accrue")
+    parser.add_argument("--cycle", help="cycle key, applied at most once (default: the current month, YYYY-MM)")
+    parser.add_argument("--no-fees", action="store_true", help="credit interest only")
+    parser.add_argument("--dry-run", action="store_true", help="only report the totals")
+    parser.add_argument("--chunk-size", type=int, default=CYCLE_CHUNK_SIZE)
+    parser.add_argument("--no-numpy", action="store_true", help="use the per-row loop")
+    args = parser.parse_args()
+    database.init_db()
+    start = time.perf_counter()
+    success, msg = run_cycle(args.days, not args.no_fees, args.dry_run, args.cycle, args.chunk_size, not args.no_numpy)
+    print(f"{msg} ({time.perf_counter() - start:.2f}s)")
+    sys.exit(0 if success else 1)
@@ -0,0 +1,191 @@
+import csv
+import os
+import sqlite3
+import sys
+import time
+import database
+import snapshots
+
+# Ledger reconciliation. Every users.balance must equal the net of its
+# transactions (plus the net of its archived rows, see archive.py), and every
+# TRANSFER_SENT row must be followed by the matching TRANSFER_RECEIVED row.
+# The account space is split into ranges that worker processes check in
+# parallel, each on its own read-only connection; archive files are checked
+# for transfer pairs as separate tasks. Sharded databases are checked shard
+# by shard, and cross-shard transfers are paired through the home
+# transfer_log instead (see shards.py).
+
+RANGES_PER_WORKER = 4
+TOLERANCE = 0.005
+MAX_LISTED = 1000
+
+# HELPER FUNCTIONS
+
+def _open_readonly(path):
+    conn = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+    conn.execute("PRAGMA query_only = ON")
+    conn.execute(f"PRAGMA mmap_size = {database.PRAGMAS['mmap_size']}")
+    conn.execute(f"PRAGMA cache_size = {database.PRAGMAS['cache_size']}")
+    return conn
+
+def _unpaired(conn, schema="main", account_range=None):
+    # A transfer is two adjacent rows: SENT at id n and RECEIVED at id n + 1
+    # with the same amount and timestamp. Each side is checked from the
+    # account that owns it, so ranges never check the same row twice.
+    # Cross-shard legs are paired by check_transfers().
+    condition, params = " AND t.id NOT IN (SELECT ledger_id FROM main.transfer_branches WHERE ledger_id IS NOT NULL)", []
+    if account_range:
+        condition, params = condition + " AND t.account_number BETWEEN ? AND ?", list(account_range)
+    rows = conn.execute(f"""
+        SELECT t.id, t.account_number, t.transaction_type, t.amount FROM {schema}.transactions t
+        LEFT JOIN {schema}.transactions p ON p.id = t.id + 1 AND p.transaction_type = 'TRANSFER_RECEIVED'
+                                         AND p.amount = t.amount AND p.timestamp = t.timestamp
+        WHERE t.transaction_type = 'TRANSFER_SENT' AND p.id IS NULL{condition}
+        UNION ALL
+        SELECT t.id, t.account_number, t.transaction_type, t.amount FROM {schema}.transactions t
+        LEFT JOIN {schema}.transactions p ON p.id = t.id - 1 AND p.transaction_type = 'TRANSFER_SENT'
+                                         AND p.amount = t.amount AND p.timestamp = t.timestamp
+        WHERE t.transaction_type = 'TRANSFER_RECEIVED' AND p.id IS NULL{condition}
+    """, params * 2).fetchmany(MAX_LISTED)
+    return rows
+
+# WORKER TASKS (run in child processes)
+
+def check_range(path, low, high):
+    conn = _open_readonly(path)
+    try:
+        accounts = conn.execute("SELECT COUNT(*) FROM users WHERE account_number BETWEEN ? AND ?", (low, high)).fetchone()[0]
+        mismatches = conn.execute(f"""
+            SELECT u.account_number, u.balance, COALESCE(l.net, 0) + COALESCE(a.credits - a.debits, 0) AS ledger
+            FROM users u
+            LEFT JOIN (
+                SELECT account_number, SUM(CASE WHEN transaction_type IN {database.DEBIT_TYPES} THEN -amount ELSE amount END) AS net
+                FROM transactions WHERE account_number BETWEEN ? AND ? GROUP BY account_number
+            ) l ON l.account_number = u.account_number
+            LEFT JOIN archived_accounts a ON a.account_number = u.account_number
+            WHERE u.account_number BETWEEN ? AND ? AND abs(u.balance - ledger) > ?
+            ORDER BY u.account_number
+        """, (low, high, low, high, TOLERANCE)).fetchmany(MAX_LISTED)
+        return accounts, mismatches, _unpaired(conn, account_range=(low, high))
+    finally:
+        conn.close()
+
+def check_archive(path, archive_path):
+    conn = _open_readonly(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS cold", (f"file:{os.path.abspath(archive_path)}?mode=ro",))
+        return 0, [], _unpaired(conn, schema="cold")
+    finally:
+        conn.close()
+
+def check_transfers(path, home, shard, shards):
+    # Every completed cross-shard transfer must have its branches in this
+    # shard settled the way the log decided; a committed one needs both.
+    conn = _open_readonly(path)
+    try:
+        conn.execute("ATTACH DATABASE ? AS home", (f"file:{os.path.abspath(home)}?mode=ro",))
+        unpaired = []
+        for role, column, kind in (("DEBIT", "sender", "TRANSFER_SENT"), ("CREDIT", "receiver", "TRANSFER_RECEIVED")):
+            unpaired += conn.execute(f"""
+                SELECT COALESCE(b.ledger_id, l.id), l.{column}, '{kind}', l.amount FROM home.transfer_log l
+                LEFT JOIN transfer_branches b ON b.transfer_id = l.id AND b.role = '{role}'
+                WHERE l.completed = 1 AND l.{column} % ? = ?
+                  AND ((b.transfer_id IS NULL AND l.state = 'COMMITTED') OR b.state != l.state)
+            """, (shards, shard)).fetchmany(MAX_LISTED)
+        return 0, [], unpaired
+    finally:
+        conn.close()
+
+# RECONCILIATION
+
+def data_files(path):
+    # The shard files of a sharded home database, else the database itself.
+    conn = _open_readonly(path)
+    try:
+        shards = conn.execute("SELECT shards FROM storage_layout WHERE id = 1").fetchone()[0]
+    finally:
+        conn.close()
+    return [database.shard_file(path, index) for index in range(shards)] if shards > 1 else [path]
+
+def split_ranges(path, parts):
+    conn = _open_readonly(path)
+    try:
+        low, high = conn.execute("SELECT MIN(account_number), MAX(account_number) FROM users").fetchone()
+        files = [row[0] for row in conn.execute("SELECT path FROM archive_months ORDER BY month")]
+    finally:
+        conn.close()
+    if low is None:
+        return [], files
+    step = max(1, -(-(high - low + 1) // parts))
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)], files
+
+def reconcile(path=None, workers=None, progress=None, archive_dir=None):
+    # Imported on first use: multiprocessing is costly to load at CLI start-up.
+    from concurrent.futures import ProcessPoolExecutor
+    path = path or database.DB_NAME
+    if not workers:
+        # Honour CPU affinity / container limits where the platform exposes them.
+        workers = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    start = time.perf_counter()
+    shard_files = data_files(path)
+
+    report = {"accounts": 0, "mismatches": [], "unpaired": [], "ranges": 0, "archives": 0, "workers": workers}
+    # URIs need the archive directory of this database, not of the caller;
+    # a reporting snapshot reads the live one.
+    archive_dir = archive_dir or os.path.join(os.path.dirname(os.path.abspath(path)), "archive")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for index, shard in enumerate(shard_files):
+            ranges, files = split_ranges(shard, -(-workers * RANGES_PER_WORKER // len(shard_files)))
+            report["ranges"] += len(ranges)
+            report["archives"] += len(files)
+            futures += [pool.submit(check_range, shard, low, high) for low, high in ranges]
+            futures += [pool.submit(check_archive, shard, os.path.join(archive_dir, name)) for name in files]
+            if len(shard_files) > 1:
+                futures.append(pool.submit(check_transfers, shard, path, index, len(shard_files)))
+        for done, future in enumerate(futures, start=1):
+            accounts, mismatches, unpaired = future.result()
+            report["accounts"] += accounts
+            report["mismatches"] += mismatches
+            report["unpaired"] += unpaired
+            if progress:
+                progress(done, len(futures))
+    report["elapsed_s"] = time.perf_counter() - start
+    return report
+
+def reconcile_ledger(path=None, workers=None, report_path="reconciliation_report.csv", progress=None, snapshot=False):
+    try:
+        archive_dir = None
+        if snapshot:
+            current = snapshots.latest()
+            if current is None:
+                return False, "No reporting snapshot has been taken yet."
+            # The live archives belong to the live database.
+            archive_dir = os.path.join(os.path.dirname(os.path.abspath(path or database.DB_NAME)), "archive")
+            path = os.path.join(current[1], os.path.basename(path or database.DB_NAME))
+        report = reconcile(path, workers, progress, archive_dir)
+        summary = (f"Checked {report['accounts']} accounts in {report['ranges']} ranges and {report['archives']} archives "
+                   f"with {report['workers']} workers in {report['elapsed_s']:.2f}s: "
+                   f"{len(report['mismatches'])} balance mismatches, {len(report['unpaired'])} unpaired transfer rows.")
+        if not (report["mismatches"] or report["unpaired"]):
+            return True, summary
+        with open(report_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["Kind", "Account Number", "Balance / Type", "Ledger / Amount", "Transaction ID"])
+            writer.writerows(("BALANCE_MISMATCH", acc, balance, ledger, "") for acc, balance, ledger in report["mismatches"])
+            writer.writerows(("UNPAIRED_TRANSFER", acc, kind, amount, tid) for tid, acc, kind, amount in report["unpaired"])
+        return False, f"{summary} Details saved as '{report_path}'"
+    except Exception as e:
+        return False, str(e)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Reconcile account balances against the ledger in parallel.")
+    parser.add_argument("--db", default=database.DB_NAME)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--report", default="reconciliation_report.csv", help="CSV written when problems are found")
+    parser.add_argument("--snapshot", action="store_true", help="check the latest reporting snapshot instead of the live files")
+    args = parser.parse_args()
+    success, msg = reconcile_ledger(args.db, args.workers, args.report, snapshot=args.snapshot)
+    print(msg)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,558 @@
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+import database
+import auth
+import operations
+import shards
+import ledger
+import rates
+import snapshots
+
+# Local JSON-over-HTTP service exposing operations.py and auth.py.
+# Requests are parsed on the asyncio event loop. Read endpoints run on a
+# thread pool; every write endpoint is handed to a single writer thread so
+# SQLite commits are serialized in-process and never fight over the lock.
+#
+# Like the CLI, account endpoints need the account's PIN (X-Account-Pin
+# header) or a session token from POST /login, and admin endpoints need
+# admin credentials (HTTP Basic) or a token from POST /admin/login; tokens
+# go in "Authorization: Bearer <token>".
+
+HOST = "127.0.0.1"
+PORT = 8080
+# Readers plus the writer stay within the connection pool's idle limit.
+READER_THREADS = database.POOL_SIZE - 1
+POSTING_THREADS = 128
+MAX_BODY = 1 << 20
+BACKLOG = 4096
+SESSION_TTL = 900             # seconds a login token stays valid
+EXPORT_DIR = "exports"
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 500: "Internal Server Error"}
+
+class BadRequest(Exception):
+    pass
+
+class Unauthorized(Exception):
+    pass
+
+# token -> (role, account number or admin username, expires at)
+_sessions = {}
+_sessions_lock = threading.Lock()
+# The running service's writer thread, for report handlers that end with a short write.
+_writer = None
+
+# HELPER FUNCTIONS
+
+def _field(data, key, kind=str, required=True):
+    value = data.get(key)
+    if value is None or value == "":
+        if required:
+            raise BadRequest(f"Missing field '{key}'.")
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"Invalid value for '{key}'.")
+
+def _result(outcome):
+    success, message = outcome
+    return {"success": success, "message": message}
+
+def _page(rows, next_cursor, columns):
+    return {"rows": [dict(zip(columns, row)) for row in rows], "next": next_cursor}
+
+def _export_path(compress):
+    # Exports go to a fixed directory next to the database, never to a
+    # client-chosen path.
+    directory = os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), EXPORT_DIR)
+    os.makedirs(directory, exist_ok=True)
+    name = f"transactions_{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}.csv"
+    return os.path.join(directory, name + (".gz" if compress else ""))
+
+def _on_writer(fn):
+    def run(*args):
+        if _writer is None:
+            return fn(*args)
+        return _writer.submit(fn, *args).result()
+    return run
+
+def _filters(query, *keys):
+    filters = {}
+    for key in keys:
+        if query.get(key):
+            filters[key] = int(query[key]) if key == "account_number" else query[key]
+    return filters
+
+# SESSIONS
+
+def _new_session(role, subject):
+    token = secrets.token_urlsafe(24)
+    now = time.monotonic()
+    with _sessions_lock:
+        for key in [key for key, (_, _, expires) in _sessions.items() if expires < now]:
+            del _sessions[key]
+        _sessions[token] = (role, subject, now + SESSION_TTL)
+    return token
+
+def _session(headers):
+    scheme, _, token = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        return None
+    with _sessions_lock:
+        session = _sessions.get(token.strip())
+    if session is None or session[2] < time.monotonic():
+        return None
+    return session[:2]
+
+def _end_sessions(role, subject):
+    with _sessions_lock:
+        for key in [key for key, (r, s, _) in _sessions.items() if (r, s) == (role, subject)]:
+            del _sessions[key]
+
+def _basic_admin(headers):
+    scheme, _, encoded = headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "basic":
+        return False
+    try:
+        username, _, password = base64.b64decode(encoded.strip(), validate=True).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        return False
+    return auth.admin_login(username, password)
+
+def _account_of(match, body):
+    # The account an account endpoint acts on: the path's, or the posting's
+    # own (the sender of a transfer). Every one of them that is given must
+    # name the same account, so the credentials checked are always those
+    # of the account the handler debits or changes.
+    values = [value for value in (match.get("acc"), body.get("account_number"), body.get("sender_account")) if value not in (None, "")]
+    if not values:
+        raise BadRequest("Missing field 'account_number'.")
+    try:
+        accounts = {int(value) for value in values}
+    except (TypeError, ValueError):
+        raise BadRequest("Invalid value for 'account_number'.")
+    if len(accounts) > 1:
+        raise BadRequest("The request names more than one acting account.")
+    return accounts.pop()
+
+def _authorize(access, match, body, headers):
+    if access == PUBLIC:
+        return
+    session = _session(headers)
+    if access == ADMIN:
+        if (session and session[0] == "admin") or _basic_admin(headers):
+            return
+        raise Unauthorized("Admin credentials required.")
+    account_number = _account_of(match, body)
+    if session == ("customer", account_number):
+        return
+    pin = headers.get("x-account-pin", "")
+    if pin.isdigit() and auth.login(account_number, int(pin)):
+        return
+    raise Unauthorized("Account PIN or session token required.")
+
+# READ ENDPOINTS
+
+def get_account(match, query, body):
+    user = operations.get_account(int(match["acc"]))
+    if not user:
+        return 404, {"error": "Account not found."}
+    return 200, {"account_number": user[0], "name": user[1], "balance": user[3]}
+
+def get_balance(match, query, body):
+    at = _field(query, "at", required=False)
+    balance = operations.get_balance_at(int(match["acc"]), at) if at else operations.get_balance(int(match["acc"]))
+    return 200, {"account_number": int(match["acc"]), "balance": balance}
+
+def get_history(match, query, body):
+    limit = min(_field(query, "limit", int, required=False) or 10, 500)
+    rows = operations.fetch_history(int(match["acc"]), limit)
+    return 200, {"rows": [dict(zip(("type", "amount", "timestamp"), row)) for row in rows]}
+
+def get_statement(match, query, body):
+    try:
+        opening, closing, rows = operations.generate_statement(int(match["acc"]), _field(query, "start_date"), _field(query, "end_date"))
+    except ValueError as e:
+        raise BadRequest(str(e))
+    return 200, {"opening_balance": opening, "closing_balance": closing,
+                 "rows": [dict(zip(("timestamp", "type", "amount", "balance_after"), row)) for row in rows]}
+
+def get_loan_eligibility(match, query, body):
+    eligible, amount = operations.check_loan_eligibility(int(match["acc"]))
+    return 200, {"eligible": eligible, "amount": amount}
+
+def get_users(match, query, body):
+    rows, next_cursor = operations.fetch_users_page(_field(query, "after", int, required=False),
+                                                    min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                    **_filters(query, "account_number"))
+    return 200, _page(rows, next_cursor, ("account_number", "name", "balance"))
+
+def get_deleted_users(match, query, body):
+    rows, next_cursor = operations.fetch_deleted_users_page(_field(query, "after", int, required=False),
+                                                            min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                            **_filters(query, "account_number", "start_date", "end_date"))
+    return 200, _page(rows, next_cursor, ("account_number", "name", "closed_at"))
+
+def get_transactions(match, query, body):
+    rows, next_cursor = operations.fetch_transactions_page(_field(query, "after", int, required=False),
+                                                           min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                           **_filters(query, "account_number", "transaction_type", "start_date", "end_date"))
+    return 200, _page(rows, next_cursor, ("id", "account_number", "name", "type", "amount", "timestamp"))
+
+def get_complaints(match, query, body):
+    rows, next_cursor = operations.fetch_complaints_page(_field(query, "after", int, required=False),
+                                                         min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                         **_filters(query, "account_number", "start_date", "end_date"))
+    return 200, _page(rows, next_cursor, ("id", "account_number", "name", "message", "timestamp"))
+
+def get_daily_report(match, query, body):
+    rows, next_cursor = operations.fetch_daily_summary_page(_field(query, "after", required=False),
+                                                            min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                            **_filters(query, "start_date", "end_date"))
+    return 200, _page(rows, next_cursor, ("day", "deposits", "withdrawals", "transfers", "interest", "fees", "net_flow", "transactions"))
+
+def _rank_cursor(query):
+    # Search pages continue from "rank,id" (the "next" pair of the last page).
+    after = _field(query, "after", required=False)
+    if after is None:
+        return None
+    try:
+        rank, key = after.split(",")
+        return float(rank), int(key)
+    except ValueError:
+        raise BadRequest("Invalid value for 'after'.")
+
+def get_search_customers(match, query, body):
+    rows, next_cursor = operations.search_customers_page(_rank_cursor(query),
+                                                         min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                         text=_field(query, "q"), include_closed=query.get("closed") != "0")
+    return 200, _page(rows, next_cursor, ("account_number", "name", "status", "rank"))
+
+def get_search_complaints(match, query, body):
+    rows, next_cursor = operations.search_complaints_page(_rank_cursor(query),
+                                                          min(_field(query, "page_size", int, required=False) or operations.PAGE_SIZE, 500),
+                                                          text=_field(query, "q"))
+    return 200, _page(rows, next_cursor, ("id", "account_number", "name", "snippet", "timestamp", "rank"))
+
+def get_throttled(match, query, body):
+    tracker = operations._velocity
+    if tracker is None:
+        return 200, {"enabled": False, "rows": []}
+    rows = [dict(zip(("account_number", "rule", "rejections", "last_rejected"), row)) for row in tracker.throttled()]
+    return 200, {"enabled": True, "rows": rows, "stats": tracker.stats()}
+
+def post_login(match, query, body):
+    user = auth.login(_field(body, "account_number", int), _field(body, "pin", int))
+    if not user:
+        return 200, {"success": False, "message": "Invalid Credentials."}
+    return 200, {"success": True, "account_number": user["account_number"], "name": user["name"], "balance": user["balance"],
+                 "token": _new_session("customer", user["account_number"])}
+
+def post_admin_login(match, query, body):
+    username = _field(body, "username")
+    if not auth.admin_login(username, _field(body, "password")):
+        return 200, {"success": False}
+    return 200, {"success": True, "token": _new_session("admin", username)}
+
+# WRITE ENDPOINTS
+
+def post_create_account(match, query, body):
+    pin = _field(body, "pin")
+    if not (pin.isdigit() and len(pin) == 4):
+        raise BadRequest("PIN must be exactly 4 digits.")
+    return 200, {"success": True, "account_number": auth.create_account(_field(body, "name"), int(pin))}
+
+def post_create_accounts(match, query, body):
+    customers = body.get("customers")
+    if not isinstance(customers, list) or not customers:
+        raise BadRequest("Field 'customers' must be a non-empty list.")
+    rows = []
+    for customer in customers:
+        if not isinstance(customer, dict):
+            raise BadRequest("Each customer must be an object with 'name' and 'pin'.")
+        pin = _field(customer, "pin")
+        if not (pin.isdigit() and len(pin) == 4):
+            raise BadRequest("PIN must be exactly 4 digits.")
+        rows.append((_field(customer, "name"), int(pin)))
+    return 200, {"success": True, "account_numbers": auth.create_accounts(rows)}
+
+def post_deposit(match, query, body):
+    return 200, _result(operations.deposit(_field(body, "account_number", int), _field(body, "amount", float)))
+
+def post_withdraw(match, query, body):
+    return 200, _result(operations.withdraw(_field(body, "account_number", int), _field(body, "amount", float)))
+
+def post_transfer(match, query, body):
+    return 200, _result(operations.transfer_funds(_field(body, "sender_account", int), _field(body, "receiver_account", int),
+                                                  _field(body, "amount", float)))
+
+def post_update_pin(match, query, body):
+    pin = _field(body, "pin")
+    if not (pin.isdigit() and len(pin) == 4):
+        raise BadRequest("PIN must be exactly 4 digits.")
+    return 200, _result(operations.update_pin(int(match["acc"]), int(pin)))
+
+def post_close_account(match, query, body):
+    outcome = operations.close_account(int(match["acc"]))
+    if outcome[0]:
+        _end_sessions("customer", int(match["acc"]))
+    return 200, _result(outcome)
+
+def post_complaint(match, query, body):
+    return 200, _result(operations.submit_complaint(_field(body, "account_number", int), _field(body, "message")))
+
+def post_add_admin(match, query, body):
+    return 200, _result(operations.add_new_admin(_field(body, "username"), _field(body, "password")))
+
+def post_apply_interest(match, query, body):
+    return 200, _result(operations.apply_interest_to_all())
+
+def post_rate_cycle(match, query, body):
+    days = _field(body, "days", int, required=False) or rates.CYCLE_DAYS
+    return 200, _result(rates.run_cycle(days, charge_fees=body.get("charge_fees") is not False,
+                                        dry_run=bool(body.get("dry_run")), cycle=body.get("cycle")))
+
+def post_export(match, query, body):
+    compress = bool(body.get("compress"))
+    with snapshots.reporting(bool(body.get("snapshot"))):
+        return 200, _result(operations.export_transactions_csv(
+            _export_path(compress), compress=compress, incremental=bool(body.get("incremental")),
+            save_watermarks=_on_writer(operations.save_export_watermarks), **_filters(body, "account_number", "start_date", "end_date")))
+
+def post_snapshot(match, query, body):
+    return 200, _result(snapshots.take_snapshot())
+
+ACC = r"(?P<acc>\d+)"
+# Report endpoints are reads that ?snapshot=1 sends to the latest reporting snapshot;
+# like exports and snapshots, they run on the readers, off the posting path.
+READ, REPORT, WRITE, POSTING = "read", "report", "write", "posting"
+# Who may call a route: anyone, the account it acts on, or an admin.
+PUBLIC, CUSTOMER, ADMIN = "public", "customer", "admin"
+ROUTES = [
+    ("GET", rf"/accounts/{ACC}", get_account, READ, CUSTOMER),
+    ("GET", rf"/accounts/{ACC}/balance", get_balance, READ, CUSTOMER),
+    ("GET", rf"/accounts/{ACC}/history", get_history, READ, CUSTOMER),
+    ("GET", rf"/accounts/{ACC}/statement", get_statement, READ, CUSTOMER),
+    ("GET", rf"/accounts/{ACC}/loan-eligibility", get_loan_eligibility, READ, CUSTOMER),
+    ("GET", r"/users", get_users, REPORT, ADMIN),
+    ("GET", r"/deleted-users", get_deleted_users, REPORT, ADMIN),
+    ("GET", r"/transactions", get_transactions, REPORT, ADMIN),
+    ("GET", r"/complaints", get_complaints, REPORT, ADMIN),
+    ("GET", r"/reports/daily", get_daily_report, REPORT, ADMIN),
+    ("GET", r"/search/customers", get_search_customers, READ, ADMIN),
+    ("GET", r"/search/complaints", get_search_complaints, READ, ADMIN),
+    ("GET", r"/admin/throttled", get_throttled, READ, ADMIN),
+    ("POST", r"/login", post_login, READ, PUBLIC),
+    ("POST", r"/admin/login", post_admin_login, READ, PUBLIC),
+    ("POST", r"/accounts", post_create_account, WRITE, PUBLIC),
+    ("POST", r"/accounts/bulk", post_create_accounts, WRITE, ADMIN),
+    ("POST", r"/deposit", post_deposit, POSTING, CUSTOMER),
+    ("POST", r"/withdraw", post_withdraw, POSTING, CUSTOMER),
+    ("POST", r"/transfer", post_transfer, POSTING, CUSTOMER),
+    ("POST", rf"/accounts/{ACC}/pin", post_update_pin, WRITE, CUSTOMER),
+    ("POST", rf"/accounts/{ACC}/close", post_close_account, WRITE, CUSTOMER),
+    ("POST", r"/complaints", post_complaint, WRITE, CUSTOMER),
+    ("POST", r"/admins", post_add_admin, WRITE, ADMIN),
+    ("POST", r"/admin/interest", post_apply_interest, WRITE, ADMIN),
+    ("POST", r"/admin/rate-cycle", post_rate_cycle, WRITE, ADMIN),
+    ("POST", r"/admin/export", post_export, REPORT, ADMIN),
+    ("POST", r"/admin/snapshot", post_snapshot, REPORT, ADMIN),
+]
+COMPILED_ROUTES = [(method, re.compile(pattern + r"/?"), handler, kind, access) for method, pattern, handler, kind, access in ROUTES]
+
+def _route(method, path):
+    allowed = False
+    for route_method, pattern, handler, kind, access in COMPILED_ROUTES:
+        match = pattern.fullmatch(path)
+        if match:
+            if route_method == method:
+                return handler, kind, access, match.groupdict()
+            allowed = True
+    return None, 405 if allowed else 404, None, None
+
+def _dispatch(handler, match, query, body, snapshot=False, access=PUBLIC, headers=None):
+    try:
+        _authorize(access, match, body, headers or {})
+        with snapshots.reporting(snapshot) as name:
+            status, payload = handler(match, query, body)
+        if name:
+            payload["snapshot"] = name
+        return status, payload
+    except Unauthorized as e:
+        return 401, {"error": str(e)}
+    except BadRequest as e:
+        return 400, {"error": str(e)}
+    except (ValueError, RuntimeError, sqlite3.IntegrityError) as e:
+        return 400, {"error": str(e)}
+    except Exception as e:
+        return 500, {"error": str(e)}
+
+class BankServer:
+    def __init__(self, host=HOST, port=PORT, readers=READER_THREADS, group_commit=False, ledger_engine=False, snapshot_interval=None,
+                 velocity_limits=False):
+        self.host = host
+        self.port = port
+        self.readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="bank-reader")
+        # One thread owns every write, so commits never queue on SQLite's lock.
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bank-writer")
+        # With group commit (or the ledger engine) postings are serialized
+        # further down; callers only wait on a shared sync, so many can be in flight.
+        self.posters = ThreadPoolExecutor(max_workers=POSTING_THREADS, thread_name_prefix="bank-poster") if group_commit or ledger_engine else None
+        self.group_commit = group_commit
+        self.ledger_engine = ledger_engine
+        self.snapshot_interval = snapshot_interval
+        self.velocity_limits = velocity_limits
+        self.snapshots = None
+        self.recovery = None
+        self.server = None
+
+    async def handle(self, method, target, body_bytes, headers=None):
+        url = urlsplit(target)
+        handler, kind, access, match = _route(method, url.path)
+        if handler is None:
+            return kind, {"error": STATUS_TEXT[kind]}
+        query = dict(parse_qsl(url.query))
+        try:
+            body = json.loads(body_bytes) if body_bytes else {}
+            if not isinstance(body, dict):
+                raise ValueError
+        except ValueError:
+            return 400, {"error": "Body must be a JSON object."}
+        if kind == POSTING:
+            executor = self.posters or self.writer
+        else:
+            executor = self.writer if kind == WRITE else self.readers
+        snapshot = kind == REPORT and query.get("snapshot", "").lower() in ("1", "true", "yes")
+        return await asyncio.get_running_loop().run_in_executor(executor, _dispatch, handler, match, query, body, snapshot,
+                                                                  access, headers)
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    await self.respond(writer, 400, {"error": "Malformed request line."}, keep_alive=False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.respond(writer, 400, {"error": "Invalid Content-Length header."}, keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    await self.respond(writer, 413, {"error": STATUS_TEXT[413]}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                status, payload = await self.handle(method.upper(), target, body, headers)
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        body = json.dumps(payload, default=str).encode()
+        head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode() + body)
+        await writer.drain()
+
+    async def start(self):
+        global _writer
+        database.init_db()
+        if database.is_sharded():
+            shards.recover_transfers()
+            self.recovery = shards.RecoveryScheduler()
+        success, msg = ledger.recover_log()
+        if not success:
+            raise RuntimeError(msg)
+        if self.group_commit:
+            operations.enable_group_commit()
+        if self.ledger_engine:
+            operations.enable_ledger_engine()
+        if self.velocity_limits:
+            operations.enable_velocity_limits()
+        if self.snapshot_interval:
+            self.snapshots = snapshots.Scheduler(self.snapshot_interval)
+        _writer = self.writer
+        self.server = await asyncio.start_server(self.serve_client, self.host, self.port, backlog=BACKLOG)
+        return self.server
+
+    async def serve_forever(self):
+        server = await self.start()
+        print(f"[System] Bank service listening on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def shutdown(self):
+        global _writer
+        _writer = None
+        if self.snapshots:
+            self.snapshots.stop()
+        if self.recovery:
+            self.recovery.stop()
+        if self.posters:
+            self.posters.shutdown(wait=True)
+            operations.disable_group_commit()
+            operations.disable_ledger_engine()
+        self.readers.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        operations.disable_velocity_limits()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the bank operations over local HTTP.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--readers", type=int, default=READER_THREADS, help="threads serving read endpoints")
+    parser.add_argument("--group-commit", action="store_true", help="batch postings into shared commits")
+    parser.add_argument("--ledger-engine", action="store_true", help="keep balances in memory behind a write-ahead log")
+    parser.add_argument("--snapshot-interval", type=float, help="take a reporting snapshot every this many seconds")
+    parser.add_argument("--no-velocity-limits", action="store_true", help="do not enforce the per-account velocity limits")
+    args = parser.parse_args(argv)
+
+    service = BankServer(args.host, args.port, args.readers, args.group_commit, args.ledger_engine, args.snapshot_interval,
+                         not args.no_velocity_limits)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    except RuntimeError as e:
+        print(f"[ERROR] {e}")
+        raise SystemExit(1)
+    finally:
+        service.shutdown()
+
+if __name__ == "__main__":
+    main()
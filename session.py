@@ -0,0 +1,82 @@
+import database
+import operations
+
+# A logged-in customer's dashboard session. It holds one pooled connection
+# (to the account's shard) for its whole lifetime; because the pool is re-entrant per thread, every
+# operations.* call made during the session runs on that same connection.
+# The account row is cached on the session and only re-read after a write.
+
+class Session:
+    def __init__(self, user):
+        self.account_number = user["account_number"]
+        self._connection = database.connection(self.account_number)
+        self.conn = self._connection.__enter__()
+        self.account = (user["account_number"], user["name"], user["pin"], user["balance"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn = None
+            self._connection.__exit__(None, None, None)
+
+    @property
+    def name(self):
+        return self.account[1]
+
+    @property
+    def balance(self):
+        return self.account[3]
+
+    def refresh(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT account_number, name, pin, balance FROM users WHERE account_number = ?", (self.account_number,))
+        row = operations.live_account(cursor.fetchone())
+        if row:
+            self.account = row
+        return row is not None
+
+    def _after_write(self, outcome):
+        if outcome[0]:
+            self.refresh()
+        return outcome
+
+    # READS (served from the session state)
+
+    def check_loan_eligibility(self):
+        return operations.check_loan_eligibility(self.account_number, balance=self.balance)
+
+    def print_history(self):
+        operations.print_history(self.account_number)
+
+    def print_statement(self, start_date, end_date):
+        operations.print_statement(self.account_number, start_date, end_date)
+
+    def export_statement_csv(self, start_date, end_date):
+        return operations.export_statement_csv(self.account_number, start_date, end_date)
+
+    # WRITES (refresh the cached row afterwards)
+
+    def deposit(self, amount):
+        return self._after_write(operations.deposit(self.account_number, amount))
+
+    def withdraw(self, amount):
+        return self._after_write(operations.withdraw(self.account_number, amount))
+
+    def transfer(self, receiver_acc, amount):
+        return self._after_write(operations.transfer_funds(self.account_number, receiver_acc, amount))
+
+    def update_pin(self, new_pin):
+        return self._after_write(operations.update_pin(self.account_number, new_pin))
+
+    def submit_complaint(self, message):
+        return operations.submit_complaint(self.account_number, message, name=self.name)
+
+    def close_account(self):
+        if self.balance > 0:
+            return False, "Cannot close account with remaining balance. Please withdraw funds first."
+        return operations.close_account(self.account_number)
@@ -0,0 +1,310 @@
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import database
+from database import connection
+from cache import account_cache
+import operations
+import summaries
+
+# Cross-shard transfers (see database.SHARD_COUNT). A transfer between two
+# shards cannot share one SQLite transaction, so it runs as a two-phase
+# commit coordinated through transfer_log in the home database:
+#
+#   1. log the transfer as PREPARING
+#   2. prepare both branches, each in its own shard: the CREDIT branch checks
+#      the receiver exists, the DEBIT branch takes the money with the usual
+#      guarded update and writes the TRANSFER_SENT row
+#   3. decide: PREPARING -> COMMITTED (or ABORTED) in the log; this single
+#      compare-and-set is the commit point
+#   4. finish both branches: a committed CREDIT branch credits the receiver
+#      and writes TRANSFER_RECEIVED, an aborted DEBIT branch pays the money
+#      back as TRANSFER_REVERSED; then the log entry is marked completed
+#
+# Every step commits with synchronous=FULL. Branches only move out of
+# PREPARED once, so finishing is idempotent: transfer() retries a failed
+# finish a few times, and recover_transfers() (at start-up, and every
+# RECOVERY_INTERVAL seconds in the service) drives whatever is left to
+# completion: decided transfers are finished, undecided ones older than
+# RECOVERY_GRACE_SECONDS are presumed aborted. Once the decision is
+# COMMITTED the transfer has happened, even if finishing it has to wait.
+# A committed transfer whose receiver row is gone by the time it is
+# finished is REVERSED instead: the sender gets the money back, and the
+# log and both branches record it. Finishing writes balances directly, so
+# recovery waits while the ledger engine owns them (it only takes transfers
+# logged before it started).
+
+RECOVERY_GRACE_SECONDS = 30
+RECOVERY_INTERVAL = 60
+FINISH_ATTEMPTS = 3
+FINISH_RETRY_DELAY = 0.05     # seconds, grows with each attempt
+
+# HELPER FUNCTIONS
+
+@contextmanager
+def _durable(conn):
+    conn.execute("PRAGMA synchronous = FULL")
+    try:
+        yield conn
+    finally:
+        conn.execute(f"PRAGMA synchronous = {database.PRAGMAS['synchronous']}")
+
+def _last_id(cursor):
+    cursor.execute("SELECT last_insert_rowid()")
+    return cursor.fetchone()[0]
+
+def _decide(transfer_id, decision):
+    # Returns the decision that stands: a concurrent recovery may have
+    # presumed the transfer aborted first.
+    with connection() as conn, _durable(conn):
+        cursor = conn.cursor()
+        cursor.execute("UPDATE transfer_log SET state = ?, updated_at = ? WHERE id = ? AND state = 'PREPARING'",
+                       (decision, operations.get_ist_time(), transfer_id))
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT state FROM transfer_log WHERE id = ?", (transfer_id,))
+            decision = cursor.fetchone()[0]
+        conn.commit()
+    return decision
+
+# TWO-PHASE TRANSFER
+
+def _prepare(transfer_id, sender_acc, receiver_acc, amount):
+    with connection(receiver_acc) as conn, _durable(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT 1 FROM users WHERE account_number = ?", (receiver_acc,))
+            if not cursor.fetchone():
+                conn.rollback()
+                return False, "Receiver account not found."
+            cursor.execute("INSERT INTO transfer_branches (transfer_id, role, account_number, amount, state) VALUES (?, 'CREDIT', ?, ?, 'PREPARED')",
+                           (transfer_id, receiver_acc, amount))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+
+    with connection(sender_acc) as conn, _durable(conn):
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("UPDATE users SET balance = balance - ? WHERE account_number = ? AND balance >= ? RETURNING name, balance",
+                           (amount, sender_acc, amount))
+            sender = cursor.fetchone()
+            if not sender:
+                conn.rollback()
+                return False, "Insufficient funds."
+            operations._record(cursor, [(sender_acc, sender[0], 'TRANSFER_SENT', amount, operations.get_ist_time(), sender[1])])
+            cursor.execute("INSERT INTO transfer_branches (transfer_id, role, account_number, amount, state, ledger_id) VALUES (?, 'DEBIT', ?, ?, 'PREPARED', ?)",
+                           (transfer_id, sender_acc, amount, _last_id(cursor)))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            return False, str(e)
+        account_cache.invalidate(sender_acc)
+    return True, "Transfer successful."
+
+def _finish_branch(transfer_id, role, account_number, decision):
+    # Returns the state the branch ends in (None if it was never prepared).
+    with connection(account_number) as conn, _durable(conn):
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT amount, state FROM transfer_branches WHERE transfer_id = ? AND role = ?", (transfer_id, role))
+        row = cursor.fetchone()
+        if row is None or row[1] != 'PREPARED':
+            conn.rollback()
+            return row and row[1]
+        amount = row[0]
+        kind = {('CREDIT', 'COMMITTED'): 'TRANSFER_RECEIVED', ('DEBIT', 'ABORTED'): 'TRANSFER_REVERSED',
+                ('DEBIT', 'REVERSED'): 'TRANSFER_REVERSED'}.get((role, decision))
+        ledger_id = None
+        if kind:
+            cursor.execute("UPDATE users SET balance = balance + ? WHERE account_number = ? RETURNING name, balance",
+                           (amount, account_number))
+            account = cursor.fetchone()
+            if account is None:
+                # close_account() refuses while a branch is PREPARED, but if
+                # the account is gone anyway, a receiver's transfer is
+                # reversed and a sender's refund is parked for review
+                # (reconcile.py reports it).
+                decision = 'REVERSED' if role == 'CREDIT' else 'PARKED'
+            else:
+                operations._record(cursor, [(account_number, account[0], kind, amount, operations.get_ist_time(), account[1])])
+                # A DEBIT branch keeps pointing at its TRANSFER_SENT row.
+                ledger_id = _last_id(cursor) if role == 'CREDIT' else None
+        cursor.execute("UPDATE transfer_branches SET state = ?, ledger_id = COALESCE(?, ledger_id) WHERE transfer_id = ? AND role = ?",
+                       (decision, ledger_id, transfer_id, role))
+        conn.commit()
+    account_cache.invalidate(account_number)
+    return decision
+
+def _finish(transfer_id, sender_acc, receiver_acc, decision):
+    # Returns the outcome: the decision, or REVERSED if the receiver was gone.
+    if _finish_branch(transfer_id, 'CREDIT', receiver_acc, decision) == 'REVERSED':
+        decision = 'REVERSED'
+    _finish_branch(transfer_id, 'DEBIT', sender_acc, decision)
+    with connection() as conn, _durable(conn):
+        conn.execute("UPDATE transfer_log SET state = ?, completed = 1, updated_at = ? WHERE id = ?",
+                     (decision, operations.get_ist_time(), transfer_id))
+        conn.commit()
+    return decision
+
+def _settle(transfer_id, sender_acc, receiver_acc, decision):
+    # Finishing is idempotent, so a failed attempt (a locked shard, say) is
+    # retried; what is still unfinished is left to recover_transfers().
+    for attempt in range(1, FINISH_ATTEMPTS + 1):
+        try:
+            return _finish(transfer_id, sender_acc, receiver_acc, decision)
+        except Exception:
+            if attempt < FINISH_ATTEMPTS:
+                time.sleep(FINISH_RETRY_DELAY * attempt)
+    return decision
+
+def transfer(sender_acc, receiver_acc, amount):
+    sender_acc, receiver_acc = int(sender_acc), int(receiver_acc)
+    try:
+        with connection() as conn, _durable(conn):
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO transfer_log (sender, receiver, amount, state, created_at) VALUES (?, ?, ?, 'PREPARING', ?)",
+                           (sender_acc, receiver_acc, amount, operations.get_ist_time()))
+            transfer_id = cursor.lastrowid
+            conn.commit()
+
+        success, msg = _prepare(transfer_id, sender_acc, receiver_acc, amount)
+        decision = _decide(transfer_id, 'COMMITTED' if success else 'ABORTED')
+    except Exception as e:
+        # Whatever was logged is settled by recover_transfers().
+        return False, str(e)
+    outcome = _settle(transfer_id, sender_acc, receiver_acc, decision)
+    if outcome == 'COMMITTED':
+        return True, msg
+    if outcome == 'REVERSED':
+        return False, "Receiver account was closed. The transfer was reversed."
+    return False, msg if not success else "Transfer timed out and was reversed."
+
+# RECOVERY
+
+def recover_transfers(grace_seconds=RECOVERY_GRACE_SECONDS):
+    import ledger  # imported on demand: ledger imports this module
+    if ledger.log_in_use():
+        return False, "In-doubt transfers cannot be settled while the ledger engine owns the balances."
+    try:
+        with connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, sender, receiver, state FROM transfer_log WHERE completed = 0 AND (state != 'PREPARING' OR created_at < datetime('now', '+330 minutes', ?)) ORDER BY id",
+                           (f"-{grace_seconds} seconds",))
+            pending = cursor.fetchall()
+        for transfer_id, sender_acc, receiver_acc, state in pending:
+            if state == 'PREPARING':
+                state = _decide(transfer_id, 'ABORTED')
+            _finish(transfer_id, sender_acc, receiver_acc, state)
+        return True, f"Settled {len(pending)} in-doubt transfers."
+    except Exception as e:
+        return False, str(e)
+
+class RecoveryScheduler:
+    # Runs recover_transfers() every `interval` seconds on a background
+    # thread, so a long-running service settles transfers left unfinished.
+    def __init__(self, interval=RECOVERY_INTERVAL):
+        self.interval = interval
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bank-transfer-recovery", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.last = recover_transfers()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+# SPLITTING AN UNSHARDED DATABASE
+
+def split_database():
+    # Moves accounts and their ledger out of DB_NAME into SHARD_COUNT shard
+    # files, offsetting ledger ids into each shard's id range. Legacy
+    # transfers whose two sides land in different shards are logged as
+    # completed cross-shard transfers (keyed by the TRANSFER_SENT id) so
+    # reconciliation can still pair them.
+    if not database.is_sharded():
+        return False, f"Set {database.SHARD_ENV} to the number of shards first."
+    shards = database.SHARD_COUNT
+    with connection() as home:
+        database.migrate(home)
+        cursor = home.cursor()
+        cursor.execute("SELECT shards FROM storage_layout WHERE id = 1")
+        if cursor.fetchone()[0] != 1:
+            return False, f"{database.DB_NAME} is already sharded."
+        cursor.execute("SELECT 1 FROM archive_months LIMIT 1")
+        if cursor.fetchone():
+            return False, "Databases with archived months cannot be split."
+        for index in range(shards):
+            if os.path.exists(database.shard_path(index)):
+                return False, f"'{database.shard_path(index)}' already exists."
+        try:
+            cursor.execute("""
+                INSERT OR IGNORE INTO transfer_log (id, sender, receiver, amount, state, completed, created_at, updated_at)
+                SELECT s.id, s.account_number, r.account_number, s.amount, 'COMMITTED', 1, s.timestamp, s.timestamp
+                FROM transactions s JOIN transactions r ON r.id = s.id + 1 AND r.transaction_type = 'TRANSFER_RECEIVED'
+                                                       AND r.amount = s.amount AND r.timestamp = s.timestamp
+                WHERE s.transaction_type = 'TRANSFER_SENT' AND s.account_number % ? != r.account_number % ?
+            """, (shards, shards))
+            home.commit()
+            for index in range(shards):
+                _copy_shard(index)
+            cursor.execute("BEGIN IMMEDIATE")
+            for table in ("transactions", "users", "deleted_users", "daily_totals"):
+                cursor.execute(f"DELETE FROM {table}")
+            cursor.execute("UPDATE storage_layout SET shards = ? WHERE id = 1", (shards,))
+            home.commit()
+        except Exception as e:
+            if home.in_transaction:
+                home.rollback()
+            return False, str(e)
+        home.execute("VACUUM")
+    return True, f"Split {database.DB_NAME} into {shards} shards."
+
+def _copy_shard(index):
+    shards, offset = database.SHARD_COUNT, index * database.SHARD_ID_SPAN
+    with connection(shard=index) as conn:
+        database.migrate(conn)
+        database.init_shard(conn, index)
+        cursor = conn.cursor()
+        cursor.execute("ATTACH DATABASE ? AS home", (os.path.abspath(database.DB_NAME),))
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for table in ("users", "deleted_users"):
+                cursor.execute(f"INSERT INTO main.{table} SELECT * FROM home.{table} WHERE account_number % ? = ?", (shards, index))
+            cursor.execute("INSERT INTO main.transactions (id, account_number, name, transaction_type, amount, timestamp, balance_after) "
+                           "SELECT id + ?, account_number, name, transaction_type, amount, timestamp, balance_after FROM home.transactions WHERE account_number % ? = ?", 
+                           (offset, shards, index))
+            cursor.execute("INSERT INTO main.transfer_branches (transfer_id, role, account_number, amount, state, ledger_id) "
+                           "SELECT id, 'DEBIT', sender, amount, 'COMMITTED', id + ? FROM home.transfer_log WHERE sender % ? = ?", 
+                           (offset, shards, index))
+            cursor.execute("INSERT INTO main.transfer_branches (transfer_id, role, account_number, amount, state, ledger_id) "
+                           "SELECT id, 'CREDIT', receiver, amount, 'COMMITTED', id + 1 + ? FROM home.transfer_log WHERE receiver % ? = ?", 
+                           (offset, shards, index))
+            summaries.rebuild(cursor)
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            cursor.execute("DETACH DATABASE home")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Sharded storage maintenance.")
+    parser.add_argument("command", choices=["split", "recover"],
+                        help=f"split: move an unsharded {database.DB_NAME} into ${database.SHARD_ENV} shards; recover: settle in-doubt transfers")
+    args = parser.parse_args()
+    if args.command == "split":
+        success, msg = split_database()
+    else:
+        database.init_db()
+        success, msg = recover_transfers()
+    print(msg)
+    sys.exit(0 if success else 1)
@@ -0,0 +1,167 @@
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+import database
+
+# Reporting snapshots. Long admin reads (user and transaction listings, the
+# daily report, CSV exports, reconciliation) can run against a consistent
+# copy of the database instead of holding read transactions on the live
+# files while tellers post. take_snapshot() first opens a read transaction
+# on every data file (home and shards), so all copies show the same moment,
+# then copies each with the SQLite backup API a few pages per step, sleeping
+# between steps so the posting path keeps the disk. A finished snapshot is
+# renamed into place and becomes LATEST; older ones beyond SNAPSHOT_KEEP are
+# removed. Inside reporting() the current thread's reads go to the latest
+# snapshot (see database.reading_snapshot()). Archive files are immutable
+# and are read from the live archive directory.
+
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_PAGES = 4096         # pages copied per backup step (16 MB at 4 KB pages)
+SNAPSHOT_PAUSE = 0.005        # seconds between steps
+SNAPSHOT_KEEP = 2
+LATEST = "LATEST"
+
+# HELPER FUNCTIONS
+
+def _root():
+    # Snapshots live next to the database they were taken from.
+    return os.path.join(os.path.dirname(os.path.abspath(database.DB_NAME)), SNAPSHOT_DIR)
+
+def data_files():
+    # (path, shard) of every data file; shard None is the home database.
+    files = [(database.DB_NAME, None)]
+    if database.is_sharded():
+        files += [(database.shard_path(index), index) for index in range(database.SHARD_COUNT)]
+    return files
+
+def latest():
+    # (name, directory) of the newest complete snapshot, or None.
+    try:
+        with open(os.path.join(_root(), LATEST)) as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    directory = os.path.join(_root(), name)
+    return (name, directory) if name and os.path.isdir(directory) else None
+
+def list_snapshots():
+    # Complete snapshots, newest first; ".partial" ones are still being taken.
+    root = _root()
+    if not os.path.isdir(root):
+        return []
+    return sorted((name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name)) and not name.endswith(".partial")),
+                  reverse=True)
+
+def _prune(keep):
+    root, current = _root(), latest()
+    for name in list_snapshots()[keep:]:
+        if current and name == current[0]:
+            continue
+        directory = os.path.join(root, name)
+        database.close_all(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+
+# TAKING SNAPSHOTS
+
+def take_snapshot(pages=SNAPSHOT_PAGES, pause=SNAPSHOT_PAUSE, keep=SNAPSHOT_KEEP, progress=None):
+    root = _root()
+    name = time.strftime("%Y%m%d_%H%M%S")
+    suffix = 1
+    while os.path.exists(os.path.join(root, name)):
+        name, suffix = f"{time.strftime('%Y%m%d_%H%M%S')}_{suffix}", suffix + 1
+    partial = os.path.join(root, f"{name}.partial")
+    sources = []
+    try:
+        os.makedirs(partial)
+        # Pin one point in time on every file before copying any of them;
+        # WAL readers do not block the writers meanwhile.
+        for path, shard in data_files():
+            conn = database.get_connection(shard=shard)
+            sources.append((path, conn))
+            conn.execute("BEGIN")
+            conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+
+        copied = 0
+        for path, conn in sources:
+            target = sqlite3.connect(os.path.join(partial, os.path.basename(path)))
+            try:
+                def step(status, remaining, total, before=copied):
+                    if progress:
+                        progress(before + total - remaining)
+                    time.sleep(pause)
+                conn.backup(target, pages=pages, progress=step)
+                target.execute("PRAGMA journal_mode = WAL")
+                copied += target.execute("PRAGMA page_count").fetchone()[0]
+            finally:
+                target.close()
+    except Exception as e:
+        shutil.rmtree(partial, ignore_errors=True)
+        return False, str(e)
+    finally:
+        for _, conn in sources:
+            conn.close()
+
+    directory = os.path.join(root, name)
+    os.replace(partial, directory)
+    with open(os.path.join(root, f"{LATEST}.tmp"), "w") as f:
+        f.write(name)
+    os.replace(os.path.join(root, f"{LATEST}.tmp"), os.path.join(root, LATEST))
+    _prune(keep)
+    return True, f"Snapshot {name} taken ({copied} pages from {len(sources)} files)."
+
+class Scheduler:
+    # Takes a snapshot every `interval` seconds on a background thread.
+    def __init__(self, interval):
+        self.interval = interval
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="bank-snapshots", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.last = take_snapshot()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+# READING SNAPSHOTS
+
+@contextmanager
+def reporting(use_snapshot=True):
+    # Yields the snapshot name the reads inside go to, or None for the live
+    # database (no snapshot taken yet, or use_snapshot is off).
+    current = latest() if use_snapshot else None
+    if current is None:
+        yield None
+        return
+    name, directory = current
+    with database.reading_snapshot(directory):
+        yield name
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Take consistent reporting snapshots of the database.")
+    parser.add_argument("command", nargs="?", choices=["take", "list"], default="take")
+    parser.add_argument("--every", type=float, help="keep taking one every this many seconds")
+    parser.add_argument("--pages", type=int, default=SNAPSHOT_PAGES, help="pages copied per backup step")
+    parser.add_argument("--keep", type=int, default=SNAPSHOT_KEEP, help="snapshots to keep")
+    args = parser.parse_args()
+    if args.command == "list":
+        current = latest()
+        for name in list_snapshots():
+            print(f"{name}{'  (latest)' if current and name == current[0] else ''}")
+        sys.exit(0)
+    database.init_db()
+    while True:
+        success, msg = take_snapshot(args.pages, keep=args.keep)
+        print(msg)
+        if not args.every:
+            sys.exit(0 if success else 1)
+        time.sleep(args.every)
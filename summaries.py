@@ -0,0 +1,45 @@
+import sys
+import database
+
+# Daily totals and counts per transaction type, kept in step with the ledger.
+# Every posting path adds its rows here inside its own write transaction, so
+# the admin report reads a handful of rows per day instead of aggregating the
+# transactions table. Transfers count once per side (TRANSFER_SENT and
+# TRANSFER_RECEIVED); the daily_summary view derives the net flow in and out
+# of the bank from deposits, interest, withdrawals and fees.
+
+UPSERT = ("INSERT INTO daily_totals (day, transaction_type, total, count) VALUES (?, ?, ?, ?) "
+          "ON CONFLICT(day, transaction_type) DO UPDATE SET total = total + excluded.total, count = count + excluded.count")
+
+def record(cursor, entries):
+    # entries are transactions rows: (account_number, name, type, amount, timestamp, ...)
+    totals = {}
+    for entry in entries:
+        key = (entry[4][:10], entry[2])
+        total, count = totals.get(key, (0.0, 0))
+        totals[key] = (total + entry[3], count + 1)
+    cursor.executemany(UPSERT, [(day, kind, total, count) for (day, kind), (total, count) in totals.items()])
+
+def record_select(cursor, select, params):
+    # For set-based postings: `select` yields (day, type, total, count) groups
+    # and must have a WHERE clause so the upsert parses unambiguously.
+    cursor.execute(f"INSERT INTO daily_totals (day, transaction_type, total, count) {select} "
+                   "ON CONFLICT(day, transaction_type) DO UPDATE SET total = total + excluded.total, count = count + excluded.count", 
+                   params)
+
+def rebuild(cursor):
+    # Archived days (see archive.py) are no longer in the ledger, so their
+    # totals are kept and only days from the oldest hot row on are redone.
+    cursor.execute("SELECT substr(MIN(timestamp), 1, 10) FROM transactions")
+    first_day = cursor.fetchone()[0]
+    if first_day is None:
+        return
+    cursor.execute("DELETE FROM daily_totals WHERE day >= ?", (first_day,))
+    cursor.execute(database.DAILY_TOTALS_BACKFILL)
+
+if __name__ == "__main__":
+    import operations
+    database.init_db()
+    success, msg = operations.rebuild_daily_summaries()
+    print(msg)
+    sys.exit(0 if success else 1)
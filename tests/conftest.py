@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+import textwrap
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+import operations
+from cache import account_cache
+
+def _open_bank(tmp_path, monkeypatch, shards):
+    # A fresh database (and shard files) in tmp_path; pools opened on an
+    # earlier test's files (and opt-in modes) are dropped so nothing leaks
+    # between tests.
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(database, "DB_NAME", str(tmp_path / "bank.db"))
+    monkeypatch.setattr(database, "SHARD_COUNT", shards)
+    monkeypatch.setenv(database.SHARD_ENV, str(shards))
+    _reset()
+    database.init_db()
+    return tmp_path
+
+def _reset():
+    operations.disable_ledger_engine()
+    operations.disable_velocity_limits()
+    operations.disable_group_commit()
+    for pool in database._pools.values():
+        pool.close_all()
+    database._pools.clear()
+    account_cache.clear()
+
+@pytest.fixture
+def bank(tmp_path, monkeypatch):
+    yield _open_bank(tmp_path, monkeypatch, 0)
+    _reset()
+
+@pytest.fixture
+def sharded_bank(tmp_path, monkeypatch):
+    yield _open_bank(tmp_path, monkeypatch, 3)
+    _reset()
+
+def run_and_crash(directory, code):
+    # Runs code against the bank in directory in a child process that exits
+    # without stopping anything, as a crash would.
+    script = f"import os, sys\nsys.path.insert(0, {ROOT!r})\n{textwrap.dedent(code)}\nos._exit(0)\n"
+    subprocess.run([sys.executable, "-c", script], cwd=directory, env=os.environ.copy(), check=True)
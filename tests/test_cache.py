@@ -0,0 +1,43 @@
+import threading
+import auth
+import operations
+from cache import AccountCache, account_cache
+
+def test_writes_invalidate_cached_rows(bank):
+    account = auth.create_account("Owner", "1234")
+    other = auth.create_account("Other", "1234")
+    assert operations.get_account(account)[3] == 0
+    assert operations.get_account(account) == account_cache.get(account)
+
+    operations.deposit(account, 100)
+    assert operations.get_account(account)[3] == 100
+    operations.transfer_funds(account, other, 30)
+    assert operations.get_balance(account) == 70 and operations.get_balance(other) == 30
+
+    operations.update_pin(account, 4321)
+    assert auth.login(account, 1234) is None and auth.login(account, 4321)
+
+    operations.withdraw(account, 70)
+    assert operations.close_account(account)[0]
+    assert operations.get_account(account) is None
+
+def test_stale_reads_are_not_cached():
+    cache = AccountCache()
+    version = cache.version(1)
+    # An invalidation between the read and the put wins over the read.
+    cache.invalidate(1)
+    cache.put(1, (1, "Owner", 1234, 0.0), version)
+    assert cache.get(1) is None
+    cache.put(1, (1, "Owner", 1234, 5.0), cache.version(1))
+    assert cache.get(1)[3] == 5.0
+
+def test_group_commit_invalidates_after_its_commit(bank):
+    account = auth.create_account("Owner", "1234")
+    operations.get_account(account)
+    operations.enable_group_commit()
+    threads = [threading.Thread(target=operations.deposit, args=(account, 10)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert operations.get_account(account)[3] == 80
@@ -0,0 +1,55 @@
+import threading
+import auth
+import database
+import groupcommit
+import operations
+
+def _rows(account):
+    with database.connection(account) as conn:
+        return conn.execute("SELECT COUNT(*) FROM transactions WHERE account_number = ?", (account,)).fetchone()[0]
+
+def test_a_failed_posting_rolls_back_only_itself(bank):
+    account = auth.create_account("Owner", "1234")
+
+    def rejected(cursor, account_number, amount, current_time):
+        operations.post_deposit(cursor, account_number, amount, current_time)
+        return False, "Rejected."
+    def broken(cursor, account_number, amount, current_time):
+        operations.post_deposit(cursor, account_number, amount, current_time)
+        raise RuntimeError("Broken.")
+
+    # A long delay and a batch of three put all of them in one transaction.
+    committer = groupcommit.GroupCommitter(operations.get_ist_time, max_batch=3, max_delay=5)
+    outcomes = {}
+    threads = [threading.Thread(target=lambda post=post: outcomes.__setitem__(post, committer.submit(post, (account,), account, 10)))
+               for post in (operations.post_deposit, rejected, broken)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    committer.stop()
+
+    assert committer.batches == 1
+    assert outcomes[operations.post_deposit][0]
+    assert outcomes[rejected] == (False, "Rejected.") and outcomes[broken] == (False, "Broken.")
+    assert operations.get_balance(account) == 10 and _rows(account) == 1
+
+def test_concurrent_withdrawals_never_overdraw(bank):
+    account = auth.create_account("Owner", "1234")
+    operations.deposit(account, 100)
+    operations.enable_group_commit()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(operations.withdraw(account, 30)[0])) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 3
+    assert operations.get_balance(account) == 10 and _rows(account) == 4
+
+def test_postings_after_stop_are_refused(bank):
+    account = auth.create_account("Owner", "1234")
+    committer = groupcommit.GroupCommitter(operations.get_ist_time)
+    committer.stop()
+    assert committer.submit(operations.post_deposit, (account,), account, 10) == (False, "Group commit is shutting down.")
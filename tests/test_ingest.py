@@ -0,0 +1,32 @@
+import csv
+import pytest
+import auth
+import ingest
+import operations
+
+@pytest.mark.parametrize("amount", ["nan", "NaN", "inf", "-inf", "Infinity", "1e400"])
+def test_non_finite_amounts_are_rejected(amount):
+    with pytest.raises(ValueError, match="finite"):
+        ingest.parse_posting({"type": "DEPOSIT", "account_number": "570001", "amount": amount})
+
+@pytest.mark.parametrize("bank_fixture", ["bank", "sharded_bank"])
+def test_non_finite_rows_fail_alone(bank_fixture, request):
+    directory = request.getfixturevalue(bank_fixture)
+    account = auth.create_account("Importer", "1234")
+    path = directory / "postings.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["type", "account_number", "amount", "receiver_account"])
+        writer.writerow(["DEPOSIT", account, "100", ""])
+        writer.writerow(["DEPOSIT", account, "nan", ""])
+        writer.writerow(["WITHDRAWAL", account, "-inf", ""])
+        writer.writerow(["DEPOSIT", account, "1e400", ""])
+        writer.writerow(["WITHDRAWAL", account, "25", ""])
+
+    success, msg = ingest.ingest_file(str(path))
+    assert success, msg
+    assert "Applied 2 rows, 3 failed" in msg
+    assert operations.get_balance(account) == 75
+    with open(f"{path}.report.csv", newline="") as f:
+        statuses = [row["Status"] for row in csv.DictReader(f)]
+    assert statuses == ["APPLIED", "FAILED", "FAILED", "FAILED", "APPLIED"]
@@ -0,0 +1,166 @@
+import threading
+import time
+import pytest
+import auth
+import database
+import ledger
+import operations
+import reconcile
+from conftest import run_and_crash
+
+# Postings made by the crashed engine in run_and_crash(): 4 deposits, then
+# 40 transfers of 1.0 around the ring of accounts, half of them checkpointed.
+CRASHED_ENGINE = """
+import auth, operations
+accounts = [auth.create_account(f"User {i}", "1234") for i in range(4)]
+engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+for acc in accounts:
+    operations.deposit(acc, 100)
+for i in range(40):
+    if i == 20:
+        engine.checkpoint()
+    operations.transfer_funds(accounts[i % 4], accounts[(i + 1) % 4], 1)
+"""
+
+def _ledger_rows():
+    rows = 0
+    for shard in range(database.shard_count()):
+        with database.connection(shard=shard) as conn:
+            rows += conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+    return rows
+
+def _balances():
+    balances = {}
+    for shard in range(database.shard_count()):
+        with database.connection(shard=shard) as conn:
+            balances.update(conn.execute("SELECT account_number, balance FROM users").fetchall())
+    return balances
+
+@pytest.mark.parametrize("bank_fixture", ["bank", "sharded_bank"])
+def test_recovery_replays_a_crashed_log_once(bank_fixture, request):
+    directory = request.getfixturevalue(bank_fixture)
+    run_and_crash(directory, CRASHED_ENGINE)
+
+    success, msg = ledger.recover_log()
+    assert success, msg
+    assert _ledger_rows() == 4 + 40 * 2
+    assert sorted(_balances().values()) == [100.0] * 4
+
+    # A second start finds nothing left to replay.
+    assert ledger.recover_log()[0]
+    assert _ledger_rows() == 4 + 40 * 2
+    report = reconcile.reconcile(workers=1)
+    assert report["mismatches"] == [] and report["unpaired"] == []
+
+def test_recovery_refuses_a_log_owned_by_a_running_engine(bank):
+    account = auth.create_account("Owner", "1234")
+    operations.enable_ledger_engine(checkpoint_interval=3600)
+    operations.deposit(account, 50)
+
+    success, msg = ledger.recover_log()
+    assert not success and "running" in msg
+    with pytest.raises(RuntimeError):
+        ledger.LedgerEngine()
+
+    operations.disable_ledger_engine()
+    assert ledger.recover_log()[0]
+    assert _ledger_rows() == 1 and _balances()[account] == 50.0
+
+def test_engine_transfers_between_shards_are_paired(sharded_bank):
+    accounts = [auth.create_account(f"User {i}", "1234") for i in range(6)]
+    for acc in accounts:
+        operations.deposit(acc, 100)
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    pairs = [(s, r) for s in accounts for r in accounts if s != r]
+    for sender, receiver in pairs:
+        assert operations.transfer_funds(sender, receiver, 1)[0]
+    engine.checkpoint()
+    # Checkpointing again (as a retry would) must not log anything twice.
+    engine.checkpoint()
+    operations.disable_ledger_engine()
+
+    report = reconcile.reconcile(workers=1)
+    assert report["mismatches"] == [] and report["unpaired"] == []
+    cross = sum(database.shard_for(s) != database.shard_for(r) for s, r in pairs)
+    with database.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM transfer_log WHERE state = 'COMMITTED' AND completed = 1").fetchone()[0] == cross
+
+@pytest.mark.parametrize("amount", [float("nan"), float("inf"), float("-inf")])
+def test_engine_rejects_non_finite_amounts(bank, amount):
+    sender, receiver = auth.create_account("Sender", "1234"), auth.create_account("Receiver", "1234")
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    engine.deposit(sender, 100)
+
+    assert not engine.deposit(sender, amount)[0]
+    assert not engine.withdraw(sender, amount)[0]
+    assert not engine.transfer_funds(sender, receiver, amount)[0]
+    assert engine.get_balance(sender) == 100 and engine.get_balance(receiver) == 0
+    assert engine.checkpoint() == 1 and engine.checkpoint_failures == 0
+
+def test_failing_checkpoints_refuse_postings(bank, monkeypatch):
+    account = auth.create_account("Owner", "1234")
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    assert engine.deposit(account, 10)[0]
+
+    def broken(*args):
+        raise RuntimeError("disk full")
+    write = engine._write
+    monkeypatch.setattr(engine, "_write", broken)
+    for _ in range(ledger.CHECKPOINT_FAILURE_LIMIT):
+        assert engine.checkpoint() == 0
+    success, msg = engine.deposit(account, 10)
+    assert not success and "disk full" in msg
+    assert engine.stats()["checkpoint_failures"] == ledger.CHECKPOINT_FAILURE_LIMIT
+
+    # Once a checkpoint gets through, the held postings land and new ones are taken.
+    monkeypatch.setattr(engine, "_write", write)
+    assert engine.checkpoint() == 1
+    assert engine.deposit(account, 10)[0]
+    operations.disable_ledger_engine()
+    assert _ledger_rows() == 2 and _balances()[account] == 20.0
+
+def test_recovery_fails_while_the_log_cannot_be_checkpointed(bank, monkeypatch):
+    run_and_crash(bank, CRASHED_ENGINE)
+    def broken(*args):
+        raise RuntimeError("disk full")
+    with monkeypatch.context() as patch:
+        patch.setattr(ledger.LedgerEngine, "_write", broken)
+        success, msg = ledger.recover_log()
+    assert not success and "disk full" in msg
+    assert _ledger_rows() == 4 + 20 * 2    # only what the engine checkpointed itself
+
+    assert ledger.recover_log()[0]
+    assert _ledger_rows() == 4 + 40 * 2
+
+def test_postings_wait_for_a_closing_account(bank, monkeypatch):
+    account = auth.create_account("Leaving", "1234")
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    results = []
+
+    # A deposit arriving while the close runs must not land on the account.
+    close = operations._close_account
+    def close_with_deposit(account_number):
+        depositor = threading.Thread(target=lambda: results.append(operations.deposit(account_number, 25)))
+        depositor.start()
+        depositor.join(0.2)
+        return close(account_number)
+    monkeypatch.setattr(operations, "_close_account", close_with_deposit)
+
+    assert operations.close_account(account)[0]
+    while not results:
+        time.sleep(0.01)
+    assert results == [(False, "Account not found.")]
+    assert engine.checkpoint() == 0 and _ledger_rows() == 0
+
+def test_refused_close_keeps_the_account_in_the_engine(bank):
+    account = auth.create_account("Staying", "1234")
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    with database.connection(account) as conn:
+        conn.execute("INSERT INTO transfer_branches (transfer_id, role, account_number, amount, state) VALUES (1, 'CREDIT', ?, 5, 'PREPARED')",
+                     (account,))
+        conn.commit()
+
+    success, msg = operations.close_account(account)
+    assert not success and "still being settled" in msg
+    assert engine.deposit(account, 10)[0] and engine.get_balance(account) == 10
+    assert not operations.close_account(account)[0]
@@ -0,0 +1,38 @@
+import os
+import re
+import pytest
+import auth
+import metrics
+import operations
+import session
+from conftest import ROOT
+
+@pytest.fixture
+def instrumented(bank):
+    metrics.enable()
+    metrics.reset()
+    yield
+    metrics.disable()
+    metrics.reset()
+
+def test_cli_paths_are_counted(instrumented):
+    account = auth.create_account("Owner", "1234")
+    other = auth.create_account("Other", "1234")
+    with session.Session(auth.login(account, 1234)) as s:
+        s.deposit(100)
+        s.withdraw(10)
+        s.transfer(other, 5)
+    calls = {name: stats["calls"] for name, stats in metrics.snapshot().items()}
+    for name in ("auth.login", "operations.get_account", "operations.deposit", "operations.withdraw", "operations.transfer_funds"):
+        assert calls.get(name) == 1, name
+
+def test_instrumented_functions_are_not_imported_by_name():
+    # Such a name keeps the unwrapped function once metrics.enable() runs.
+    pattern = re.compile(r"^\s*from (operations|auth) import", re.MULTILINE)
+    offenders = []
+    for name in os.listdir(ROOT):
+        if name.endswith(".py"):
+            with open(os.path.join(ROOT, name)) as f:
+                if pattern.search(f.read()):
+                    offenders.append(name)
+    assert offenders == []
@@ -0,0 +1,30 @@
+import pytest
+import auth
+import operations
+
+@pytest.mark.parametrize("amount", [float("nan"), float("inf"), float("-inf")])
+def test_postings_reject_non_finite_amounts(bank, amount):
+    sender, receiver = auth.create_account("Sender", "1234"), auth.create_account("Receiver", "1234")
+    operations.deposit(sender, 100)
+
+    assert operations.deposit(sender, amount) == (False, "Amount must be a finite number.")
+    assert operations.withdraw(sender, amount) == (False, "Amount must be a finite number.")
+    assert operations.transfer_funds(sender, receiver, amount) == (False, "Amount must be a finite number.")
+    assert operations.get_balance(sender) == 100 and operations.get_balance(receiver) == 0
+
+@pytest.mark.parametrize("bank_fixture", ["bank", "sharded_bank"])
+def test_filtered_incremental_export_keeps_its_own_watermark(bank_fixture, request):
+    directory = request.getfixturevalue(bank_fixture)
+    first, second = auth.create_account("First", "1234"), auth.create_account("Second", "1234")
+    operations.deposit(first, 10)
+    operations.deposit(second, 20)
+    path = str(directory / "export.csv")
+
+    assert operations.export_transactions_csv(path, incremental=True, account_number=first) == (True, f"1 transactions saved as '{path}'")
+    # The unfiltered export still owes both rows.
+    assert operations.export_transactions_csv(path, incremental=True) == (True, f"2 transactions saved as '{path}'")
+    assert operations.export_transactions_csv(path, incremental=True)[1] == "No new transactions since the last export."
+
+    operations.deposit(first, 5)
+    assert operations.export_transactions_csv(path, incremental=True, account_number=first)[1] == f"1 transactions saved as '{path}'"
+    assert operations.export_transactions_csv(path, incremental=True)[1] == f"1 transactions saved as '{path}'"
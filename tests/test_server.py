@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+import auth
+import operations
+import server
+
+def _call(method, path, body=None, headers=None):
+    # Routes and dispatches a request as the service does, minus the socket.
+    handler, kind, access, match = server._route(method, path)
+    return server._dispatch(handler, match, {}, body or {}, access=access, headers=headers or {})
+
+def test_transfer_needs_the_senders_credentials(bank):
+    owner = auth.create_account("Owner", "1111")
+    victim = auth.create_account("Victim", "2222")
+    operations.deposit(victim, 100)
+    pin = {"x-account-pin": "1111"}
+
+    # The owner's PIN never authorizes debiting the victim, however the
+    # accounts are named.
+    assert _call("POST", "/transfer", {"sender_account": victim, "receiver_account": owner, "amount": 50}, pin)[0] == 401
+    status, _ = _call("POST", "/transfer", {"account_number": owner, "sender_account": victim,
+                                             "receiver_account": owner, "amount": 50}, pin)
+    assert status == 400
+    assert operations.get_balance(victim) == 100
+
+    operations.deposit(owner, 10)
+    status, payload = _call("POST", "/transfer", {"sender_account": owner, "receiver_account": victim, "amount": 5}, pin)
+    assert status == 200 and payload["success"]
+    assert operations.get_balance(victim) == 105
+
+def test_session_token_is_bound_to_its_account(bank):
+    owner = auth.create_account("Owner", "1111")
+    other = auth.create_account("Other", "2222")
+    status, payload = _call("POST", "/login", {"account_number": owner, "pin": 1111})
+    bearer = {"authorization": f"Bearer {payload['token']}"}
+
+    assert _call("GET", f"/accounts/{owner}/balance", headers=bearer)[0] == 200
+    assert _call("GET", f"/accounts/{other}/balance", headers=bearer)[0] == 401
+    assert _call("GET", f"/accounts/{owner}/balance")[0] == 401
+    assert _call("GET", "/users", headers=bearer)[0] == 401
+
+def test_non_finite_amounts_are_refused(bank):
+    account = auth.create_account("Owner", "1111")
+    other = auth.create_account("Other", "2222")
+    operations.deposit(account, 100)
+    pin = {"x-account-pin": "1111"}
+
+    for amount in ("inf", "-inf", "nan", 1e400):
+        for path, body in (("/deposit", {"account_number": account}), ("/withdraw", {"account_number": account}),
+                           ("/transfer", {"sender_account": account, "receiver_account": other})):
+            status, payload = _call("POST", path, dict(body, amount=amount), pin)
+            assert status == 200 and not payload["success"], (path, amount)
+    assert operations.get_balance(account) == 100 and operations.get_balance(other) == 0
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1.5"])
+def test_malformed_content_length_gets_400(bank, length):
+    async def exchange():
+        service = server.BankServer(port=0)
+        try:
+            listener = await service.start()
+            reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+            writer.write(f"POST /deposit HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            listener.close()
+            return status_line
+        finally:
+            service.shutdown()
+    assert asyncio.run(exchange()).startswith(b"HTTP/1.1 400 ")
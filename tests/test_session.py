@@ -0,0 +1,31 @@
+import auth
+import database
+import operations
+import session
+
+def test_session_calls_reuse_its_connection(bank):
+    account = auth.create_account("Owner", "1234")
+    other = auth.create_account("Other", "1234")
+    with session.Session(auth.login(account, 1234)) as s:
+        statements = []
+        s.conn.set_trace_callback(statements.append)
+        assert s.deposit(100)[0]
+        assert s.transfer(other, 40)[0]
+        assert s.check_loan_eligibility() is not None
+        # Every statement of the writes and the refresh ran on the session's connection.
+        assert any("UPDATE users SET balance = balance +" in sql for sql in statements)
+        assert any("SELECT account_number, name, pin, balance FROM users" in sql for sql in statements)
+        assert s.balance == 60
+        held = s.conn
+    assert held in database.get_pool(database.path_for(account))._idle
+
+def test_session_state_refreshes_only_after_writes(bank):
+    account = auth.create_account("Owner", "1234")
+    with session.Session(auth.login(account, 1234)) as s:
+        statements = []
+        s.conn.set_trace_callback(statements.append)
+        assert s.name == "Owner" and s.balance == 0
+        assert statements == []
+        assert not s.withdraw(10)[0]
+        assert not any("SELECT account_number, name, pin, balance" in sql for sql in statements)
+        assert s.deposit(25)[0] and s.balance == 25
@@ -0,0 +1,84 @@
+import auth
+import database
+import operations
+import reconcile
+import shards
+
+def _pair():
+    # A new sender and receiver on different shards; account numbers are
+    # spread pseudo-randomly, so open accounts until two differ.
+    first = auth.create_account("Sender", "1234")
+    while True:
+        other = auth.create_account("Receiver", "1234")
+        if database.shard_for(other) != database.shard_for(first):
+            return first, other
+
+def _in_doubt():
+    with database.connection() as conn:
+        return conn.execute("SELECT COUNT(*) FROM transfer_log WHERE completed = 0").fetchone()[0]
+
+def test_committed_transfer_is_finished_by_recovery(sharded_bank, monkeypatch):
+    sender, receiver = _pair()
+    operations.deposit(sender, 100)
+
+    # The decision is logged, then every attempt to finish fails, as if the
+    # process died before applying the credit.
+    def crash(*args):
+        raise RuntimeError("crashed")
+    monkeypatch.setattr(shards, "FINISH_RETRY_DELAY", 0)
+    with monkeypatch.context() as patch:
+        patch.setattr(shards, "_finish", crash)
+        success, _ = shards.transfer(sender, receiver, 40)
+    assert success
+    assert _in_doubt() == 1
+    assert operations.get_balance(receiver) == 0
+
+    assert shards.recover_transfers()[0]
+    assert _in_doubt() == 0
+    assert operations.get_balance(sender) == 60 and operations.get_balance(receiver) == 40
+
+    # Recovery is idempotent: running it again credits nothing twice.
+    assert shards.recover_transfers()[0]
+    assert operations.get_balance(receiver) == 40
+    report = reconcile.reconcile(workers=1)
+    assert report["mismatches"] == [] and report["unpaired"] == []
+
+def test_transfer_to_a_vanished_receiver_is_reversed(sharded_bank, monkeypatch):
+    sender, receiver = _pair()
+    operations.deposit(sender, 100)
+
+    # The receiver's row disappears between prepare and finish.
+    prepare = shards._prepare
+    def prepare_then_drop(transfer_id, sender_acc, receiver_acc, amount):
+        result = prepare(transfer_id, sender_acc, receiver_acc, amount)
+        with database.connection(receiver_acc) as conn:
+            conn.execute("DELETE FROM users WHERE account_number = ?", (receiver_acc,))
+            conn.commit()
+        return result
+    monkeypatch.setattr(shards, "_prepare", prepare_then_drop)
+
+    success, msg = shards.transfer(sender, receiver, 40)
+    assert not success and "reversed" in msg
+    assert operations.get_balance(sender) == 100
+    with database.connection() as conn:
+        assert conn.execute("SELECT state, completed FROM transfer_log").fetchall() == [('REVERSED', 1)]
+
+def test_recovery_waits_while_the_engine_owns_balances(sharded_bank, monkeypatch):
+    sender, receiver = _pair()
+    operations.deposit(sender, 100)
+    monkeypatch.setattr(shards, "FINISH_RETRY_DELAY", 0)
+    with monkeypatch.context() as patch:
+        patch.setattr(shards, "_finish", lambda *args: 1 / 0)
+        assert shards.transfer(sender, receiver, 40)[0]
+
+    engine = operations.enable_ledger_engine(checkpoint_interval=3600)
+    success, msg = shards.recover_transfers()
+    assert not success and "ledger engine" in msg
+    assert engine.deposit(receiver, 5)[0]
+    operations.disable_ledger_engine()
+
+    # Settled once the engine has stopped, on top of what it checkpointed.
+    assert shards.recover_transfers()[0]
+    assert operations.get_balance(sender) == 60 and operations.get_balance(receiver) == 45
+    report = reconcile.reconcile(workers=1)
+    assert report["mismatches"] == [] and report["unpaired"] == []
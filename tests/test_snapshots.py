@@ -0,0 +1,37 @@
+import sqlite3
+import threading
+import pytest
+import auth
+import database
+import snapshots
+
+def test_retired_pool_closes_connections_as_they_come_back(bank):
+    pool = database.get_pool(str(bank / "other.db"))
+    held = pool.acquire()
+    idle = []
+    worker = threading.Thread(target=lambda: (idle.append(pool.acquire()), pool.release(idle[0])))
+    worker.start()
+    worker.join()
+    assert pool._idle == idle
+
+    database.close_all(str(bank))
+    with pytest.raises(sqlite3.ProgrammingError):
+        idle[0].execute("SELECT 1")
+    assert held.execute("SELECT 1").fetchone() == (1,)
+    pool.release(held)
+    with pytest.raises(sqlite3.ProgrammingError):
+        held.execute("SELECT 1")
+    assert pool._idle == [] and database.get_pool(str(bank / "other.db")) is not pool
+
+def test_pruning_a_snapshot_in_use_leaks_no_connection(bank):
+    auth.create_account("Owner", "1234")
+    assert snapshots.take_snapshot(keep=1)[0]
+    with snapshots.reporting() as name:
+        with database.connection() as conn:
+            for _ in range(3):
+                assert snapshots.take_snapshot(keep=1)[0]
+            # The snapshot being read was pruned, but the read goes on.
+            assert name not in snapshots.list_snapshots()
+            assert conn.execute("SELECT COUNT(*) FROM users").fetchone() == (1,)
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute("SELECT 1")
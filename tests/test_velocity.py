@@ -0,0 +1,44 @@
+import auth
+import operations
+import velocity
+
+RULES = [("withdrawals per hour", ("WITHDRAWAL",), 3600, 3, None),
+         ("withdrawn per hour", ("WITHDRAWAL",), 3600, None, 100.0)]
+
+def test_limits_count_and_amount(bank):
+    account = auth.create_account("Owner", "1234")
+    tracker = velocity.VelocityTracker(RULES, clock=lambda: 1_000_000.0)
+
+    assert tracker.reserve(account, "WITHDRAWAL", 60)[0]
+    allowed, msg, _ = tracker.reserve(account, "WITHDRAWAL", 50)
+    assert not allowed and "withdrawn per hour" in msg
+    assert tracker.reserve(account, "WITHDRAWAL", 10)[0]
+    assert tracker.reserve(account, "WITHDRAWAL", 10)[0]
+    allowed, msg, _ = tracker.reserve(account, "WITHDRAWAL", 1)
+    assert not allowed and "withdrawals per hour" in msg
+    assert [row[:2] for row in tracker.throttled()] == [(account, "withdrawals per hour")]
+
+def test_released_reservations_do_not_count(bank):
+    account = auth.create_account("Owner", "1234")
+    tracker = velocity.VelocityTracker(RULES, clock=lambda: 1_000_000.0)
+    _, _, token = tracker.reserve(account, "WITHDRAWAL", 90)
+    tracker.release(account, "WITHDRAWAL", 90, token)
+    assert tracker.usage(account) == [("withdrawals per hour", 0, 0.0), ("withdrawn per hour", 0, 0.0)]
+    assert tracker.reserve(account, "WITHDRAWAL", 90)[0]
+
+def test_non_finite_amounts_cannot_disable_limits(bank):
+    account = auth.create_account("Owner", "1234")
+    tracker = velocity.VelocityTracker(RULES, clock=lambda: 1_000_000.0)
+
+    for amount in (float("nan"), float("inf")):
+        assert tracker.reserve(account, "WITHDRAWAL", amount) == (False, "Amount must be a finite number.", None)
+    assert tracker.reserve(account, "WITHDRAWAL", 90)[0]
+    assert not tracker.reserve(account, "WITHDRAWAL", 20)[0]
+
+def test_failed_withdrawals_give_their_reservation_back(bank):
+    account = auth.create_account("Owner", "1234")
+    operations.deposit(account, 50)
+    tracker = operations.enable_velocity_limits(RULES, seed=False)
+    assert not operations.withdraw(account, 80)[0]    # insufficient funds
+    assert operations.withdraw(account, 40)[0]
+    assert tracker.usage(account)[1] == ("withdrawn per hour", 1, 40.0)
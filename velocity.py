@@ -0,0 +1,216 @@
+import json
+import math
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import database
+from database import connection
+
+# Per-account velocity limits on withdrawals and transfers
+# (operations.enable_velocity_limits()). Each rule caps the number of
+# postings and/or the amount moved per rolling window. Instead of summing
+# the ledger on every call, the tracker keeps one ring of BUCKETS buckets
+# (count, amount) per account and distinct (kinds, window) pair: checking a
+# rule sums at most BUCKETS slots. A ring always covers its whole window
+# plus the part of the current bucket already elapsed, so limits err on the
+# strict side by at most 1/BUCKETS of the window.
+#
+# A posting reserves its amount before it runs and gives it back if it
+# fails, so concurrent postings cannot slip past a limit together. At most
+# MAX_TRACKED_ACCOUNTS accounts are held, least recently used first out.
+# The service calls seed() to load the recent ledger at start-up; without
+# it (the CLI), or once an account has been evicted, an account's next
+# posting reads that account's recent rows.
+
+RULES_ENV = "BANK_VELOCITY_RULES"
+# (name, transaction types, window seconds, max postings, max amount);
+# None leaves that dimension unlimited.
+RULES = [
+    ("withdrawals per hour", ("WITHDRAWAL",), 3600, 10, None),
+    ("withdrawn per day", ("WITHDRAWAL",), 86400, None, 200000.0),
+    ("transferred per hour", ("TRANSFER_SENT",), 3600, 20, 100000.0),
+    ("transferred per day", ("TRANSFER_SENT",), 86400, None, 500000.0),
+]
+BUCKETS = 12
+MAX_TRACKED_ACCOUNTS = 50000
+MAX_THROTTLED = 1000
+
+IST = timezone(timedelta(hours=5, minutes=30))
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# HELPER FUNCTIONS
+
+def load_rules(path=None):
+    # Rules from the JSON file named by $BANK_VELOCITY_RULES (a list of
+    # {"name", "types", "window", "max_count", "max_amount"}), else RULES.
+    path = path or os.environ.get(RULES_ENV)
+    if not path:
+        return RULES
+    with open(path) as f:
+        return [(r["name"], tuple(r["types"]), int(r["window"]), r.get("max_count"), r.get("max_amount")) for r in json.load(f)]
+
+def _epoch(timestamp):
+    # Ledger timestamps are IST wall-clock strings.
+    return datetime.strptime(timestamp, TIME_FORMAT).replace(tzinfo=IST).timestamp()
+
+def _ist(epoch):
+    return datetime.fromtimestamp(epoch, IST).strftime(TIME_FORMAT)
+
+# TRACKER
+
+class VelocityTracker:
+    def __init__(self, rules=RULES, buckets=BUCKETS, max_accounts=MAX_TRACKED_ACCOUNTS, clock=time.time):
+        self.rules = [tuple(rule) for rule in rules]
+        self.buckets = buckets
+        self.max_accounts = max_accounts
+        self.clock = clock
+        # One ring per distinct (kinds, window); rules point at their ring.
+        self.windows = sorted({(kinds, window) for _, kinds, window, _, _ in self.rules}, key=lambda w: (w[1], w[0]))
+        self._ring_of = [self.windows.index((kinds, window)) for _, kinds, window, _, _ in self.rules]
+        self.kinds = sorted({kind for kinds, _ in self.windows for kind in kinds})
+        self.horizon = max((window for _, window in self.windows), default=0)
+        # account -> {ring index: array of [head bucket, count, amount, count, amount, ...]}
+        self._accounts = OrderedDict()
+        # Accounts are only known to be idle when never evicted since seed().
+        self._complete = False
+        # account -> [rule name, rejections, last rejected (epoch)]
+        self._throttled = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _width(self, ring):
+        return self.windows[ring][1] / self.buckets
+
+    def _advance(self, slots, ring, now):
+        # Moves the ring forward to the bucket of `now`, clearing the buckets
+        # skipped, and returns the ring's newest bucket.
+        bucket, head = int(now // self._width(ring)), int(slots[0])
+        if bucket <= head:
+            return head
+        for b in range(max(head + 1, bucket - self.buckets + 1), bucket + 1):
+            slot = 1 + 2 * (b % self.buckets)
+            slots[slot] = slots[slot + 1] = 0.0
+        slots[0] = bucket
+        return bucket
+
+    def _add(self, rings, kind, amount, when, sign=1):
+        for ring, (kinds, window) in enumerate(self.windows):
+            if kind not in kinds:
+                continue
+            slots = rings.get(ring)
+            if slots is None:
+                slots = rings[ring] = array("d", [0.0] * (1 + 2 * self.buckets))
+            head = self._advance(slots, ring, when)
+            bucket = int(when // self._width(ring))
+            if head - self.buckets < bucket <= head:
+                slot = 1 + 2 * (bucket % self.buckets)
+                slots[slot] += sign
+                slots[slot + 1] += sign * amount
+
+    def _track(self, account_number, rings):
+        self._accounts[account_number] = rings
+        self._accounts.move_to_end(account_number)
+        while len(self._accounts) > self.max_accounts:
+            self._accounts.popitem(last=False)
+            self._complete = False
+            self.evictions += 1
+
+    def _load(self, cursor, where, params, now):
+        cursor.execute(f"SELECT account_number, transaction_type, amount, timestamp FROM transactions "
+                       f"WHERE timestamp >= ? AND transaction_type IN ({', '.join('?' * len(self.kinds))}){where} ORDER BY timestamp",
+                       [_ist(now - self.horizon)] + self.kinds + params)
+        for account_number, kind, amount, timestamp in cursor:
+            rings = self._accounts.get(account_number)
+            if rings is None:
+                rings = {}
+                self._track(account_number, rings)
+            self._add(rings, kind, amount, _epoch(timestamp))
+
+    def seed(self):
+        # Loads every posting inside the longest window from all shards.
+        now = self.clock()
+        with self._lock:
+            self._accounts.clear()
+            self._complete = True
+            for shard in range(database.shard_count()):
+                with connection(shard=shard) as conn:
+                    self._load(conn.cursor(), "", [], now)
+            return len(self._accounts)
+
+    def _rings(self, account_number, now):
+        rings = self._accounts.get(account_number)
+        if rings is not None:
+            self._accounts.move_to_end(account_number)
+            return rings
+        rings = {}
+        self._track(account_number, rings)
+        if not self._complete:
+            with connection(account_number) as conn:
+                self._load(conn.cursor(), " AND account_number = ?", [account_number], now)
+        return rings
+
+    def reserve(self, account_number, kind, amount):
+        # (allowed, message, token); the token undoes the reservation via release().
+        # A NaN amount would turn the ring's sums, and so its limits, into NaN for good.
+        if not math.isfinite(amount):
+            return False, "Amount must be a finite number.", None
+        now = self.clock()
+        with self._lock:
+            rings = self._rings(account_number, now)
+            for rule, ring in zip(self.rules, self._ring_of):
+                name, kinds, window, max_count, max_amount = rule
+                if kind not in kinds:
+                    continue
+                count = total = 0.0
+                slots = rings.get(ring)
+                if slots is not None:
+                    self._advance(slots, ring, now)
+                    count, total = sum(slots[1::2]), sum(slots[2::2])
+                if (max_count is not None and count + 1 > max_count) or (max_amount is not None and total + amount > max_amount + 0.005):
+                    self._throttle(account_number, name, now)
+                    limit = f"{max_count} postings" if max_count is not None and count + 1 > max_count else f"₹ {max_amount:.2f}"
+                    return False, f"Limit reached: {name} ({limit}). Please try again later.", None
+            self._add(rings, kind, amount, now)
+            return True, None, now
+
+    def release(self, account_number, kind, amount, token):
+        with self._lock:
+            rings = self._accounts.get(account_number)
+            if rings is not None:
+                self._add(rings, kind, amount, token, sign=-1)
+
+    def _throttle(self, account_number, name, now):
+        entry = self._throttled.pop(account_number, None) or [name, 0, now]
+        entry[0], entry[1], entry[2] = name, entry[1] + 1, now
+        self._throttled[account_number] = entry
+        if len(self._throttled) > MAX_THROTTLED:
+            self._throttled.popitem(last=False)
+
+    def usage(self, account_number):
+        # [(rule name, postings, amount)] of one account in each rule's window.
+        now = self.clock()
+        with self._lock:
+            rings = self._rings(account_number, now)
+            usage = []
+            for (name, *_), ring in zip(self.rules, self._ring_of):
+                slots = rings.get(ring)
+                if slots is not None:
+                    self._advance(slots, ring, now)
+                usage.append((name, int(sum(slots[1::2])) if slots else 0, sum(slots[2::2]) if slots else 0.0))
+            return usage
+
+    def throttled(self):
+        # [(account, rule, rejections, last rejected IST)] for accounts
+        # refused within the longest window, most recent first.
+        now = self.clock()
+        with self._lock:
+            return [(account_number, name, rejections, _ist(at)) for account_number, (name, rejections, at) in reversed(self._throttled.items())
+                    if at >= now - self.horizon]
+
+    def stats(self):
+        with self._lock:
+            return {"accounts": len(self._accounts), "max_accounts": self.max_accounts, "evictions": self.evictions,
+                    "throttled": len(self._throttled), "rules": len(self.rules), "buckets": self.buckets}